@@ -7,4 +7,5 @@ import exchangedata
 import clock
 import order
 import betlog
+import metrics
 
@@ -4,8 +4,43 @@
 #
 # Logging framework for betman library/application
 
+"""Logging for betman.
+
+Everything logs to the logger 'betman' or one of its children, e.g.
+'betman.multi' for core/multi.py (get_logger('multi') returns this).
+The level of each can be set separately in const.LOGLEVELS, so that
+the debug output of the modules we call every tick can be turned on
+and off without touching the rest.
+
+Since a lot of this is on the hot path of the engine, we try not to
+slow the tick down:
+
+(i) messages are only formatted if they will be logged, i.e.
+
+    log.debug('orders {0}', olist)
+
+costs a level check and nothing else if debug is off for the module
+(which is not true of log.debug('orders {0}'.format(olist)) or print
+olist).
+
+(ii) nothing is written on the calling thread.  Records go on a queue
+and a writer thread passes them on to the file and stdout handlers.
+Note we do format the message (but not the rest of the line, e.g. the
+time) before putting it on the queue, since the arguments (e.g. a
+list of orders) may well have changed by the time the writer gets to
+it.  If the queue is full, logging blocks until the writer catches up
+(as for the SelectionWriter in database/database.py), so we never
+build up an unbounded backlog of records in memory.
+
+"""
+
+import os
 import sys
+import atexit
 import logging
+from logging import DEBUG, INFO, WARNING, ERROR
+from threading import Thread
+from Queue import Queue
 import const
 
 # recall the default logging priorities are
@@ -22,6 +57,134 @@ import const
 betlog = logging.getLogger('betman')
 betlog.setLevel(logging.DEBUG) # ignore anything below DEBUG
 
+class _Message(object):
+    """Message formatted with str.format when (if) it is logged."""
+
+    __slots__ = ('msg', 'args', 'kwargs')
+
+    def __init__(self, msg, args, kwargs):
+        self.msg = msg
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        if self.args or self.kwargs:
+            return self.msg.format(*self.args, **self.kwargs)
+        return str(self.msg)
+
+class Log(object):
+    """Logger for a single module.
+
+    The methods take a message and arguments for str.format, e.g.
+    log.info('placed {0} orders', n), and do nothing at all unless
+    the level is enabled for the module.
+
+    """
+
+    def __init__(self, name):
+        self.logger = logging.getLogger('betman.{0}'.format(name))
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, msg, args, kwargs):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, _Message(msg, args, kwargs))
+
+    def debug(self, msg, *args, **kwargs):
+        self._log(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self._log(logging.ERROR, msg, args, kwargs)
+
+def get_logger(name):
+    """Return Log for module name (the logger betman.name)."""
+
+    return Log(name)
+
+def set_levels(levels):
+    """Set levels of loggers from dict levels, e.g. {'multi': 'DEBUG'}.
+
+    Keys are names of the loggers (either 'betman' or the part after
+    'betman.'), values are level names or numbers.
+
+    """
+
+    for name, level in levels.items():
+        if name != 'betman':
+            name = 'betman.{0}'.format(name)
+        if isinstance(level, basestring):
+            level = logging.getLevelName(level.upper())
+        logging.getLogger(name).setLevel(level)
+
+# for formatting tracebacks
+_EXCFORMAT = logging.Formatter()
+
+class _QueueHandler(logging.Handler):
+    """Handler that puts records on the queue of the writer thread."""
+
+    def __init__(self, writer):
+        logging.Handler.__init__(self)
+        self.writer = writer
+
+    def emit(self, record):
+        try:
+            # format the message now (see module docstring), and any
+            # traceback, which we won't have once we leave the
+            # except block that logged it.
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = _EXCFORMAT.formatException(record.exc_info)
+                record.exc_info = None
+            self.writer.put(record)
+        except Exception:
+            self.handleError(record)
+
+class _Writer(object):
+    """Writer thread, passing records from the queue to handlers."""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self._start()
+
+        # write anything still on the queue when the app exits
+        atexit.register(self.flush)
+
+    def _start(self):
+        self.queue = Queue(const.LOGQUEUE)
+        # a process forked from this one (e.g. by multiprocessing)
+        # gets a copy of the queue but not the thread, so it needs a
+        # writer of its own.
+        self.pid = os.getpid()
+        t = Thread(target = self._run, args = (self.queue,))
+        t.setDaemon(True)
+        t.start()
+
+    def put(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put(record)
+
+    def flush(self):
+        """Block until everything queued has been written."""
+
+        self.queue.join()
+
+    def _run(self, queue):
+        while True:
+            record = queue.get()
+            for h in self.handlers:
+                if record.levelno >= h.level:
+                    h.handle(record)
+            queue.task_done()
+
 def _logfile_name():
     import time
     t = time.gmtime()
@@ -42,27 +205,36 @@ def _add_handlers():
     fh = logging.FileHandler('{0}apicall{1}.log'.format(const.LOGDIR,
                                                         lbasename))
     fh.setLevel(logging.INFO)
-
     fh.setFormatter(frmt)
-    # add the Handler to the logger
-    betlog.addHandler(fh)
 
     # add a file handler for everything else
     fh2 = logging.FileHandler('{0}allinfo{1}.log'.format(const.LOGDIR,
                                                          lbasename))
     fh2.setLevel(logging.DEBUG)
     fh2.setFormatter(frmt)
-    # add the Handler to the logger
-    betlog.addHandler(fh2)
+
+    handlers = [fh, fh2]
 
     # output everything to stdout
-    ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(logging.DEBUG)
-    ch.setFormatter(frmt)
-    betlog.addHandler(ch)
+    if const.DEBUG:
+        ch = logging.StreamHandler(sys.stdout)
+        ch.setLevel(logging.DEBUG)
+        ch.setFormatter(frmt)
+        handlers.append(ch)
+
+    # the handlers are only ever called from the writer thread
+    writer = _Writer(handlers)
+    betlog.addHandler(_QueueHandler(writer))
+    return writer
 
 if not betlog.handlers:
-    _add_handlers()
+    _writer = _add_handlers()
+    set_levels(const.LOGLEVELS)
+
+def flush():
+    """Block until everything logged so far has been written."""
+
+    _writer.flush()
 
 # You can now start issuing logging statements in your code
 #lgr.debug('debug message') # This won't print to myapp.log
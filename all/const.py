@@ -42,12 +42,76 @@ BFPASS = 'Bamb0[]zle'
 # path to database
 MASTERDB = '{0}/database/masterdb.db'.format(_RPATH)
 
+# path to columnar archive of historical prices (see
+# database/archive.py), and whether to write to it alongside the
+# histselections table.
+ARCHIVEDIR = '{0}/database/archive/'.format(_RPATH)
+WRITEARCHIVE = True
+
+# baseline results of the tick benchmark (see backtest/benchtick.py)
+BENCHFILE = '{0}/backtest/benchtick.json'.format(_RPATH)
+
 # path to log files
 LOGDIR = '{0}/logs/'.format(_RPATH)
 
+# logging (see all/betlog.py).  Levels are by logger name: each
+# module logs to betman.<module name>, and any logger not listed here
+# takes the level of betman.  The debug output of the modules we call
+# every tick (order lists, URLs etc.) is off by default, since writing
+# it slows the tick down.
+LOGLEVELS = {'betman': 'DEBUG',
+             'engine': 'INFO',
+             'multi': 'INFO',
+             'managers': 'INFO',
+             'orderstore': 'INFO',
+             'mmstrategy': 'INFO',
+             'bdaqnonapiparse': 'INFO',
+             'bfnonapiparse': 'INFO',
+             'bfnonapimethod': 'INFO',
+             'bfapimethod': 'INFO',
+             'bfapiparse': 'INFO',
+             'bdaqapiparse': 'INFO',
+             'apimethod': 'INFO',
+             'database': 'INFO'}
+# maximum number of log records waiting to be written
+LOGQUEUE = 10000
+
+# metrics of the engine (see all/metrics.py): the file we write them
+# to, how often (in ticks) we write it, and the port we serve them on
+# over HTTP (None for not at all).  The server only listens on
+# METRICSHOST, which is the local machine unless changed (the metrics
+# shouldn't be visible to the world).
+METRICSFILE = '{0}metrics.prom'.format(LOGDIR)
+METRICSTICKS = 50
+METRICSPORT = None
+METRICSHOST = '127.0.0.1'
+
+# HTTP settings for the non-API (screen scraping) clients: maximum
+# number of idle keep-alive connections we hold per host, timeout in
+# seconds for each request, and whether to ask for gzipped responses.
+HTTPPOOLSIZE = 8
+HTTPTIMEOUT = 10
+HTTPGZIP = True
+
+# number of market ids the non-API price methods ask for in a single
+# request to begin with, the amount we grow this by after each
+# successful request, and the most we will ever ask for (see
+# ChunkedNonApiMethod in api/apimethod.py).
+NAPICHUNK = 50
+NAPICHUNKSTEP = 10
+NAPICHUNKMAX = 200
+
 # write to database after results of every API call?
 WRITEDB = False
 
+# length of each tick of the engine in seconds; strategy update
+# frequencies (in ticks) are converted to seconds using this.
+TICKLENGTH = 1.2
+
+# number of visited states each strategy remembers (see StateMachine
+# in strategy/strategy.py).
+STATEHISTORY = 500
+
 # exchange ids of BDAQ and BF
 BDAQID = 1
 BFID = 2
@@ -4,6 +4,7 @@
 
 """Event, Market and Selection objects"""
 
+from array import array
 import const
 import exchangedata
 
@@ -60,19 +61,62 @@ class Market(object):
     def __str__(self):
         return self.__repr__()
 
+# the prices of a selection are stored in a single array of 4*depth
+# doubles: the back (price, volume) pairs, best price first, then the
+# lay (price, volume) pairs.  The depth is const.NUMPRICES unless we
+# only asked for the best few prices (see Strategy.get_price_depth).
+# A missing price (and its volume) is stored as _NOPRICE.
+_NOPRICE = 0.0
+_NSIDE = 2 * const.NUMPRICES
+
+# padding for one side of the book
+_PAD = [_NOPRICE] * _NSIDE
+
+def _flatten(prices, nside=_NSIDE):
+    """
+    Return list [p1, v1, p2, v2, ...] of length nside from list of
+    (price, volume) pairs.  Prices beyond nside/2 are ignored.
+    """
+
+    flat = [x for pv in prices for x in pv]
+    n = len(flat)
+    if n >= nside:
+        return flat[:nside]
+    return flat + _PAD[n:nside]
+
+def _flatten_missing(prices, nside=_NSIDE):
+    """As _flatten, but allowing for (None, None) pairs in prices."""
+
+    flat = []
+    for (p, v) in prices[:nside // 2]:
+        if p is None:
+            break
+        flat.append(p)
+        flat.append(v or 0.0)
+    return flat + _PAD[len(flat):nside]
+
 class Selection(object):
-    """A selection."""
+    """A selection.
+
+    We create thousands of these every tick, so the class has fixed
+    slots, and the prices are held in a single array (see _NOPRICE)
+    rather than lists of tuples.  Note any extra information from the
+    API passed as keyword arguments is not stored.
+
+    """
+
+    __slots__ = ('exid', 'name', 'id', 'mid', 'matchedback', 'matchedlay',
+                 'lastmatched', 'lastmatchedprice', 'lastmatchedamount',
+                 'src', 'wsn', 'dorder', 'tstamp', '_prices')
     
     def __init__(self, exid, name, myid, marketid, mback, mlay,
                  lastmatched, lastmatchedprice, lastmatchedamount,
                  backprices, layprices, src=None, wsn=None, dorder=None,
-                 tstamp = None, **kwargs):
+                 tstamp = None, depth = const.NUMPRICES, **kwargs):
 
         self.exid = exid
 
-        # convert name to ascii string and ignore any funky unicode
-        # characters.
-        self._uname = name
+        # convert name to utf8 encoded string.
         self.name = name.encode('utf8')
 
         self.id = myid # selection id
@@ -94,46 +138,141 @@ class Selection(object):
         # timestamp 
         self.tstamp = tstamp
 
-        # list of prices and stakes [(p1,s1), (p2,s2) ...,]
-        self.backprices = backprices
-        self.layprices = layprices
+        # we only keep the best depth prices on each side.
+        nside = 2 * depth
+        try:
+            self._prices = array('d', _flatten(backprices, nside) +
+                                 _flatten(layprices, nside))
+        except TypeError:
+            # some API parsing functions give us (None, None) when
+            # there are no prices.
+            self._prices = array('d', _flatten_missing(backprices, nside) +
+                                 _flatten_missing(layprices, nside))
+
+    @classmethod
+    def from_flat(cls, exid, name, myid, marketid, prices, src=None,
+                  wsn=None):
+        """
+        Return Selection with prices given as a flat list [bp1, bv1,
+        ..., lp1, lv1, ...] of length 4*depth, laid out as in the
+        _prices array.  This is for parsers that can build the
+        list directly, and skips the (price, volume) pairs.  Note name
+        should already be a utf8 encoded string.
+        """
 
-        # paded back and lay prices to const.NUMPRICES
-        self.padback = self.pad_prices(backprices, const.NUMPRICES)
-        self.padlay = self.pad_prices(layprices, const.NUMPRICES)
+        sel = cls.__new__(cls)
+        sel.exid = exid
+        sel.name = name
+        sel.id = myid
+        sel.mid = marketid
+        sel.matchedback = sel.matchedlay = sel.lastmatched = None
+        sel.lastmatchedprice = sel.lastmatchedamount = None
+        sel.src = src
+        sel.wsn = wsn
+        sel.dorder = sel.tstamp = None
+        sel._prices = array('d', prices)
+        return sel
 
-        # store all data from API
-        self.properties = kwargs
+    @property
+    def depth(self):
+        """Number of prices we hold on each side of the book."""
+
+        return len(self._prices) >> 2
 
-    def pad_prices(self, prices, num):
+    def _get_pairs(self, lay, pad):
+        """Return list of (price, volume) pairs for one side of the book.
+
+        If pad is True, missing prices are (None, None) and the list
+        has length const.NUMPRICES, otherwise they are left out.
+
+        """
+
+        a = self._prices
+        nside = len(a) >> 1
+        start = nside if lay else 0
+        pairs = []
+        for i in xrange(start, start + nside, 2):
+            if a[i] != _NOPRICE:
+                pairs.append((a[i], a[i + 1]))
+            elif pad:
+                pairs.append((None, None))
+        if pad and (nside < _NSIDE):
+            pairs.extend([(None, None)] * ((_NSIDE - nside) >> 1))
+        return pairs
+
+    @property
+    def _uname(self):
+        return self.name.decode('utf8')
+
+    # list of prices and stakes [(p1,s1), (p2,s2) ...,]
+    @property
+    def backprices(self):
+        return self._get_pairs(False, False)
+
+    @property
+    def layprices(self):
+        return self._get_pairs(True, False)
+
+    # back and lay prices padded with (None, None) to const.NUMPRICES
+    @property
+    def padback(self):
+        return self._get_pairs(False, True)
+
+    @property
+    def padlay(self):
+        return self._get_pairs(True, True)
+
+    def get_flat_prices(self, missing=None):
         """
-        Pad prices so that if have fewer than num back or lay prices.
+        Return list [bp1, bv1, bp2, bv2, ..., lp1, lv1, ...] of all
+        the back then lay prices and volumes (of length
+        4*const.NUMPRICES), with missing prices and volumes replaced
+        by missing.
         """
 
-        nprices = len(prices)
-        if nprices == num:
-            return prices
-        # pad prices with None
-        app = [(None, None)] * (num - nprices)
-        return prices + app
+        a = self._prices.tolist()
+        for i in xrange(0, len(a), 2):
+            if a[i] == _NOPRICE:
+                a[i] = a[i + 1] = missing
+        nside = len(a) >> 1
+        if nside < _NSIDE:
+            # we hold fewer than const.NUMPRICES prices
+            pad = [missing] * (_NSIDE - nside)
+            a = a[:nside] + pad + a[nside:] + pad
+        return a
+
+    def same_prices(self, other):
+        """Return True if other has exactly the same prices and volumes."""
+
+        return self._prices == other._prices
+
+    def __getstate__(self):
+        return [getattr(self, k, None) for k in self.__slots__]
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
 
     def best_back(self):
         """Return best back price, or 1.0 if no price."""
         
-        if self.padback[0][0] is None:
+        p = self._prices[0]
+        if p == _NOPRICE:
             # this is 1.0
             return exchangedata.MINODDS
 
-        return self.padback[0][0]
+        return p
 
     def best_lay(self):
         """Return best lay price, or 1000.0 if no price."""
         
-        if self.padlay[0][0] is None:
+        a = self._prices
+        p = a[len(a) >> 1]
+        if p == _NOPRICE:
             # best lay is 1.01
             return exchangedata.MAXODDS
 
-        return self.padlay[0][0]
+        return p
 
     def make_best_lay(self):
         """
@@ -5,8 +5,10 @@
 # Some information for the exchanges, including odds ladders and
 # useful functions for these.
 
-import math
+import numpy as np
+from bisect import bisect_left, bisect_right
 import const
+from betexception import DataError
 
 # same for both BDAQ and BF
 MINODDS = 1.0
@@ -48,216 +50,206 @@ MINODDSPLUS1 = 1.01
 # The odds increment on Asian Handicap markets is 0.01 for all odds
 # ranges.
 
+# the tables above as (from, to, increment), in hundredths so that
+# the ladders below are exact.
+_INCREMENTS = {const.BDAQID: [(100, 300, 1),
+                              (300, 400, 5),
+                              (400, 600, 10),
+                              (600, 1000, 20),
+                              (1000, 2000, 50),
+                              (2000, 5000, 100),
+                              (5000, 20000, 200),
+                              (20000, 100000, 500)],
+               const.BFID: [(100, 200, 1),
+                            (200, 300, 2),
+                            (300, 400, 5),
+                            (400, 600, 10),
+                            (600, 1000, 20),
+                            (1000, 2000, 50),
+                            (2000, 3000, 100),
+                            (3000, 5000, 200),
+                            (5000, 10000, 500),
+                            (10000, 100000, 1000)]}
+
+# prices within this of a valid price are taken to be that price
+# (prices from the APIs and from arithmetic on them need not be
+# exact).
+_EPS = 0.000001
+
+def _make_ladder(increments):
+    """Return sorted list of all valid odds (MINODDSPLUS1 to MAXODDS)."""
+
+    hundredths = []
+    for (start, end, inc) in increments:
+        hundredths.extend(range(start + inc, end + 1, inc))
+    # note round gives the same float as e.g. float('3.05'), which
+    # is what we get from the APIs.
+    return [round(h / 100.0, 2) for h in hundredths]
+
+# the odds ladders (every valid price, shortest first) for each
+# exchange, as a list (for bisect) and as a NumPy array (for the
+# _array functions).
+LADDERS = {exid: _make_ladder(incs) for exid, incs in _INCREMENTS.items()}
+_NPLADDERS = {exid: np.array(l) for exid, l in LADDERS.items()}
+
+_EXIDERR = 'exid must be either {0} or {1}'.format(const.BDAQID, const.BFID)
+
 def next_shorter_odds(exid, odds):
-    """Return odds one shorter (i.e. less in decimal) than odds."""
-
-    if exid == const.BDAQID:
-        # use BDAQ betting increments
-        if odds <= 3:
-            return odds - 0.01
-        elif odds <= 4:
-            return odds - 0.05
-        elif odds <= 6:
-            return odds - 0.1
-        elif odds <= 10:
-            return odds - 0.2
-        elif odds <= 20:
-            return odds - 0.5
-        elif odds <= 50:
-            return odds - 1
-        elif odds <= 200:
-            return odds - 2
-        elif odds <= 1000:
-            return odds - 5
-        else:
-            return MAXODDS
-
-    elif exid == const.BFID:
-        # use BF betting increments
-        if odds <= 2 :
-            return odds - 0.01
-        elif odds <= 3:
-            return odds - 0.02
-        elif odds <= 4:
-            return odds - 0.05        
-        elif odds <= 6:
-            return odds - 0.1
-        elif odds <= 10:
-            return odds - 0.2
-        elif odds <= 20:
-            return odds - 0.5
-        elif odds <= 30:
-            return odds - 1
-        elif odds <= 50:
-            return odds - 2
-        elif odds <= 100:
-            return odds - 5
-        elif odds <= 1000:
-            return odds - 10
-        else:
-            return MAXODDS
-
-    else:
-        raise DataError, 'exid must be either {0} or {1}'\
-              .format(const,BDAQID, const.BFID)
+    """Return odds one shorter (i.e. less in decimal) than odds.
+
+    If there are no shorter odds, return MINODDS, and if odds are
+    longer than MAXODDS, return MAXODDS.
+
+    """
+
+    try:
+        ladder = LADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    if odds > MAXODDS + _EPS:
+        return MAXODDS
+    i = bisect_left(ladder, odds - _EPS)
+    if i == 0:
+        return MINODDS
+    return ladder[i - 1]
 
 def next_longer_odds(exid, odds):
-    """Return odds one longer (i.e. greater in decimal) than odds."""
-
-    if exid == const.BDAQID:
-        # use BDAQ betting increments
-        if odds < 3 :
-            return odds + 0.01
-        elif odds < 4:
-            return odds + 0.05
-        elif odds < 6:
-            return odds + 0.1
-        elif odds < 10:
-            return odds + 0.2
-        elif odds < 20:
-            return odds + 0.5
-        elif odds < 50:
-            return odds + 1
-        elif odds < 200:
-            return odds + 2
-        elif odds < 1000:
-            return odds + 5
-        else:
-            return MAXODDS
-
-    elif exid == const.BFID:
-        # use BF betting increments
-        if odds < 2 :
-            return odds + 0.01
-        elif odds < 3:
-            return odds + 0.02
-        elif odds < 4:
-            return odds + 0.05        
-        elif odds < 6:
-            return odds + 0.1
-        elif odds < 10:
-            return odds + 0.2
-        elif odds < 20:
-            return odds + 0.5
-        elif odds < 30:
-            return odds + 1
-        elif odds < 50:
-            return odds + 2
-        elif odds < 100:
-            return odds + 5
-        elif odds < 1000:
-            return odds + 10
-        else:
-            return MAXODDS
-
-    else:
-        raise DataError, 'exid must be either {0} or {1}'\
-              .format(const,BDAQID, const.BFID)
+    """Return odds one longer (i.e. greater in decimal) than odds.
+
+    If there are no longer odds, return MAXODDS.
+
+    """
+
+    try:
+        ladder = LADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    i = bisect_right(ladder, odds + _EPS)
+    if i == len(ladder):
+        return MAXODDS
+    return ladder[i]
 
 def closest_longer_odds(exid, odds):
     """Return closest valid odds on exid that are equal to or longer
     (i.e. greater in decimal) than odds passed."""
 
-    if odds < MINODDS:
+    try:
+        ladder = LADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    if odds <= MINODDS + _EPS:
         return MINODDS
-    elif odds >= MAXODDS:
+    i = bisect_left(ladder, odds - _EPS)
+    if i == len(ladder):
         return MAXODDS
-
-    # first get odds to two decimal places ROUNDED UP
-    rodds = math.ceil(odds*100) / 100
-
-    if exid == const.BDAQID:
-        # use BDAQ betting increments
-        if odds < 3 :
-            return rodds
-        elif odds < 4:
-            return math.ceil(rodds/0.05)*0.05
-        elif odds < 6:
-            return math.ceil(rodds/0.1)*0.1
-        elif odds < 10:
-            return math.ceil(rodds/0.2)*0.2            
-        elif odds < 20:
-            return math.ceil(rodds/0.5)*0.5            
-        elif odds < 50:
-            return math.ceil(rodds/1.0)*1.0
-        elif odds < 200:
-            return math.ceil(rodds/2.0)*2.0            
-        elif odds < 1000:
-            return math.ceil(rodds/5.0)*5.0            
-
-    elif exid == const.BFID:
-        # use BF betting increments
-        if odds < 2 :
-            return rodds
-        elif odds < 3:
-            return math.ceil(rodds/0.02)*0.02
-        elif odds < 4:
-            return math.ceil(rodds/0.05)*0.05
-        elif odds < 6:
-            return math.ceil(rodds/0.1)*0.1
-        elif odds < 10:
-            return math.ceil(rodds/0.2)*0.2
-        elif odds < 20:
-            return math.ceil(rodds/0.5)*0.5
-        elif odds < 30:
-            return math.ceil(rodds/1.0)*1.0
-        elif odds < 50:
-            return math.ceil(rodds/2.0)*2.0
-        elif odds < 100:
-            return math.ceil(rodds/5.0)*5.0
-        elif odds < 1000:
-            return math.ceil(rodds/10.0)*10.0
+    return ladder[i]
 
 def closest_shorter_odds(exid, odds):
     """Return closest valid odds on exid that are equal to or shorter
     (i.e. smaller in decimal) than odds passed."""
 
-    if odds <= MINODDS:
-        return MINODDS
-    elif odds > MAXODDS:
+    try:
+        ladder = LADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    if odds > MAXODDS + _EPS:
         return MAXODDS
-    
-    # first get odds to two decimal places ROUNDED DOWN
-    rodds = math.floor(odds*100) / 100
-    
-    if exid == const.BDAQID:
-        # use BDAQ betting increments
-        if odds <= 3 :
-            return rodds
-        elif odds <= 4:
-            return math.floor(rodds/0.05)*0.05
-        elif odds <= 6:
-            return math.floor(rodds/0.1)*0.1
-        elif odds <= 10:
-            return math.floor(rodds/0.2)*0.2            
-        elif odds <= 20:
-            return math.floor(rodds/0.5)*0.5            
-        elif odds <= 50:
-            return math.floor(rodds/1.0)*1.0
-        elif odds <= 200:
-            return math.floor(rodds/2.0)*2.0            
-        elif odds <= 1000:
-            return math.floor(rodds/5.0)*5.0            
-
-    elif exid == const.BFID:
-        # use BF betting increments
-        if odds <= 2 :
-            return rodds
-        elif odds <= 3:
-            return math.floor(rodds/0.02)*0.02
-        elif odds <= 4:
-            return math.floor(rodds/0.05)*0.05
-        elif odds <= 6:
-            return math.floor(rodds/0.1)*0.1
-        elif odds <= 10:
-            return math.floor(rodds/0.2)*0.2
-        elif odds <= 20:
-            return math.floor(rodds/0.5)*0.5
-        elif odds <= 30:
-            return math.floor(rodds/1.0)*1.0
-        elif odds <= 50:
-            return math.floor(rodds/2.0)*2.0
-        elif odds <= 100:
-            return math.floor(rodds/5.0)*5.0
-        elif odds <= 1000:
-            return math.floor(rodds/10.0)*10.0
+    i = bisect_right(ladder, odds + _EPS)
+    if i == 0:
+        return MINODDS
+    return ladder[i - 1]
+
+def tick_index(exid, odds):
+    """Return position on the odds ladder of exid of odds.
+
+    Odds that are not valid are first moved to the closest longer
+    valid odds (see closest_longer_odds).  MINODDSPLUS1 has index 0.
+
+    """
+
+    try:
+        ladder = LADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    return min(bisect_left(ladder, odds - _EPS), len(ladder) - 1)
+
+def ticks_between(exid, odds1, odds2):
+    """Return number of ticks from odds1 to odds2 on exid.
+
+    This is positive if odds2 are longer than odds1, e.g. on BF
+    ticks_between(const.BFID, 1.98, 2.02) is 3.
+
+    """
+
+    return tick_index(exid, odds2) - tick_index(exid, odds1)
+
+def offset(exid, odds, n):
+    """Return odds n ticks longer (shorter if n < 0) than odds on exid.
+
+    The result is limited to be between MINODDSPLUS1 and MAXODDS.
+
+    """
+
+    try:
+        ladder = LADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    i = tick_index(exid, odds) + n
+    return ladder[min(max(i, 0), len(ladder) - 1)]
+
+# NumPy versions of the above, for arrays of odds.  NaN odds (no
+# price) give NaN, except for the tick index, which is an integer
+# array (and gives the index of MAXODDS for NaN odds).
+
+def closest_longer_odds_array(exid, odds):
+    """Array version of closest_longer_odds."""
+
+    try:
+        ladder = _NPLADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    odds = np.asarray(odds, dtype=float)
+    i = np.minimum(np.searchsorted(ladder, odds - _EPS), len(ladder) - 1)
+    with np.errstate(invalid='ignore'):
+        res = np.where(odds <= MINODDS + _EPS, MINODDS, ladder[i])
+    return np.where(np.isnan(odds), np.nan, res)
+
+def closest_shorter_odds_array(exid, odds):
+    """Array version of closest_shorter_odds."""
+
+    try:
+        ladder = _NPLADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    odds = np.asarray(odds, dtype=float)
+    i = np.searchsorted(ladder, odds + _EPS, 'right') - 1
+    res = np.where(i < 0, MINODDS, ladder[np.maximum(i, 0)])
+    with np.errstate(invalid='ignore'):
+        res = np.where(odds > MAXODDS + _EPS, MAXODDS, res)
+    return np.where(np.isnan(odds), np.nan, res)
+
+def tick_index_array(exid, odds):
+    """Array version of tick_index."""
+
+    try:
+        ladder = _NPLADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    odds = np.asarray(odds, dtype=float)
+    return np.minimum(np.searchsorted(ladder, odds - _EPS), len(ladder) - 1)
+
+def ticks_between_array(exid, odds1, odds2):
+    """Array version of ticks_between."""
+
+    return tick_index_array(exid, odds2) - tick_index_array(exid, odds1)
+
+def offset_array(exid, odds, n):
+    """Array version of offset (n can also be an array)."""
+
+    try:
+        ladder = _NPLADDERS[exid]
+    except KeyError:
+        raise DataError, _EXIDERR
+    odds = np.asarray(odds, dtype=float)
+    i = np.clip(tick_index_array(exid, odds) + n, 0, len(ladder) - 1)
+    return np.where(np.isnan(odds), np.nan, ladder[i])
@@ -0,0 +1,269 @@
+# metrics.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Counters and timing histograms for the hot paths of the engine.
+
+Metrics are kept in a single registry, and are identified by name
+and labels, e.g. the time of each API call is the histogram
+'api_seconds' with label method (the name of the API method class).
+What we measure is:
+
+tick_seconds     - each phase of the tick (label phase, see
+                   Engine.tick)
+api_seconds      - each API call (label method); the _count of this
+                   is the number of calls
+api_errors_total - API calls that raised (labels method and error)
+db_seconds       - each database write (label op)
+state_seconds    - each StateMachine.update of a strategy
+orders_total     - orders sent to the exchanges (labels exchange and
+                   action, one of place, update or cancel)
+pool_wait_seconds - time API calls wait for a thread of the pool
+                   (label exchange, see multi.Pool)
+
+The engine writes everything to const.METRICSFILE every
+const.METRICSTICKS ticks in the Prometheus text format (e.g. for the
+textfile collector of the node exporter), and if const.METRICSPORT
+is not None, serves the same text over HTTP at /metrics (on
+const.METRICSHOST only).
+
+Since these are updated thousands of times a tick, we keep them
+cheap: a histogram has fixed buckets, so observing a time is a
+bisect and two additions, and nothing is formatted until we export.
+Create the metrics once (e.g. at module level) and keep a reference,
+rather than looking them up by name on every update.
+
+"""
+
+import BaseHTTPServer
+import bisect
+import os
+import threading
+import time
+
+# all metric names start with this
+_PREFIX = 'betman_'
+
+# upper bounds of the histogram buckets in seconds; there is also a
+# last bucket with no upper bound.
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the clock we time things with
+clock = time.time
+
+def _label_str(labels, extra=()):
+    items = ['{0}="{1}"'.format(k, v) for (k, v) in labels + extra]
+    return '{' + ','.join(items) + '}' if items else ''
+
+class Counter(object):
+    """A count of things that have happened."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def lines(self, name):
+        return ['{0}{1} {2}'.format(name, _label_str(self.labels),
+                                    self.value)]
+
+class _Timer(object):
+    """Context manager that observes the time spent inside it."""
+
+    __slots__ = ('hist', 't0')
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, etype, evalue, tb):
+        self.hist.observe(clock() - self.t0)
+
+class Histogram(object):
+    """Distribution of times (or any other values) observed."""
+
+    def __init__(self, labels, bounds=BUCKETS):
+        self.labels = labels
+        self.bounds = bounds
+        # counts[i] is the number of values at most bounds[i], and
+        # more than bounds[i - 1]; the last is for anything bigger.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """Return context manager timing the code inside it."""
+
+        return _Timer(self)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """
+        Return estimate of quantile q (between 0 and 1) of the values
+        observed, i.e. the upper bound of the bucket it is in.
+        """
+
+        n = self.count
+        if not n:
+            return None
+        cum = 0
+        for i, c in enumerate(self.counts):
+            cum += c
+            if cum >= q * n:
+                break
+        return self.bounds[i] if i < len(self.bounds) else float('inf')
+
+    def lines(self, name):
+        lines = []
+        cum = 0
+        for b, c in zip(self.bounds + ('+Inf',), self.counts):
+            cum += c
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _label_str(self.labels, (('le', b),)), cum))
+        lstr = _label_str(self.labels)
+        lines.append('{0}_sum{1} {2!r}'.format(name, lstr, self.sum))
+        lines.append('{0}_count{1} {2}'.format(name, lstr, cum))
+        return lines
+
+class Registry(object):
+    """All of the metrics, by name and labels."""
+
+    def __init__(self):
+        # keys are names, values are (type, help, dict of metrics
+        # keyed by the sorted label items).
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _get(self, cls, mtype, name, helptext, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (mtype, helptext, {})
+            metrics = self._metrics[name][2]
+            if key not in metrics:
+                metrics[key] = cls(key)
+            return metrics[key]
+
+    def counter(self, name, helptext='', **labels):
+        """Return the Counter with name and labels, creating it if need be."""
+
+        return self._get(Counter, 'counter', name, helptext, labels)
+
+    def histogram(self, name, helptext='', **labels):
+        """Return the Histogram with name and labels, creating it if need be."""
+
+        return self._get(Histogram, 'histogram', name, helptext, labels)
+
+    def timer(self, name, helptext='', **labels):
+        """
+        Return decorator that times each call of a function in the
+        histogram with name and labels.  Exceptions raised are
+        counted in the counter name_errors_total (with the same labels,
+        plus label error, the name of the exception class).
+        """
+
+        hist = self.histogram(name, helptext, **labels)
+        errname = name.replace('_seconds', '') + '_errors_total'
+
+        def decorator(func):
+            def _timed(*args, **kwargs):
+                t0 = clock()
+                try:
+                    return func(*args, **kwargs)
+                except Exception, e:
+                    self.counter(errname, 'Calls that raised an exception.',
+                                 error=type(e).__name__, **labels).inc()
+                    raise
+                finally:
+                    hist.observe(clock() - t0)
+            _timed.__name__ = getattr(func, '__name__', name)
+            _timed.__doc__ = getattr(func, '__doc__', None)
+            return _timed
+        return decorator
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+
+        with self._lock:
+            metrics = [(name, mtype, helptext, dict(mdict)) for
+                       (name, (mtype, helptext, mdict))
+                       in sorted(self._metrics.items())]
+        lines = []
+        for name, mtype, helptext, mdict in metrics:
+            name = _PREFIX + name
+            if helptext:
+                lines.append('# HELP {0} {1}'.format(name, helptext))
+            lines.append('# TYPE {0} {1}'.format(name, mtype))
+            for key in sorted(mdict):
+                lines.extend(mdict[key].lines(name))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write all metrics to file path."""
+
+        # write then rename, so that whatever reads the file never
+        # sees half of it.
+        tmp = '{0}.tmp'.format(path)
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve all metrics over HTTP at /metrics on a separate thread.
+
+        We only listen on host, by default the local machine; pass ''
+        for all interfaces.
+
+        """
+
+        if self._server is not None:
+            return
+        registry = self
+
+        class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+        t = threading.Thread(target=self._server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+# the registry used by the whole application
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+timer = registry.timer
+render = registry.render
+write = registry.write
+serve = registry.serve
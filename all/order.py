@@ -41,11 +41,53 @@ POLARITY_MAP = {1: 'BACK',
 
 class Order(object):
     """Used to place an order, and returned after an order is placed."""    
+
+    # every order is kept for the lifetime of the application (see
+    # OrderStore), so the class has fixed slots.  Attributes other
+    # than those set in __init__ are only set if passed as keyword
+    # arguments (or later on), since e.g. hasattr(o, 'oref') tells us
+    # if the order has been placed.
+    __slots__ = ('exid', 'sid', 'stake', 'price', 'polarity', 'status',
+                 'cancelrunning', 'persistence', 'cancelreset', 'src',
+                 'wsn',
+                 # notable kwargs (and therefore possible instance
+                 # attributes) not set at instantiation are:
+                 'oref',           # reference number from API
+                 'mid',            # market id
+                 'matchedstake',   # amount of order matched
+                 'unmatchedstake', # amount of order unmatched
+                 'sname',          # name of the selection that order is for
+                 'strategy',       # strategy id (from the database)
+                 'deltastake',     # change to make to stake when
+                                   # updating (BDAQ only)
+                 'newpersistence', # for updating (BF only)
+                 'newprice',       # for updating (BF only)
+                 'newstake',       # for updating (BF only)
+                 'tupdated',       # the API parsing functions store
+                                   # the time returned from BDAQ/BF API
+                                   # here.
+                 'tplaced',        # as above.
+                 'sizeCancelled',  # stored from BF UpdateBets and
+                 'sizeMatched',    # CancelBets (see bfapiparse.py).
+                 '_DRAW')          # used by the GUI
     
-    def __init__(self, exid, sid, stake, price, polarity, **kwargs):
+    def __init__(self, exid, sid, stake, price, polarity,
+                 status=NOTPLACED, cancelrunning=True, persistence='NONE',
+                 cancelreset=False, src=0, wsn=0, **kwargs):
         """
         Create order from exid (const.BDAQID or const.BFID), selection
         id, stake (in GBP), price (odds), polarity (O_BACK or O_LAY).
+
+        The keyword arguments with defaults are:
+        status        - one of the numbers above e.g. O_MATCHED
+        cancelrunning - BDAQ only: cancel when market goes 'in
+                        running' aka 'in play'?
+        persistence   - BF only: persistence type (same as
+                        cancelrunning but for BF)
+        cancelreset   - BDAQ only: cancel if selection is reset?
+        src           - BDAQ only: selection reset count
+        wsn           - BDAQ only: withdrawal selection number
+        Any other keyword arguments must be one of the slots above.
         """
         
         self.exid = exid
@@ -54,44 +96,31 @@ class Order(object):
         self.price = price
         self.polarity = polarity # 1 for back, 2 for lay
 
-        # the following are defaults and can be overridden by **kwargs
-        self.status = NOTPLACED
-        # BDAQ only: cancel when market goes 'in running' aka 'in play'?
-        self.cancelrunning = True
-        # BF only: persistence type
-        self.persistence = 'NONE'
-        # BDAQ only: cancel if selection is reset?
-        self.cancelreset = False
-        # BDAQ only: selection reset count        
-        self.src = 0
-        # BDAQ only: withdrawal selection number        
-        self.wsn = 0              
+        self.status = status
+        self.cancelrunning = cancelrunning
+        self.persistence = persistence
+        self.cancelreset = cancelreset
+        self.src = src
+        self.wsn = wsn
 
         for kw in kwargs:
-            # notable kwargs (and therefore possible instance attributes) are:
-            # not set at instantiation above:
-            # oref           - reference number from API
-            # mid            - market id
-            # matchedstake   - amount of order matched
-            # unmatchedstake - amount of order unmatched
-            # sname          - name of the selection that order is for
-            # set at instantiation above (but sometimes overridden here):
-            # status         - one of the numbers above e.g. O_MATCHED
-            # cancelrunning  - default is True
-            # cancelreset    - default is True
-            # src            - selection reset count
-            # wsn            - withdrawal sequence number
-            # persistence    - same as cancelrunning but for BF
-            # deltastake     - change to make to stake when updating (BDAQ only)
-            # newpersistence - for updating (BF only)
-            # newprice       - for updating (BF only)
-            # newstake       - for updating (BF only)
-            # tupdated       - the API parsing functions store the time 
-            #                  returned from BDAQ/BF API here.
-            # tplaced        - the API parsing functions store the time 
-            #                  returned from BDAQ/BF API here.
-
-            setattr(self, kw, kwargs[kw])
+            try:
+                setattr(self, kw, kwargs[kw])
+            except AttributeError:
+                raise InternalError, 'unknown order attribute {0}'.format(kw)
+
+    def as_dict(self):
+        """Return dict of all attributes that have been set."""
+
+        return {k: getattr(self, k) for k in self.__slots__
+                if hasattr(self, k)}
+
+    # for pickling/copying (we don't have a __dict__)
+    __getstate__ = as_dict
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
 
     def update(self, price=None, stake=None, persistence=None):
         """Set new price and new stake, ready for the order to be updated on
@@ -11,7 +11,137 @@ and Betfair.
 from suds.client import Client
 from suds.sax.element import Element
 from betman import const
+from threading import Lock
+from Queue import LifoQueue, Empty, Full
+from StringIO import StringIO
+import httplib
+import socket
+import urllib
 import urllib2
+import urlparse
+import zlib
+
+class HTTPPool(object):
+    """Pool of keep-alive HTTP connections.
+
+    This is shared by all of the non-API clients, so that we don't
+    pay for a new TCP connection (and DNS lookup) on every request
+    for prices.  We hold at most size idle connections per host; a
+    connection is only ever used by one thread at a time.  The
+    call method behaves like urllib2.urlopen, i.e. it returns a file
+    like object, and raises URLError (or HTTPError) on failure.
+
+    """
+
+    def __init__(self, size=const.HTTPPOOLSIZE, timeout=const.HTTPTIMEOUT,
+                 gzip=const.HTTPGZIP):
+        self.size = size
+        self.timeout = timeout
+        self.gzip = gzip
+
+        # keys are (scheme, host), values are LifoQueues of idle
+        # connections (most recently used first, since these are the
+        # least likely to have been closed by the server).
+        self._idle = {}
+        self._lock = Lock()
+
+    def _get_idle(self, key):
+        with self._lock:
+            if key not in self._idle:
+                self._idle[key] = LifoQueue(self.size)
+            return self._idle[key]
+
+    def _get_conn(self, key):
+        """Return (connection, reused) for scheme and host in key."""
+
+        try:
+            return self._get_idle(key).get_nowait(), True
+        except Empty:
+            scheme, host = key
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = httplib.HTTPConnection(host, timeout=self.timeout)
+            return conn, False
+
+    def _put_conn(self, key, conn):
+        try:
+            self._get_idle(key).put_nowait(conn)
+        except Full:
+            conn.close()
+
+    # maximum number of redirects we follow for a single call (as
+    # urllib2's HTTPRedirectHandler).
+    MAXREDIRECTS = 10
+
+    def _get(self, url, headers):
+        """Make a single HTTP GET request and return (response, body)."""
+
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{0}?{1}'.format(path, parts.query)
+
+        while True:
+            conn, reused = self._get_conn(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                # an idle connection may have been closed by the
+                # server; in this case try again with a new one.
+                if reused:
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put_conn(key, conn)
+
+        if resp.getheader('content-encoding', '').lower() == 'gzip':
+            try:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            except zlib.error, e:
+                raise urllib2.URLError(e)
+
+        return resp, body
+
+    def call(self, url, headers):
+        """Make HTTP GET request and return the response.
+
+        Redirects are followed, as for urllib2.urlopen.
+
+        """
+
+        headers = dict(headers)
+        if self.gzip:
+            headers['Accept-Encoding'] = 'gzip'
+
+        for i in range(self.MAXREDIRECTS + 1):
+            resp, body = self._get(url, headers)
+            location = resp.getheader('location')
+            if (resp.status not in (301, 302, 303, 307)) or (not location):
+                break
+            url = urlparse.urljoin(url, location)
+        else:
+            raise urllib2.HTTPError(url, resp.status,
+                                    'too many redirects', resp.msg,
+                                    StringIO(body))
+
+        # this includes any redirect we didn't follow
+        if resp.status >= 300:
+            raise urllib2.HTTPError(url, resp.status, resp.reason,
+                                    resp.msg, StringIO(body))
+
+        return urllib.addinfourl(StringIO(body), resp.msg, url, resp.status)
+
+# the pool of HTTP connections used by all of the non-API clients.
+_httppool = HTTPPool()
 
 class BDAQApiClient(object):
     """
@@ -104,8 +234,7 @@ class BDAQNonApiClient(object):
         self.headers = { 'User-Agent' : const.USERAGENT }
 
     def call(self, url):
-        req = urllib2.Request(url, headers=self.headers)
-        return urllib2.urlopen(req)
+        return _httppool.call(url, self.headers)
 
 class BFApiClient(object):
     """Client object to handle requests to the Betfair Api."""
@@ -170,5 +299,4 @@ class BFNonApiClient(object):
         self.headers = { 'User-Agent' : const.USERAGENT }
 
     def call(self, url):
-        req = urllib2.Request(url, headers=self.headers)
-        return urllib2.urlopen(req)
+        return _httppool.call(url, self.headers)
@@ -4,9 +4,27 @@
 
 """
 Base class for API methods (official SOAP APIs) and for NonApi (screen
-scraping) methods for both BDAQ and BF.
+scraping) methods for both BDAQ and BF.  Every call is timed in the
+histogram api_seconds, labelled by the name of the method class (see
+all/metrics.py).
 """
 
+from betman import const, util, betlog, metrics
+from threading import Lock
+from urllib2 import HTTPError
+
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('apimethod')
+
+def _timed(meth, func, suffix=''):
+    """Return func (a bound method of meth) timed in api_seconds."""
+
+    name = type(meth).__name__
+    if suffix:
+        name = '{0}.{1}'.format(name, suffix)
+    return metrics.timer('api_seconds', 'Time of each API call.',
+                         method=name)(func)
+
 class ApiMethod(object):
     """Base class for all Betdaq and BF Api methods."""
 
@@ -17,6 +35,7 @@ class ApiMethod(object):
         # note this will call the derived class method, assuming it
         # exists, and not the method below.
         self.create_req()
+        self.call = _timed(self, self.call)
 
     def create_req(self):
         """Create the request object for the Api call."""
@@ -33,9 +52,134 @@ class NonApiMethod(object):
 
     def __init__(self, urlclient):
         self.client = urlclient
+        self.call = _timed(self, self.call)
 
     def call(self):
         """Call the NonApi function and return the appropriate data."""
         
         pass
 
+
+class ChunkedNonApiMethod(NonApiMethod):
+    """Base class for NonApi methods that take a list of market ids.
+
+    The exchange websites return HTTP 400 if we ask for too many
+    markets in a single request, and we don't know in advance how
+    many is too many (it depends on the endpoint, and probably on how
+    much data each market has).  So each method learns the size of
+    chunk its endpoint accepts: we start at const.NAPICHUNK market
+    ids, grow the chunk size by const.NAPICHUNKSTEP after each full
+    chunk that succeeds, and if we get HTTP 400 we halve it and never
+    again try a chunk as big as the one that failed.  Only the failed
+    chunk is retried (split in two); the other chunks are unaffected.
+    HTTP 400 can also mean one of the market ids is bad, in which
+    case we keep splitting until we find it, and return it as an
+    erroneous market id rather than learning a smaller chunk size.
+
+    Derived classes implement fetch, which makes a single request
+    for a list of market ids, keeping only the best depth prices on
+    each side of the book.  The chunks returned by plan can be
+    given to call_chunk on separate threads (see update_prices in
+    multi.py), so the learned sizes are protected by a lock.
+
+    """
+
+    def __init__(self, urlclient):
+        super(ChunkedNonApiMethod, self).__init__(urlclient)
+        # chunk size we will ask for next time
+        self.maxmids = const.NAPICHUNK
+        # smallest chunk size we have had HTTP 400 for
+        self.badmids = const.NAPICHUNKMAX + 1
+        self._lock = Lock()
+        # time each request as well as the whole call
+        self.fetch = _timed(self, self.fetch, 'fetch')
+
+    def fetch(self, ids, depth):
+        """Make one request for market ids in list ids.
+
+        Should return (dict keyed by market id, list of erroneous
+        market ids).
+
+        """
+
+        return {}, []
+
+    def plan(self, mids):
+        """Return list of chunks of market ids to request."""
+
+        return list(util.chunks(mids, self.maxmids))
+
+    def _succeeded(self, n):
+        with self._lock:
+            # only grow if the chunk was as large as we dared
+            if n >= self.maxmids:
+                self.maxmids = min(self.maxmids + const.NAPICHUNKSTEP,
+                                   self.badmids - 1)
+
+    def _failed(self, n):
+        with self._lock:
+            self.badmids = min(self.badmids, n)
+            self.maxmids = max(1, min(self.maxmids, n // 2))
+
+    def _call_chunk(self, ids, depth):
+        """
+        Return (dict, list of erroneous mids, list of bad mids) for
+        market ids ids, where the bad mids are those we got HTTP 400
+        for when we asked for them on their own.
+        """
+
+        try:
+            res, emids = self.fetch(ids, depth)
+        except HTTPError, e:
+            if e.code != 400:
+                raise
+            if len(ids) == 1:
+                log.info('HTTP 400 for mid {0}', ids[0])
+                return {}, [], list(ids)
+            half = len(ids) // 2
+            res, emids, bad = self._call_chunk(ids[:half], depth)
+            res2, emids2, bad2 = self._call_chunk(ids[half:], depth)
+            res.update(res2)
+            emids.extend(emids2)
+            bad.extend(bad2)
+            # a single bad market id gives HTTP 400 for every chunk
+            # it is in, whatever the size of the chunk, so we only
+            # count the failure against the chunk size if it wasn't
+            # down to a bad id.
+            if not bad:
+                self._failed(len(ids))
+                log.info('HTTP 400 for {0} mids, chunk size now {1}',
+                         len(ids), self.maxmids)
+            return res, emids, bad
+
+        self._succeeded(len(ids))
+        return res, emids, []
+
+    def call_chunk(self, ids, depth=const.NUMPRICES):
+        """Return (dict, list of erroneous mids) for market ids ids.
+
+        If the request fails with HTTP 400 we split ids in two and
+        try each half in turn, until we find any market ids that give
+        HTTP 400 on their own, which we return as erroneous.  Any
+        other error is raised.
+
+        """
+
+        res, emids, bad = self._call_chunk(ids, depth)
+        emids.extend(bad)
+        return res, emids
+
+    def call(self, mids, depth=const.NUMPRICES):
+        """
+        Return (dict keyed by market id, list of erroneous market
+        ids) for all market ids in list mids, making the requests one
+        after the other.
+        """
+
+        allres = {}
+        allemids = []
+        for ids in self.plan(mids):
+            res, emids = self.call_chunk(ids, depth)
+            allres.update(res)
+            allemids.extend(emids)
+        return allres, allemids
@@ -89,5 +89,8 @@ ListBlacklistInformation = bdaqapimethod.\
 # non Api (screen scraping) functions appear below.  These are
 # suffixed with _nApi.
 
-# get prices for some market ids
-GetPrices_nApi = bdaqnonapimethod.NonApiGetPrices(_ncl).call
+# get prices for some market ids.  We keep the method object too, so
+# that the chunks of market ids can be fetched at the same time (see
+# update_prices in multi.py).
+nApiGetPrices = bdaqnonapimethod.NonApiGetPrices(_ncl)
+GetPrices_nApi = nApiGetPrices.call
@@ -160,12 +160,15 @@ class ApiGetPrices(ApiMethod):
         self.req._WantSelectionsMatchedAmounts = True
         self.req._WantSelectionMatchedDetails = True
 
-    def call(self, mids):
+    def call(self, mids, depth=const.NUMPRICES):
         """
         Return all selections for Market ids in mids, where mids is a
-        list of market ids.
+        list of market ids.  We ask for the best depth prices on each
+        side of the book.
         """
 
+        self.req._NumberForPricesRequired = depth
+        self.req._NumberAgainstPricesRequired = depth
         allselections = []
         # split up mids into groups of size MAXMIDS
         for (callnum, ids) in \
@@ -177,7 +180,7 @@ class ApiGetPrices(ApiMethod):
                 
             betlog.betlog.info('calling BDAQ Api GetPrices')
             result = self.client.service.GetPrices(self.req)
-            selections =  bdaqapiparse.ParseGetPrices(ids, result)
+            selections =  bdaqapiparse.ParseGetPrices(ids, result, depth)
             allselections = allselections + selections
 
         #if const.WRITEDB:
@@ -403,9 +406,8 @@ class ApiPlaceOrdersNoReceipt(ApiMethod):
 # not fully implemented (do not use)
 class ApiPlaceOrdersWithReceipt(ApiMethod):
     def __init__(self, apiclient, dbman):
-        self.client = apiclient.client
+        super(ApiPlaceOrdersWithReceipt, self).__init__(apiclient)
         self.dbman = dbman
-        self.create_req()
 
     def create_req(self):
         self.req = self.client.factory.create('PlaceOrdersWithReceiptRequest')
@@ -8,10 +8,13 @@ library has done most of the work for us here, we just need to extract
 the data we want.
 """
 
-from betman import const, util, Market, Selection, Event, order
+from betman import const, util, Market, Selection, Event, order, betlog
 from betman.all import const
 from betman.all.betexception import ApiError
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('bdaqapiparse')
+
 def _check_errors(resp):
     """
     Check errors from BDAQ API response.  This function is called in
@@ -22,7 +25,7 @@ def _check_errors(resp):
     retcode = resp.ReturnStatus._Code
 
     if retcode != 0:
-        print resp
+        log.error('{0}', resp)
         raise ApiError, '{0} {1}'.format(retcode,
                                          resp.ReturnStatus._Description)
 
@@ -86,7 +89,7 @@ def _ParseEventClassifier(eclass, name='', markets=[]):
                                       mtype._StartTime,
                                       **dict(mtype)))
 
-def ParseGetPrices(marketids, resp):
+def ParseGetPrices(marketids, resp, depth=const.NUMPRICES):
 
     _check_errors(resp)
 
@@ -193,6 +196,7 @@ def ParseGetPrices(marketids, resp):
                                                lastmatchamount,
                                                bprices, lprices,
                                                sel._ResetCount, wsn,
+                                               depth=depth,
                                                **kwdict))
     return allselections
 
@@ -349,7 +353,7 @@ def ParseCancelOrders(resp, olist):
     _check_errors(resp)
     tstamp = resp.Timestamp
 
-    print resp
+    log.debug('{0}', resp)
 
     # warning: according the the BDAQ API docs, we won't get
     # information back about any order that is subject to an in
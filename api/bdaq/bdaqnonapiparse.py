@@ -9,11 +9,45 @@ import re
 from betman import const, Selection, betlog
 from betman.all.betexception import ApiError
 
-def ParseNonApiGetPrices(resp, mids):
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('bdaqnonapiparse')
+
+# the prices we last parsed for each selection.  Keys are market ids,
+# values are dicts with selection ids as keys, and values (flat
+# prices, src, wsn, Selection).  If a selection's prices, reset count
+# and withdrawal number are the same as last time, we hand back the
+# same Selection object rather than making a new one (so that the
+# price store can tell at a glance that it hasn't changed).
+_last = {}
+
+# padding for one side of the book (see Selection in exchange.py)
+_NSIDE = 2 * const.NUMPRICES
+_PAD = [0.0] * _NSIDE
+
+def _flat_side(so, depth):
+    """
+    Return [p1, v1, p2, v2, ...] of length 2*depth from the 'fSO' or
+    'aSO' entry of a selection, which is a dict if there is one
+    price, or a list of dicts if there is more than one.
+    """
+
+    if isinstance(so, dict):
+        return [so['p'], so['rA']] + _PAD[2:2 * depth]
+    if depth == 1:
+        # only the best price
+        return [so[0]['p'], so[0]['rA']]
+    flat = []
+    for p in so[:depth]:
+        flat.append(p['p'])
+        flat.append(p['rA'])
+    return flat + _PAD[len(flat):2 * depth]
+
+def ParseNonApiGetPrices(resp, mids, depth=const.NUMPRICES):
     """
     Return Selections from json string response as a dictionary with
     keys that are the market ids.  Also return a list of mids with
-    'errors'; probably these are markets that have finished.
+    'errors'; probably these are markets that have finished.  We only
+    keep the best depth prices on each side of the book.
     """
 
     try:
@@ -27,6 +61,8 @@ def ParseNonApiGetPrices(resp, mids):
         # market has finished. In this case we will get
         # 'EmptyResponse' (can check this easily in a browser).
         # Return no selections and the market ids
+        for m in mids:
+            _last.pop(m, None)
         return {}, mids
 
     # go through each market in turn and get the selections.  Note
@@ -51,76 +87,63 @@ def ParseNonApiGetPrices(resp, mids):
         markmid = int(mdat['mId'])
 
         # dictionary of selections for this marketid
-        selections[markmid] = {}
+        msels = selections[markmid] = {}
         # withdrawal selection number for the market; we store this in
         # the selection objects for speedier betting.
         wsn = mdat['wSN']
+
+        lastsels = _last.get(markmid, {})
+        newlast = {}
         
         # the mkt key contains everything we want
         for sel in mdat['sel']:
-            # apostraphe appears as '&apos;' and this seems to be the
-            # best place to correct it.            
-            name = sel['sN'].replace('&apos;', '\'')
             sid = sel['sId']
             # each selection also contains a market id.  This should
             # be the same as markmid above!
             mid = int(sel['mId'])
 
             if (mid != markmid):
-                print sel
-                print type(mid), type(markmid)
                 raise ApiError, ('Selection has mid {0} '
                                  'not correct mid {1}'.\
                                  format(mid, markmid))
 
-            if 'fSO' in sel:
-                # if there are multiple back prices available,
-                # sel['fSO'] will be a list
-                if isinstance(sel['fSO'], list):
-                    bprices = [(p['p'], p['rA']) for p in sel['fSO']]
-                else:
-                    # only one back price available
-                    bprices = [(sel['fSO']['p'], sel['fSO']['rA'])]
-            else:
-                # no back prices available
-                bprices = []
-                
-            if 'aSO' in sel:
-                # if there are multiple lay prices available,
-                # sel['aSO'] will be a list                
-                if isinstance(sel['aSO'], list):
-                    lprices = [(p['p'], p['rA']) for p in sel['aSO']]
-                else:
-                    # only one lay price available
-                    lprices = [(sel['aSO']['p'], sel['aSO']['rA'])]
-            else:
-                # no lay prices available
-                lprices = []
+            # back prices then lay prices, laid out as the prices
+            # array of the Selection.
+            fso = sel.get('fSO')
+            flat = _flat_side(fso, depth) if fso else _PAD[:2 * depth]
+            aso = sel.get('aSO')
+            flat.extend(_flat_side(aso, depth) if aso else _PAD[:2 * depth])
 
             # selection recount number
             src = sel['sRC']
 
+            last = lastsels.get(sid)
+            if ((last is not None) and (last[0] == flat) and
+                (last[1] == src) and (last[2] == wsn)):
+                # nothing has changed since last time
+                newlast[sid] = last
+                msels[sid] = last[3]
+                continue
+
+            # apostraphe appears as '&apos;' and this seems to be the
+            # best place to correct it.
+            name = sel['sN'].replace('&apos;', '\'').encode('utf8')
+
             # add the selection.  Note we are not getting amounts
             # matched etc. at the moment.
-            selections[markmid][sid] = Selection(const.BDAQID,
-                                                 name, sid, mid,
-                                                 None,
-                                                 None,
-                                                 None,
-                                                 None,
-                                                 None,
-                                                 bprices, lprices,
-                                                 src,
-                                                 wsn,
-                                                 **sel)
+            s = Selection.from_flat(const.BDAQID, name, sid, mid, flat,
+                                    src, wsn)
+            newlast[sid] = (flat, src, wsn, s)
+            msels[sid] = s
+
+        _last[markmid] = newlast
 
     # check how many markets we got selections for.
     # note, if we didn't get all markets, probably some have been
     # cancelled/finished etc.
     lsels = len(selections)
     lmids = len(mids)
-    betlog.betlog.debug('BDAQ got selections for {0} of {1} markets'\
-                        .format(lsels, lmids))
+    log.debug('BDAQ got selections for {0} of {1} markets', lsels, lmids)
             
     # construct error list - market ids we did not get any selection
     # information for. Presumably these have finished etc.
@@ -132,31 +155,27 @@ def ParseNonApiGetPrices(resp, mids):
                 errormids.append(m)
 
     if errormids:
-        betlog.betlog.debug('BDAQ no selections for markets: {0}'\
-                            .format(' '.join([str(m) for m in errormids])))
+        for m in errormids:
+            _last.pop(m, None)
+        log.debug('BDAQ no selections for markets: {0}',
+                  ' '.join([str(m) for m in errormids]))
 
     return selections, errormids
     
+# matches a name in the BDAQ response, i.e. a word straight after {
+# or , (ignoring spaces) that is followed by a colon.
+_NAMERE = re.compile(r'([{,])\s*([a-zA-Z]\w*)\s*:')
+
 def _correct_json(jstr):
     """
     Return proper Json from BDAQ response!  The problem with the
     Betdaq response is:
     (i) There are some spaces around the names
     (ii) None of the names are in double quotes
+    We fix both with a single pass over the response.  Note this
+    assumes that all names from BDAQ start with an alphabetic
+    character (which seems to be the case), so we don't match json
+    values like 06:00, which are already in double quotes.
     """
     
-    # Strip leading whitespace: match { followed by any number of
-    # spaces followed by any alphanumeric character.
-    jstr = re.sub(r"{\s*(\w)", r'{"\1', jstr)
-    
-    # Strip trailing whitespace: match , followed by any number of
-    # spaces followed by any alphanumeric character
-    jstr = re.sub(r",\s*(\w)", r',"\1', jstr)
-    
-    # Add double quotes: matches only an alphabetic character [a-zA-Z]
-    # before the ":" and not any alphanumeric character \w, since we
-    # don't want to match json values like 06:00 which are already in
-    # double quotes.  Note: this assumes that all names from BDAQ end
-    # with an alphabetic character (which seems to be the case).
-    jstr = re.sub(r"([a-zA-Z]):", r'\1":', jstr)
-    return jstr
+    return _NAMERE.sub(r'\1"\2":', jstr)
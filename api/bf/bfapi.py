@@ -65,14 +65,18 @@ CancelBets = bfapimethod.ApicancelBets(cluk, dbman).call
 # update bets
 UpdateBets = bfapimethod.ApiupdateBets(cluk, dbman).call
 
-# this only checks if matched or unmatched at the moment
+# this only checks if matched or unmatched at the moment.  We can
+# pass at most MAXBETSTATUS orders in a single call.
 GetBetStatus = bfapimethod.ApigetMUBets(cluk, dbman).call
+MAXBETSTATUS = bfapimethod.ApigetMUBets.MAXBETS
 
 # non Api (screen scraping) functions appear below.  These are suffixed with _nApi.
 
 # get market information
 GetMarket_nApi = bfnonapimethod.NonApigetMarket(cluknonapi, dbman).call
 
-# get prices
-GetPrices_nApi = bfnonapimethod.NonApigetPrices(cluknonapi,
-                                                dbman).call
+# get prices.  We keep the method object too, so that the chunks of
+# market ids can be fetched at the same time (see update_prices in
+# multi.py).
+nApiGetPrices = bfnonapimethod.NonApigetPrices(cluknonapi, dbman)
+GetPrices_nApi = nApiGetPrices.call
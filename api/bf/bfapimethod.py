@@ -1,8 +1,10 @@
-from operator import attrgetter
 import bfapiparse
 from betman import const, Event, betlog
 from betman.api.apimethod import ApiMethod
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('bfapimethod')
+
 """
 Function for logging into Betfar and classes for calling the Betfair
 Api Methods.  These are not designed to be called from user
@@ -195,7 +197,7 @@ class ApicancelBetsByMarket(ApiMethod):
         self.req.markets = midlist
         betlog.betlog.info('calling BF Api cancelBetsByMarket')
         response = self.client.service.cancelBetsByMarket(self.req)
-        print response
+        log.debug('{0}', response)
 
 # there are a number of subtleties with updateBets, see p121 of the BF
 # API docs.
@@ -243,67 +245,95 @@ class ApiupdateBets(ApiMethod):
         """Update list of orders for a single market."""
         
         _add_header(self)
-        print self.req.bets
         self.req.bets.UpdateBets = self.make_update_bet_list(olist)
         betlog.betlog.info('calling BF Api updateBets')
-        print self.req
+        log.debug('{0}', self.req)
         response = self.client.service.updateBets(self.req)
-        print response
+        log.debug('{0}', response)
         allorders = bfapiparse.ParseupdateBets(response, olist)
         return allorders
 
 class ApigetMUBets(ApiMethod):
+
+    # the maximum number of bet ids we can pass in a single request,
+    # and the maximum number of records returned by a single request.
+    MAXBETS = 200
+    
     def __init__(self, apiclient, dbman):
         super(ApigetMUBets, self).__init__(apiclient)
         self.dbman = dbman
 
     def create_req(self):
-        self.req = self.client.factory.create('ns1:GetMUBetsReq')
+        # note we create a new request for every call (see call), so
+        # that we can make several calls at once from different
+        # threads.
+        return self.client.factory.create('ns1:GetMUBetsReq')
 
-    def fillreq(self, betids, marketid):
+    def fillreq(self, req, betids, marketid, start):
         # can be C - cancelled, L - lapsed, M - Matched, MU - Matched
         # and Unmatched, S - Settled, U - Unmatched, V - Voided.
-        self.req.betStatus = 'MU'
+        req.betStatus = 'MU'
         # if marketid is non-zero, then betids is ignored
-        self.req.marketId = marketid
+        req.marketId = marketid
         # can include 200 betids maximum
-        self.req.betIds.betId = betids
+        req.betIds.betId = betids
         # can be BET_ID - order by bet id, CANCELLED_DATE - order by
         # cancelled date, MARKET_NAME - order by market name,
         # MATCHED_DATE - order by Matched date, NONE - default order
         # or PLACED_DATE - order by placed date.  This probably
         # shouldn't matter too much since I'll parse the output
         # anyhow.
-        self.req.orderBy.value = 'BET_ID'
+        req.orderBy.value = 'BET_ID'
         # can be 'ASC' - ascending or 'DESC' - descending.
-        self.req.sortOrder.value = 'ASC'
+        req.sortOrder.value = 'ASC'
         # I think this is the maximum but docs are unclear.
-        self.req.recordCount = 200
-        self.req.startRecord = 0
+        req.recordCount = self.MAXBETS
+        # a bet that has been partially matched more than once has
+        # more than one record, so we may need more than one 'page'
+        # of records (see call).
+        req.startRecord = start
         # apparently we don't need to set matchedSince...
         # self.matchedSince = 
         # not sure what I should go for here...
-        self.req.excludeLastSecond = False        
+        req.excludeLastSecond = False        
         
     def call(self, orders, marketid=0):
+        """Return dict of the current state of orders (at most MAXBETS).
+
+        To get the status of more orders than this, see
+        multi.get_order_status.
+
+        """
+
         # Note, the actual Api call will work if orders=[]. Then we
         # will return all matched and unmatched bets.  However,
         # bfapiparse.ParsegetMUBets will have to be modified to make
         # this work.
-        _add_header(self)
 
         # make orders into a dict, where key is order reference
         odict = {}
         for o in orders:
             odict[o.oref] = o
-        orders.sort(key = attrgetter('oref'))
-        
-        betids = sorted([o.oref for o in orders])
-        self.fillreq(betids, marketid)
-
-        betlog.betlog.info('calling BF Api getMUBets')            
-        response = self.client.service.getMUBets(self.req)
-        allorders = bfapiparse.ParsegetMUBets(response, odict)
+        betids = sorted(odict)
+
+        responses = []
+        start = 0
+        while True:
+            req = self.create_req()
+            req.header = self.client.reqheader
+            self.fillreq(req, betids, marketid, start)
+
+            betlog.betlog.info('calling BF Api getMUBets')            
+            response = self.client.service.getMUBets(req)
+            responses.append(response)
+
+            # get the next page of records, if there is one.
+            start += self.MAXBETS
+            if ((response.errorCode == 'NO_RESULTS') or
+                (start >= response.totalRecordCount)):
+                break
+
+        allorders = bfapiparse.ParsegetMUBets(responses, odict)
             
         return allorders
 
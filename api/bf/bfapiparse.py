@@ -9,6 +9,9 @@ from betman import const, Market, Event, order, betlog
 from betman.all.betexception import ApiError
 import datetime
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('bfapiparse')
+
 _EPS = 0.000001 # for fp arithmetic
 
 def _check_errors(res):
@@ -23,40 +26,38 @@ def _check_errors(res):
     api_ecode = res.header.errorCode
 
     if api_ecode != 'OK':
-        print res
+        log.error('{0}', res)
         raise ApiError, api_ecode
 
     # next, we check any 'service specific errors'
     service_ecode = res.errorCode
 
     if service_ecode != 'OK':
-        print res
+        log.error('{0}', res)
         raise ApiError, service_ecode        
 
-def ParsegetMUBets(res, odict):
+def ParsegetMUBets(reslist, odict):
+    """
+    Return dict of orders from list of getMUBets responses (there is
+    more than one response if we needed more than one page of
+    results) for the orders in odict.
+    """
 
     # here we override checking of errors, since the BF API returns an
     # error if no results are returned, but from our perspective there
     # is no problem with this, we just return an empty dict.
-    if res.errorCode == 'NO_RESULTS':
+    reslist = [res for res in reslist if res.errorCode != 'NO_RESULTS']
+    if not reslist:
         return {}
 
-    _check_errors(res)
-
-    #if len(res.bets.MUBet) != len(odict):
-    #    betlog.betlog.debug('Got {0} results for updating {1} orders'\
-    #                        .format(len(res.bets.MUBet), len(odict)))
-    #    print res.bets.MUBet
-    #    print odict
-    #print res.bets.MUBet
+    for res in reslist:
+        _check_errors(res)
 
     # The following is slightly complicated, this is because the BF
     # API can return multiple orders with the same betid, (although
     # they will have a different transactionId). We will get this if a
     # bet has been 'partially' matched.  From our perspective, this is
     # a single 'unmatched' bet.
-    print 'odict from engine', odict
-    print 'result', res
 
     # dictionary of orders we will return
     allorders = {}
@@ -71,7 +72,7 @@ def ParsegetMUBets(res, odict):
 
     # go through each MUBet, and add the amount matched (if any) to
     # the appropriate order object.
-    for r in res.bets.MUBet:
+    for r in [r for res in reslist for r in res.bets.MUBet]:
 
         if r.betStatus == 'M':
 
@@ -88,7 +89,6 @@ def ParsegetMUBets(res, odict):
         # fp arithmetic
         ms = o.matchedstake
         s = o.stake
-        #print o, ms, s
         if (ms > s - _EPS) and (ms < s + _EPS):
             o.status = order.MATCHED
 
@@ -102,14 +102,10 @@ def ParseplaceBets(res, olist):
     # if the main errorcode is "OK".  This is a 'known issue' in the
     # BF API, as detailed by the documentation
     # BetfairSportsExchangeAPIReferenceGuidev6.pdf, p114.
-    print res
+    log.debug('{0}', res)
     _check_errors(res)
     tstamp = res.header.timestamp
 
-#    print 'parse place bets:'
-#    print olist
-#    print res
-    
     # check that we have one result for each order executed
     if len(res.betResults.PlaceBetsResult) != len(olist):
         raise ApiError, ('did not receive the correct number'
@@ -125,10 +121,10 @@ def ParseplaceBets(res, olist):
         # full list.
         if betres.resultCode != "OK":
             # we don't want to raise an exception here since the other
-            # orders could have gone through ok, so print a warning
+            # orders could have gone through ok, so log a warning
             # and skip to next order order id.
-            betlog.betlog.debug('Warning: order {0} returned result {1}'\
-                                .format(o, betres.resultCode))
+            log.warning('order {0} returned result {1}', o,
+                        betres.resultCode)
 
         oref = betres.betId
         # check if we were matched
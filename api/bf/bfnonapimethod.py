@@ -9,8 +9,11 @@ Api.
 
 import bfnonapiparse
 import datetime
-from betman import util, betlog
-from betman.api.apimethod import NonApiMethod
+from betman import betlog
+from betman.api.apimethod import ChunkedNonApiMethod
+
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('bfnonapimethod')
 
 def _example():
     """Example for testing."""
@@ -49,7 +52,7 @@ def _formula1():
                      '&marketIds=1.{1}'.format('%2C'.join(typeswanted),mid))
     print url
 
-class NonApigetMarket(NonApiMethod):
+class NonApigetMarket(ChunkedNonApiMethod):
     """
     Get information about a market.  Replacement for ApigetMarket,
     which is badly throttled (5p/s) when using the free BF API.
@@ -59,80 +62,60 @@ class NonApigetMarket(NonApiMethod):
         super(NonApigetMarket, self).__init__(urlclient)
         self.dbman = dbman
 
-    def call(self, mids):
-        allemids = []
-        MAXMIDS = 50
-        allminfo = {}
-        allemids = []
-        for ids in util.chunks(mids, MAXMIDS):
-            # for AUS markets, need to write 2. rather than 1. 
-            midstring= '%2C'.join(['{0}.{1}'.format(self.client.mprefix,
-                                                    m) for m in ids])
+    def fetch(self, ids, depth):
+        # for AUS markets, need to write 2. rather than 1. 
+        midstring= '%2C'.join(['{0}.{1}'.format(self.client.mprefix,
+                                                m) for m in ids])
 
-            # note also that pricesurl is diferent for UK and AUS markets.
-            url = self.client.pricesurl + ('&types=MARKET_STATE%2C'
-                                           'MARKET_DESCRIPTION'
-                                           '&marketIds={0}'.\
-                                           format(midstring))
+        # note also that pricesurl is diferent for UK and AUS markets.
+        url = self.client.pricesurl + ('&types=MARKET_STATE%2C'
+                                       'MARKET_DESCRIPTION'
+                                       '&marketIds={0}'.\
+                                       format(midstring))
 
-            #betlog.betlog.debug('BF getMarket URL: {0}'.format(url))
+        #betlog.betlog.debug('BF getMarket URL: {0}'.format(url))
 
-            # make the HTTP request
-            betlog.betlog.info('calling BF nonApi getMarket')            
-            response = self.client.call(url)
+        # make the HTTP request
+        betlog.betlog.info('calling BF nonApi getMarket')            
+        response = self.client.call(url)
 
-            # selections for all the market ids
-            minfo, emids = bfnonapiparse.ParsenonApigetMarket(response.read(),
-                                                              mids)
-            
-            allminfo.update(minfo)
-            allemids = allemids + emids
-            
-        return allminfo, allemids
+        # market info for all the market ids
+        return bfnonapiparse.ParsenonAPIgetMarket(response.read(), ids)
 
-class NonApigetPrices(NonApiMethod):
+class NonApigetPrices(ChunkedNonApiMethod):
     """
     Replacement for ApigetPrices, which is throttled when using
-    the BF free API.
+    the BF free API.  BF returns HTTP 400 if we ask for too many
+    market ids at once, so these are split into chunks (see
+    ChunkedNonApiMethod).
     """
     
     def __init__(self, urlclient, dbman):
         super(NonApigetPrices, self).__init__(urlclient)
         self.dbman = dbman
     
-    def call(self, mids):
+    def fetch(self, ids, depth):
         """
-        mids should be list of market ids.
+        ids should be list of market ids; return selection dictionary
+        and the list of erroneous market ids.  Note we always get the
+        best three prices (RUNNER_EXCHANGE_PRICES_BEST), we just
+        don't parse them all.
         """
         
-        # unsure what MAXMIDS should be.  BF returns HTTP 400 return
-        # code if we ask for too much data, so try limiting to 50
-        # market ids for now (seems to work).
-        MAXMIDS = 50
-        allselections = {}
-        allemids = []
-        for ids in util.chunks(mids, MAXMIDS):
-            
-            # mprefix is 1 for UK markets and 2 for AUS markets
-            midstring= '%2C'.join(['{0}.{1}'.format(self.client.mprefix,
-                                                    m) for m in ids])
-            url = self.client.pricesurl + ('&types=RUNNER_DESCRIPTION%2'
-                                           'CRUNNER_EXCHANGE'
-                                           '_PRICES_BEST'
-                                           '&marketIds={0}'.format(midstring))
-
-            betlog.betlog.debug('BF Selection URL: {0}'.format(url))
+        # mprefix is 1 for UK markets and 2 for AUS markets
+        midstring= '%2C'.join(['{0}.{1}'.format(self.client.mprefix,
+                                                m) for m in ids])
+        url = self.client.pricesurl + ('&types=RUNNER_DESCRIPTION%2'
+                                       'CRUNNER_EXCHANGE'
+                                       '_PRICES_BEST'
+                                       '&marketIds={0}'.format(midstring))
 
-            # make the HTTP request
-            betlog.betlog.info('calling BF nonApi getPrices')            
-            response = self.client.call(url)
+        log.debug('BF Selection URL: {0}', url)
 
-            # selections for all the market ids
-            selections, emids = bfnonapiparse.\
-                                ParseJsonSelections(response.read(),
-                                                    ids)
- 
-            allselections.update(selections)
-            allemids = allemids + emids
+        # make the HTTP request
+        betlog.betlog.info('calling BF nonApi getPrices')            
+        response = self.client.call(url)
 
-        return allselections, allemids
+        # selections for all the market ids
+        return bfnonapiparse.ParseJsonSelections(response.read(), ids,
+                                                 depth)
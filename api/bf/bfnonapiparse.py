@@ -9,6 +9,9 @@ import xml.etree.ElementTree as etree
 from betman import const, Selection, betlog
 import json
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('bfnonapiparse')
+
 # obsolete - do not use, use ParseJsonSelections instead
 def ParseSelections(mids, xmlstr):
     root = etree.fromstring(xmlstr)
@@ -79,8 +82,7 @@ def ParsenonAPIgetMarket(jstr, mids):
     # cancelled/finished etc.
     lminfo = len(minfo)
     lmids = len(mids)
-    betlog.betlog.debug('BF got market info for {0} of {1} markets'\
-                        .format(lminfo, lmids))
+    log.debug('BF got market info for {0} of {1} markets', lminfo, lmids)
 
     # construct error list - market ids we did not get any market
     # information for. Presumably these have finished etc.
@@ -91,17 +93,18 @@ def ParsenonAPIgetMarket(jstr, mids):
                 errormids.append(m)
 
     if errormids:
-        betlog.betlog.debug('BF no market info for markets: {0}'\
-                            .format(' '.join([str(m) for m in errormids])))
+        log.debug('BF no market info for markets: {0}',
+                  ' '.join([str(m) for m in errormids]))
 
     return minfo, errormids
 
 
 
-def ParseJsonSelections(jstr, mids):
+def ParseJsonSelections(jstr, mids, depth=const.NUMPRICES):
     """
     Parse json data, return selections as dictionary with mids as
-    keys.
+    keys.  We only keep the best depth prices on each side of the
+    book.
     """
     
     data = json.loads(jstr)
@@ -124,13 +127,13 @@ def ParseJsonSelections(jstr, mids):
                     sid = runner['selectionId']
                     if 'availableToBack' in runner['exchange']:
                         back = [(b['price'], b['size']) for b in
-                                runner['exchange']['availableToBack']]
+                                runner['exchange']['availableToBack'][:depth]]
                     else:
                         # no odds available to back
                         back = [(None, None)]
                     if 'availableToLay' in runner['exchange']:
                         lay = [(la['price'], la['size']) for la in
-                               runner['exchange']['availableToLay']]
+                               runner['exchange']['availableToLay'][:depth]]
                     else:
                         # no odds available to lay
                         lay = [(None, None)]
@@ -140,6 +143,7 @@ def ParseJsonSelections(jstr, mids):
                                                      None, None, None,
                                                      None, None, back,
                                                      lay, None, None,
+                                                     depth=depth,
                                                      **runner)
 
     # check how many markets we got selections for.
@@ -147,8 +151,7 @@ def ParseJsonSelections(jstr, mids):
     # cancelled/finished etc.
     lsels = len(selections)
     lmids = len(mids)
-    betlog.betlog.debug('BF got selections for {0} of {1} markets'\
-                        .format(lsels, lmids))
+    log.debug('BF got selections for {0} of {1} markets', lsels, lmids)
 
     # construct error list - market ids we did not get any selection
     # information for. Presumably these have finished etc.
@@ -159,7 +162,7 @@ def ParseJsonSelections(jstr, mids):
                 errormids.append(m)
 
     if errormids:
-        betlog.betlog.debug('BF no selections for markets: {0}'\
-                            .format(' '.join([str(m) for m in errormids])))
+        log.debug('BF no selections for markets: {0}',
+                  ' '.join([str(m) for m in errormids]))
 
     return selections, errormids
@@ -0,0 +1 @@
+from backtest import *
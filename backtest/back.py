@@ -1,7 +1,11 @@
+import datetime
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 from betman import database
+from betman.database import archive
 
 dbman = database.DBMaster()
+tarchive = archive.TickArchive()
 
 mms = dbman.return_market_matches()
 
@@ -18,22 +22,22 @@ ax1 = fig1.add_subplot(111)
 ax2 = fig2.add_subplot(111)
 
 for (s1, s2) in zip(smatches[0], smatches[1]):
-    # time series data from betdaq
-    pdata = dbman.return_selections('select * from histselections where exchange_id = ? '
-                                    'and market_id = ? and selection_id = ?',
-                                    (s2.exid, s2.mid, s2.id))
+    # time series data from the tick archive
+    pdata = tarchive.load_selection(s2.exid, s2.mid, s2.id)
+    # the archive turns the (naive) tick times into epoch seconds
+    # as local time (see archive.to_epoch), so turn them back the
+    # same way; epoch2num would give us UTC, and the plot would be
+    # out by the UTC offset.
+    tstamps = mdates.date2num([datetime.datetime.fromtimestamp(t)
+                               for t in pdata['tstamp']])
     # back price
-    line, = ax1.plot_date([p.tstamp for p in pdata], [p.padback[0][0] for p in pdata], 
-                          fmt='-')
+    line, = ax1.plot_date(tstamps, pdata['back'][:, 0], fmt='-')
     col = line.get_color()
     # lay price
-    ax1.plot_date([p.tstamp for p in pdata], [p.padlay[0][0] for p in pdata], 
-                  fmt='-', color=col)
+    ax1.plot_date(tstamps, pdata['lay'][:, 0], fmt='-', color=col)
 
-    ax1.plot_date([p.tstamp for p in pdata], [p.padback[0][0] for p in pdata], 
-                  marker='o', color=col)
-    ax1.plot_date([p.tstamp for p in pdata], [p.padlay[0][0] for p in pdata], 
-                  marker='o', color=col)
+    ax1.plot_date(tstamps, pdata['back'][:, 0], marker='o', color=col)
+    ax1.plot_date(tstamps, pdata['lay'][:, 0], marker='o', color=col)
 
     
     print len(pdata)
@@ -0,0 +1,609 @@
+# backtest.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Backtesting engine.
+
+We replay prices recorded in the tick archive (see
+database/archive.py) through the strategy objects we run for real
+(MMStrategy, CXStrategy, BothMMStrategy etc.), without changing them.
+Orders the strategies make are 'placed' on a simulated exchange (see
+Matcher), and at the end we work out the position of each strategy
+from the orders that were matched (see strategy/position.py).
+
+The replay follows Engine.tick (see core/engine.py).  On each
+recorded tick we:
+
+(i) add any strategies whose start time has passed, and remove any
+whose end time has passed (this is what the automations do).
+
+(ii) match any resting orders against the recorded prices, and feed
+the order store to the strategies.
+
+(iii) feed the prices recorded on this tick to the strategies whose
+selections were recorded (i.e. those that would have got new prices
+from the engine).
+
+(iv) cancel, update and make any orders these strategies want.
+
+As in the engine, a strategy with UTICK attribute n (see
+core/managers.py) only gets prices on every nth tick.  Note the ticks
+here are the recorded ticks, so n = 1 means the strategy gets prices
+as often as they were recorded.
+
+Typical use is:
+
+bt = Backtest()
+sel = bt.get_selection(const.BFID, mid, sid)
+bt.add_strategy(MMStrategy(sel), tend=starttime)
+res = bt.run()
+print summary(res)
+
+"""
+
+import copy
+import datetime
+import numpy as np
+from betman import const, order, exchangedata, Selection
+from betman.core import managers
+from betman.core.stores.orderstore import OrderIndex
+from betman.database import archive
+from betman.strategy import strategy, position
+
+# small number used for fp arithmetic
+_EPS = 0.000001
+
+# one record per strategy in the results returned by Backtest.run
+RESULTDTYPE = np.dtype([('norders',  '<i8'), # orders placed
+                        ('nmatched', '<i8'), # orders (fully) matched
+                        ('placed',   '<f8'), # total stake placed
+                        ('matched',  '<f8'), # total stake matched
+                        ('win',      '<f8'), # return if selection wins
+                        ('lose',     '<f8'), # return if selection loses
+                        ('pwin',     '<f8')]) # implied prob of winning
+                                              # at the last tick
+
+def _to_datetime(t):
+    return datetime.datetime.fromtimestamp(t)
+
+class _Series(object):
+    """Recorded prices of a single selection."""
+
+    def __init__(self, recs, tmpl):
+        """
+        recs - array of archive.TICKDTYPE records (ordered by time).
+        tmpl - Selection object we take the name, src and wsn from.
+        """
+
+        self.exid = tmpl.exid
+        self.mid = tmpl.mid
+        self.sid = tmpl.id
+        self.name = tmpl._uname
+        self.src = tmpl.src
+        self.wsn = tmpl.wsn
+
+        self.tstamp = np.array(recs['tstamp'])
+
+        # best back and lay prices, with the same convention as
+        # Selection.best_back and Selection.best_lay for an empty
+        # side of the book.
+        bback = recs['back'][:, 0]
+        blay = recs['lay'][:, 0]
+        self.bback = np.where(np.isnan(bback), exchangedata.MINODDS, bback)
+        self.blay = np.where(np.isnan(blay), exchangedata.MAXODDS, blay)
+
+        # changed[i] is True if any price or volume of record i is
+        # different to record i - 1 (the same comparison as
+        # PriceStore._selection_changed, except that NaN == NaN).
+        cols = np.hstack([recs['back'], recs['bvol'],
+                          recs['lay'], recs['lvol']])
+        same = ((cols[1:] == cols[:-1]) |
+                (np.isnan(cols[1:]) & np.isnan(cols[:-1])))
+        self.changed = np.concatenate([[True], ~same.all(axis=1)])
+
+        # building Selection objects is the slow part of the replay,
+        # so we do it from lists rather than from the arrays.
+        self._back = recs['back'].tolist()
+        self._bvol = recs['bvol'].tolist()
+        self._lay = recs['lay'].tolist()
+        self._lvol = recs['lvol'].tolist()
+
+    def align(self, tstamps):
+        """
+        Store best back and lay prices at every time in tstamps (a
+        sorted array of all recorded times), for use by the Matcher.
+        Before the first record for the selection, these are NaN.
+        """
+
+        idx = np.searchsorted(self.tstamp, tstamps, side='right') - 1
+        self.gbback = self.bback[idx]
+        self.gblay = self.blay[idx]
+        self.gbback[idx < 0] = np.nan
+        self.gblay[idx < 0] = np.nan
+
+        # the tick number of each record
+        self.ticks = np.searchsorted(tstamps, self.tstamp)
+
+    def get_selection(self, i):
+        """Return Selection object for record i."""
+
+        # note p == p is False if p is NaN, i.e. there is no price.
+        back = [(p, v) for (p, v) in zip(self._back[i], self._bvol[i])
+                if p == p]
+        lay = [(p, v) for (p, v) in zip(self._lay[i], self._lvol[i])
+               if p == p]
+        return Selection(self.exid, self.name, self.sid, self.mid,
+                         None, None, None, None, None, back, lay,
+                         self.src, self.wsn,
+                         tstamp=_to_datetime(self.tstamp[i]))
+
+class BacktestOrderStore(object):
+    """Order store for the backtest.
+
+    This has the parts of the interface of OrderStore (see
+    core/stores/orderstore.py) that are used by the strategies and
+    PositionTracker, but nothing is written to the database.
+
+    """
+
+    def __init__(self):
+
+        # the current state of all orders placed.
+        self._orders = OrderIndex()
+
+        # cancelled, updated and new orders from the latest tick.
+        self.latest = [{const.BDAQID: {}, const.BFID: {}},
+                       {const.BDAQID: {}, const.BFID: {}},
+                       {const.BDAQID: {}, const.BFID: {}}]
+
+        # orders whose status changed (i.e. were matched) on the
+        # latest tick.
+        self.latest_updates = {const.BDAQID: {}, const.BFID: {}}
+
+    def get_order(self, exid, oref):
+        return self._orders.get(exid, oref)
+
+    def set_tplaced(self, olist):
+        # tplaced is set when we place the order
+        pass
+
+    def get_orders_from_oref_dict(self, orefdict):
+        return {exid: [self._orders.get(exid, oref) for oref in orefdict[exid]]
+                for exid in [const.BDAQID, const.BFID]}
+
+    def get_current_orders(self, exid):
+        return self._orders.orders[exid]
+
+    def get_unmatched_orders(self, exid):
+        return self._orders.with_status(exid, order.UNMATCHED)
+
+    def add_strategy_order(self, strategy, o):
+        self._orders.add_strategy_order(strategy, o.exid, o.oref, o.tplaced)
+
+    def get_strategy_orders(self, strategy):
+        return self._orders.strategy_orders(strategy)
+
+    def get_strategy_position(self, strategy):
+        return self._orders.strategy_position(strategy)
+
+    def add_order(self, o):
+        """Add order o, or update the indexes after o has changed."""
+
+        self._orders.add(o.exid, o.oref, o)
+
+    def expect_orders(self, onew, owners):
+        for olist in onew.values():
+            for o in olist:
+                if id(o) in owners:
+                    self._orders.expect(o, owners[id(o)])
+
+    def dispatch(self, odict):
+        """Tell the strategies about the orders in odict."""
+
+        for exid in odict:
+            self._orders.dispatch(exid, odict[exid], self)
+
+class Matcher(object):
+    """Simulated exchange.
+
+    An order is matched in full on the first tick (at or after the
+    tick it was placed or updated on) where the recorded prices cross
+    it, i.e. for a back order at price p when the best back price on
+    offer is at least p, and for a lay order at price p when the best
+    lay price on offer is at most p.
+
+    Since the recorded prices don't include our own orders, an order
+    that improves on the best price (as the market making strategies
+    do) will only be matched if the market later moves through it.
+    This is a conservative model: we assume we are never matched by
+    someone taking the price we are offering.  We also assume the
+    volume on offer is enough to match our (small) stakes in full.
+
+    """
+
+    def __init__(self, ostore, series):
+        """
+        ostore - BacktestOrderStore
+        series - dict mapping (exid, mid, sid) to _Series (aligned)
+        """
+
+        self.ostore = ostore
+        self._series = series
+
+        # mapping of tick number to list of orders to be matched on
+        # that tick, and of (exid, oref) to the tick each order will
+        # be matched on.
+        self._tomatch = {}
+        self._mtick = {}
+
+        # order reference counter
+        self._oref = 0L
+
+    def get_match_tick(self, o, k):
+        """Return tick at which order o will be matched, or None."""
+
+        s = self._series[(o.exid, o.mid, o.sid)]
+        if o.polarity == order.BACK:
+            cross = s.gbback[k:] >= o.price - _EPS
+        else:
+            cross = s.gblay[k:] <= o.price + _EPS
+        idx = np.flatnonzero(cross)
+        if len(idx):
+            return k + idx[0]
+        return None
+
+    def _schedule(self, o, k):
+        """Set status of order o, and schedule it to be matched."""
+
+        mtick = self.get_match_tick(o, k)
+        self._mtick[(o.exid, o.oref)] = mtick
+        if mtick == k:
+            self._set_matched(o)
+        else:
+            o.status = order.UNMATCHED
+            o.matchedstake = 0.0
+            o.unmatchedstake = o.stake
+            if mtick is not None:
+                self._tomatch.setdefault(mtick, []).append(o)
+
+    def _set_matched(self, o):
+        o.status = order.MATCHED
+        o.matchedstake = o.stake
+        o.unmatchedstake = 0.0
+
+    def match(self, k):
+        """Match any orders due to be matched on tick k."""
+
+        updates = {const.BDAQID: {}, const.BFID: {}}
+        for o in self._tomatch.pop(k, []):
+            # the order may have been cancelled or updated since it
+            # was scheduled.
+            if ((o.status == order.UNMATCHED) and
+                (self._mtick[(o.exid, o.oref)] == k)):
+                self._set_matched(o)
+                self.ostore.add_order(o)
+                updates[o.exid][o.oref] = o
+        self.ostore.latest_updates = updates
+        self.ostore.dispatch(updates)
+
+    def make_orders(self, ocancel, oupdate, onew, k, tnow):
+        """Cancel, update and make orders (from the strategies) on tick k.
+
+        ocancel, oupdate, onew - dicts with keys const.BDAQID and
+        const.BFID, values that are lists of order objects.
+        tnow - the time of tick k (a datetime.datetime).
+
+        """
+
+        cancelled = {const.BDAQID: {}, const.BFID: {}}
+        updated = {const.BDAQID: {}, const.BFID: {}}
+        new = {const.BDAQID: {}, const.BFID: {}}
+
+        for o in [o for olist in ocancel.values() for o in olist]:
+            o = self.ostore.get_order(o.exid, o.oref)
+            if o.status == order.UNMATCHED:
+                o.status = order.CANCELLED
+                o.unmatchedstake = 0.0
+                self.ostore.add_order(o)
+                cancelled[o.exid][o.oref] = o
+
+        for req in [o for olist in oupdate.values() for o in olist]:
+            o = self.ostore.get_order(req.exid, req.oref)
+            if o.status == order.UNMATCHED:
+                # the new price and stake are as for the real APIs
+                # (see Order.update): BF orders store them separately
+                # as newprice and newstake, for BDAQ the price has
+                # already been changed and deltastake is the change
+                # in stake.  Note on BF updating the price of an order
+                # really cancels it and makes a new order, here we
+                # keep the original reference.  An unmatched order has
+                # nothing matched, so all of the new stake is
+                # unmatched (this is set by _schedule).
+                if o.exid == const.BDAQID:
+                    o.price = req.price
+                    o.stake += getattr(req, 'deltastake', 0.0)
+                else:
+                    o.price = getattr(req, 'newprice', o.price)
+                    o.stake = getattr(req, 'newstake', o.stake)
+                o.tupdated = tnow
+                self._schedule(o, k)
+                self.ostore.add_order(o)
+                updated[o.exid][o.oref] = o
+
+        for o in [o for olist in onew.values() for o in olist]:
+            # the strategy keeps its own copy of the order, and gets
+            # the placed order from the store (as for the real API).
+            o = copy.copy(o)
+            self._oref += 1
+            o.oref = self._oref
+            o.tplaced = tnow
+            self._schedule(o, k)
+            self.ostore.add_order(o)
+            new[o.exid][o.oref] = o
+
+        self.ostore.latest = [cancelled, updated, new]
+        for odict in self.ostore.latest:
+            self.ostore.dispatch(odict)
+
+class Backtest(object):
+    """Replay recorded prices through strategies."""
+
+    def __init__(self, tarchive=None, tstart=None, tend=None):
+        """
+        tarchive - archive.TickArchive to read prices from (default
+                   is the archive in const.ARCHIVEDIR).
+        tstart   - only replay ticks at or after this time.
+        tend     - only replay ticks at or before this time.
+
+        tstart and tend are datetime.datetime objects.
+        """
+
+        self.tarchive = tarchive or archive.TickArchive()
+        self.tstart = tstart
+        self.tend = tend
+
+        # store records for each market as we load them
+        self._markets = {}
+
+        # list of (strategy, tstart, tend)
+        self._strategies = []
+
+    def _load_market(self, exid, mid):
+        if (exid, mid) not in self._markets:
+            recs = self.tarchive.load_market(exid, mid)
+            # only keep records in the time window.  Since the records
+            # are ordered by time, this is a slice of the memmap (so
+            # nothing is read from disk outside of the window).
+            i0, i1 = 0, len(recs)
+            if self.tstart is not None:
+                i0 = np.searchsorted(recs['tstamp'],
+                                     archive.to_epoch(self.tstart))
+            if self.tend is not None:
+                i1 = np.searchsorted(recs['tstamp'],
+                                     archive.to_epoch(self.tend), 'right')
+            self._markets[(exid, mid)] = recs[i0:i1]
+        return self._markets[(exid, mid)]
+
+    def _load_selection(self, exid, mid, sid):
+        recs = self._load_market(exid, mid)
+        return recs[recs['sid'] == sid]
+
+    def get_selection(self, exid, mid, sid, name=None):
+        """
+        Return Selection object for the first recorded prices of a
+        selection (typically used to create a strategy).  Since names
+        are not stored in the archive, the name is str(sid) if not
+        given.
+        """
+
+        recs = self._load_selection(exid, mid, sid)
+        if not len(recs):
+            return None
+        tmpl = Selection(exid, unicode(name or sid), sid, mid, None, None,
+                         None, None, None, [], [])
+        return _Series(recs[:1], tmpl).get_selection(0)
+
+    def add_strategy(self, strat, tstart=None, tend=None):
+        """
+        Add strategy to be run between tstart and tend (both
+        datetime.datetime, default is to run for the whole replay).
+        If tend is given, the strategy gets its time to live (see
+        MMStrategy.update_ttl) every tick, as it would from an
+        automation.
+        """
+
+        self._strategies.append((strat, tstart, tend))
+
+    def _setup(self):
+        """Load the prices and set up the matcher and order store."""
+
+        self.stratgroup = strategy.StrategyGroup()
+        self.ostore = BacktestOrderStore()
+
+        # the selections we need prices for
+        self._series = {}
+        for (strat, ts, te) in self._strategies:
+            for sel in strat.get_selections():
+                selid = (sel.exid, sel.mid, sel.id)
+                if selid not in self._series:
+                    recs = self._load_selection(*selid)
+                    if len(recs):
+                        self._series[selid] = _Series(recs, sel)
+
+        if self._series:
+            self._tstamps = np.unique(np.concatenate(
+                [s.tstamp for s in self._series.values()]))
+        else:
+            self._tstamps = np.zeros(0)
+
+        for s in self._series.values():
+            s.align(self._tstamps)
+
+        self.matcher = Matcher(self.ostore, self._series)
+
+        # all records sorted by tick, so that events[b[k]:b[k + 1]]
+        # are the (series, record) recorded on tick k.
+        slist = self._series.values()
+        ticks = np.concatenate([s.ticks for s in slist] + [[]])
+        snum = np.concatenate([np.repeat(i, len(s.ticks))
+                               for i, s in enumerate(slist)] + [[]])
+        recnum = np.concatenate([np.arange(len(s.ticks))
+                                 for s in slist] + [[]])
+        isort = np.argsort(ticks, kind='mergesort')
+        self._events = zip(snum[isort].astype(int).tolist(),
+                           recnum[isort].astype(int).tolist())
+        self._bounds = np.searchsorted(ticks[isort],
+                                       np.arange(len(self._tstamps) + 1))
+        self._slist = slist
+
+        # (exid, mid, sid) to strategies that read its prices
+        self._readers = {}
+        for (strat, ts, te) in self._strategies:
+            for selid in strat.get_selectionids():
+                self._readers.setdefault(selid, []).append(strat)
+
+        # strategies waiting to start, and running with an end time
+        self._waiting = list(self._strategies)
+        self._running = []
+
+        # the latest Selection object for each series
+        self._current = [None] * len(slist)
+
+    def _update_strategies(self, tnow):
+        """Add and remove strategies according to their start/end times."""
+
+        for item in list(self._waiting):
+            strat, ts, te = item
+            if (ts is None) or (tnow >= ts):
+                self._waiting.remove(item)
+                self._running.append(item)
+                self.stratgroup.add(strat)
+
+        for item in list(self._running):
+            strat, ts, te = item
+            if te is None:
+                continue
+            ttl = (te - tnow).total_seconds()
+            if ttl < 0:
+                self._running.remove(item)
+                self.stratgroup.remove(strat)
+            else:
+                strat.update_ttl(ttl)
+
+    def _get_prices(self, k):
+        """
+        Return prices dict for tick k, the set of (exid, mid, sid)
+        whose prices changed, and the list of strategies that read
+        any of the prices.
+        """
+
+        prices = {const.BDAQID: {}, const.BFID: {}}
+        changed = set()
+        strats = []
+        for (i, j) in self._events[self._bounds[k]:self._bounds[k + 1]]:
+            s = self._slist[i]
+            selid = (s.exid, s.mid, s.sid)
+            if s.changed[j] or (self._current[i] is None):
+                self._current[i] = s.get_selection(j)
+                changed.add(selid)
+            prices[s.exid].setdefault(s.mid, {})[s.sid] = self._current[i]
+            strats.extend(self._readers.get(selid, []))
+        return prices, changed, strats
+
+    def tick(self, k):
+        """Replay tick number k."""
+
+        tnow = _to_datetime(self._tstamps[k])
+
+        self._update_strategies(tnow)
+
+        # match any orders, and feed the order store to the
+        # strategies.
+        self.matcher.match(k)
+        self.stratgroup.update_orders(self.ostore)
+
+        # feed prices to strategies that would have got them.
+        prices, changed, strats = self._get_prices(k)
+        for strat in self.stratgroup:
+            setattr(strat, managers.UPDATED, False)
+        for strat in strats:
+            if (k % getattr(strat, managers.UTICK, 1)) == 0:
+                setattr(strat, managers.UPDATED, True)
+        self.stratgroup.update_prices_if(prices, managers.UPDATED, changed)
+
+        # cancel, update and make new orders
+        onew = self.stratgroup.get_orders_to_place_if(managers.UPDATED)
+        self.ostore.expect_orders(
+            onew, self.stratgroup.get_order_owners_if(managers.UPDATED))
+        self.matcher.make_orders(
+            self.stratgroup.get_orders_to_cancel_if(managers.UPDATED),
+            self.stratgroup.get_orders_to_update_if(managers.UPDATED),
+            onew, k, tnow)
+
+    def run(self):
+        """Replay all ticks and return results (see get_results)."""
+
+        self._setup()
+        for k in xrange(len(self._tstamps)):
+            self.tick(k)
+        return self.get_results()
+
+    def get_results(self):
+        """
+        Return array of RESULTDTYPE records, one for each strategy
+        (in the order they were added).
+        """
+
+        res = np.zeros(len(self._strategies), dtype=RESULTDTYPE)
+        for i, (strat, ts, te) in enumerate(self._strategies):
+            ptracker = position.PositionTracker(strat)
+            ptracker.ostore = self.ostore
+            sign, price, stake, mstake, ustake = ptracker.get_order_arrays()
+            res['norders'][i] = len(sign)
+            res['nmatched'][i] = np.sum(mstake > stake - _EPS)
+            res['placed'][i] = np.sum(stake)
+            res['matched'][i] = np.sum(mstake)
+            res['win'][i], res['lose'][i] = position.net_returns(sign, price,
+                                                                 mstake)
+            res['pwin'][i] = self._get_pwin(strat)
+        return res
+
+    def _get_pwin(self, strat):
+        """
+        Return probability of the strategy's selection winning,
+        implied by the mid price of the last recorded tick (for the
+        first selection of the strategy).
+        """
+
+        selids = [selid for selid in strat.get_selectionids()
+                  if selid in self._series]
+        if not selids:
+            return np.nan
+        s = self._series[selids[0]]
+        return 2.0 / (s.bback[-1] + s.blay[-1])
+
+def concatenate(reslist):
+    """Return single array of results from list of results arrays."""
+
+    if not reslist:
+        return np.zeros(0, dtype=RESULTDTYPE)
+    return np.concatenate(reslist)
+
+def summary(res, commission=0.05):
+    """Return dict summarising array res returned by Backtest.run.
+
+    The expected return of each strategy uses the implied probability
+    of winning at the last tick, and commission is taken from any
+    positive expected return.
+
+    """
+
+    eret = res['pwin'] * res['win'] + (1.0 - res['pwin']) * res['lose']
+    eret = np.where(eret > 0, eret * (1.0 - commission), eret)
+    placed = np.sum(res['placed'])
+    return {'strategies': len(res),
+            'orders': int(np.sum(res['norders'])),
+            'matched': int(np.sum(res['nmatched'])),
+            'fillrate': (np.sum(res['matched']) / placed) if placed else 0.0,
+            'locked': float(np.sum(np.minimum(res['win'], res['lose']))),
+            'expected': float(np.nansum(eret))}
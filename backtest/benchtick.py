@@ -0,0 +1,352 @@
+# benchtick.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Benchmark of Engine.tick against the simulated exchange.
+
+We run the engine (see core/engine.py) with 10, 100 and 1000 market
+making strategies (MMStrategy) against a SimExchange (see
+simulator.py), and time each phase of the tick:
+
+update_order_information - polling the exchanges for order status
+update_orders            - feeding the order store to the strategies
+update_prices            - polling the exchanges for prices
+update_prices_if         - feeding the prices to the strategies
+make_orders              - cancelling, updating and making orders
+tick                     - the whole of Engine.tick
+gc                       - garbage collection (see below)
+
+For each phase we report the median (p50) and 99th percentile (p99)
+time per tick in milliseconds, and the net number of objects
+allocated per tick (only objects the garbage collector tracks, i.e.
+containers, are counted).  So that these counts aren't reset by a
+collection halfway through a phase, the collector is switched off
+during each tick, and we then run the collection that would have
+happened, timed as the gc phase.  We also report the number of API
+calls (and requests for prices) per tick.
+
+The prices are a random walk generated from a fixed seed, and the
+exchange clock moves to the next recorded time before every tick, so
+every run sees the same prices and orders.  Use --archive to replay
+a real tick archive instead.  Each number of strategies is run in a
+new process, since the order and price stores are singletons.  The
+database and archive written by the engine are in a temporary
+directory.
+
+Results can be saved as a baseline (const.BENCHFILE), and later runs
+are compared with it: a phase whose p50 or p99 time is more than
+TOLERANCE slower than the baseline is reported as a regression.
+Typical use is:
+
+python benchtick.py           # compare with the baseline
+python benchtick.py --save    # save a new baseline
+
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from betman import const, database, exchangedata
+from betman.backtest import backtest
+from betman.backtest.simulator import SimExchange
+from betman.core import engine, managers
+from betman.core.config import GlobalConfig
+from betman.database import archive
+from betman.strategy.mmstrategy import MMStrategy
+
+# the phases of the tick we time (see Engine.tick), in order
+PHASES = ['update_order_information', 'update_orders', 'update_prices',
+          'update_prices_if', 'make_orders', 'tick', 'gc']
+
+# fractional slow down from the baseline that counts as a regression,
+# and the slow down in ms below which we don't care (timer noise).
+TOLERANCE = 0.2
+_NOISE = 0.05
+
+# selections per market in the generated archive
+_NSELS = 10
+
+def make_archive(adir, nsels, nticks, seed=0):
+    """
+    Write a random walk of prices for nsels selections over nticks
+    ticks (const.TICKLENGTH apart) to a tick archive in adir; half
+    of the markets are BDAQ and half BF.  Return the TickArchive.
+    """
+
+    tarchive = archive.TickArchive(adir)
+    rng = np.random.RandomState(seed)
+    t0 = time.time()
+    nmarkets = (nsels + _NSELS - 1) // _NSELS
+    for m in range(nmarkets):
+        exid = const.BDAQID if m % 2 == 0 else const.BFID
+        ladder = np.array(exchangedata.LADDERS[exid])
+        recs = np.zeros(nticks * _NSELS, dtype=archive.TICKDTYPE)
+        recs['back'] = recs['bvol'] = recs['lay'] = recs['lvol'] = np.nan
+        recs['tstamp'] = np.repeat(t0 + const.TICKLENGTH * np.arange(nticks),
+                                   _NSELS)
+        recs['sid'] = np.tile(np.arange(1, _NSELS + 1), nticks)
+        # best back price does a random walk on the odds ladder
+        # (between odds of about 1.5 and 10), and the spread is 1 to
+        # 4 ticks.
+        i0 = np.searchsorted(ladder, 1.5)
+        i1 = np.searchsorted(ladder, 10.0)
+        start = rng.randint(i0, i1, _NSELS)
+        steps = rng.randint(-1, 2, (nticks, _NSELS))
+        idx = np.clip(start + np.cumsum(steps, axis=0), i0, i1).ravel()
+        spread = rng.randint(1, 5, nticks * _NSELS)
+        for j in range(const.NUMPRICES - 2):
+            recs['back'][:, j] = ladder[idx - j]
+            recs['lay'][:, j] = ladder[idx + spread + j]
+            recs['bvol'][:, j] = rng.randint(2, 200, len(recs))
+            recs['lvol'][:, j] = rng.randint(2, 200, len(recs))
+        tarchive.append(exid, m + 1, recs)
+    return tarchive
+
+def _get_selections(tarchive, num):
+    """Return list of (exid, mid, sid) of the first num selections."""
+
+    selids = []
+    for exid, mid in sorted(tarchive.get_markets()):
+        sids = np.unique(tarchive.load_market(exid, mid)['sid'])
+        selids.extend([(exid, mid, sid) for sid in sids.tolist()])
+        if len(selids) >= num:
+            break
+    return selids[:num]
+
+def _collect():
+    """Run the garbage collection the interpreter would have run."""
+
+    counts = gc.get_count()
+    thresholds = gc.get_threshold()
+    for gen in (2, 1, 0):
+        if counts[gen] > thresholds[gen]:
+            gc.collect(gen)
+            return
+
+class _Timings(object):
+    """Time and allocations of each phase on every tick."""
+
+    def __init__(self):
+        self.times = {p: [] for p in PHASES}
+        self.allocs = {p: [] for p in PHASES}
+        self._tick = {}
+
+    def wrap(self, phase, func):
+        """Return func, timed as phase."""
+
+        def _timed(*args, **kwargs):
+            n0 = gc.get_count()[0]
+            t0 = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                dt = time.time() - t0
+                t, n = self._tick.get(phase, (0.0, 0))
+                self._tick[phase] = (t + dt, n + gc.get_count()[0] - n0)
+        return _timed
+
+    def end_tick(self, keep):
+        """Store this tick's numbers (if keep) and start a new tick."""
+
+        if keep:
+            for p in PHASES:
+                t, n = self._tick.get(p, (0.0, 0))
+                self.times[p].append(1000.0 * t)
+                self.allocs[p].append(n)
+        self._tick = {}
+
+def run(nstrats, nticks=200, warmup=20, latency=0.0, adir=None):
+    """Run the benchmark with nstrats strategies and return results.
+
+    nticks  - number of ticks we time.
+    warmup  - number of ticks run before we start timing.
+    latency - latency in seconds of the simulated exchange.
+    adir    - tick archive to replay (default is to generate one).
+
+    The result is a dict with keys 'phases' (dict of phase to dict
+    with keys 'p50', 'p99' (in ms) and 'allocs') and 'calls' (dict
+    of API method to calls per tick).  Since the order and price
+    stores are singletons, this should be run in a new process (see
+    run_all).
+
+    """
+
+    # everything the engine writes goes to tmpdir.  The API modules
+    # connected to the database when they were imported, so we
+    # reconnect to the new one.
+    tmpdir = tempfile.mkdtemp()
+    const.MASTERDB = os.path.join(tmpdir, 'bench.db')
+    const.ARCHIVEDIR = os.path.join(tmpdir, 'written')
+    database.DBMaster().close()
+    database.DBMaster()
+
+    try:
+        if adir is None:
+            tarchive = make_archive(os.path.join(tmpdir, 'replay'),
+                                    nstrats, nticks + warmup)
+        else:
+            tarchive = archive.TickArchive(adir)
+        selids = _get_selections(tarchive, nstrats)
+        markets = list(set([(exid, mid) for (exid, mid, sid) in selids]))
+
+        sim = SimExchange(tarchive, markets, latency)
+        sim.start()
+        sim.install()
+
+        eng = engine.Engine(GlobalConfig(os.path.join(tmpdir, 'cfg')))
+        # poll for order status on the exchange's clock
+        eng.omanager.poller = managers.OrderPoller(lambda: sim.tnow)
+
+        bt = backtest.Backtest(tarchive)
+        for selid in selids:
+            strat = MMStrategy(bt.get_selection(*selid))
+            setattr(strat, managers.UTICK, 1)
+            eng.add_strategy(strat)
+
+        timings = _Timings()
+        for name, obj in [('update_order_information', eng.omanager),
+                          ('make_orders', eng.omanager),
+                          ('update_prices', eng.pmanager),
+                          ('update_orders', eng.stratgroup),
+                          ('update_prices_if', eng.stratgroup)]:
+            setattr(obj, name, timings.wrap(name, getattr(obj, name)))
+        tick = timings.wrap('tick', eng.tick)
+        collect = timings.wrap('gc', _collect)
+
+        # the engine prints on every tick
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        gc.collect()
+        ncalls = {}
+        try:
+            k = 0
+            while (k < nticks + warmup) and sim.step():
+                if k == warmup:
+                    ncalls = dict(sim.ncalls)
+                gc.disable()
+                try:
+                    tick()
+                finally:
+                    gc.enable()
+                collect()
+                timings.end_tick(k >= warmup)
+                k += 1
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            sim.stop()
+
+        ntimed = max(k - warmup, 1)
+        phases = {}
+        for p in PHASES:
+            t = timings.times[p] or [0.0]
+            phases[p] = {'p50': float(np.percentile(t, 50)),
+                         'p99': float(np.percentile(t, 99)),
+                         'allocs': float(np.mean(timings.allocs[p] or [0]))}
+        calls = {name: float(n - ncalls.get(name, 0)) / ntimed
+                 for name, n in sim.ncalls.items()}
+        return {'phases': phases, 'calls': calls}
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def _run_job(args):
+    return args[0], run(*args)
+
+def run_all(sizes, nticks, warmup, latency, adir):
+    """Run the benchmark for each number of strategies in sizes.
+
+    Returns dict with keys str(nstrats) (so that the results can be
+    stored as json) and values as returned by run.
+
+    """
+
+    jobs = [(n, nticks, warmup, latency, adir) for n in sizes]
+    # a new process for each job
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return {str(n): res for n, res in pool.map(_run_job, jobs, 1)}
+    finally:
+        pool.close()
+        pool.join()
+
+def compare(results, baseline):
+    """
+    Return list of (nstrats, phase, stat, baseline, new) for every
+    time in results more than TOLERANCE slower than in baseline.
+    """
+
+    regressions = []
+    for n, res in sorted(results.items(), key=lambda r: int(r[0])):
+        if n not in baseline:
+            continue
+        for p in PHASES:
+            for stat in ['p50', 'p99']:
+                old = baseline[n]['phases'][p][stat]
+                new = res['phases'][p][stat]
+                if (new > old * (1.0 + TOLERANCE)) and (new - old > _NOISE):
+                    regressions.append((int(n), p, stat, old, new))
+    return regressions
+
+def print_results(results, baseline=None):
+    """Print table of results (as returned by run_all)."""
+
+    for n, res in sorted(results.items(), key=lambda r: int(r[0])):
+        print '{0} strategies'.format(n)
+        print '{0:>25} {1:>9} {2:>9} {3:>9} {4:>9}'.\
+              format('phase', 'p50 ms', 'p99 ms', 'allocs', 'base p50')
+        for p in PHASES:
+            ph = res['phases'][p]
+            base = ''
+            if baseline and n in baseline:
+                base = '{0:9.3f}'.format(baseline[n]['phases'][p]['p50'])
+            print '{0:>25} {1:9.3f} {2:9.3f} {3:9.0f} {4:>9}'.\
+                  format(p, ph['p50'], ph['p99'], ph['allocs'], base)
+        print 'calls per tick:', ', '.join(['{0} {1:.2f}'.format(k, v) for
+                                           k, v in sorted(res['calls'].items())])
+        print
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Engine.tick')
+    parser.add_argument('--strategies', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--ticks', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency of each exchange call in seconds')
+    parser.add_argument('--archive', default=None,
+                        help='tick archive to replay')
+    parser.add_argument('--baseline', default=const.BENCHFILE)
+    parser.add_argument('--save', action='store_true',
+                        help='save results as the new baseline')
+    args = parser.parse_args()
+
+    results = run_all(args.strategies, args.ticks, args.warmup,
+                      args.latency, args.archive)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print 'saved baseline to', args.baseline
+    elif baseline:
+        regressions = compare(results, baseline)
+        for (n, p, stat, old, new) in regressions:
+            print 'REGRESSION {0} strategies {1} {2}: {3:.3f} -> {4:.3f} ms'.\
+                  format(n, p, stat, old, new)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# book.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Order book of a single selection for the simulated exchange.
+
+The book holds the recorded prices of the selection (i.e. everyone
+else's unmatched orders, as we got them from the exchange), plus our
+own unmatched orders, and matches our orders with price-time
+priority:
+
+(i) a new order is first matched against the recorded prices it
+crosses, best price first (e.g. a back order at price p against the
+prices on offer to back of at least p).  We remember how much of the
+recorded volume we took, so that two of our orders can't take the
+same volume before the next recorded prices come in.
+
+(ii) what is left of the order rests in the book, at the back of the
+queue at its price.  Since the recorded prices don't tell us about
+individual orders, the queue at a price is the recorded volume that
+was there when we joined (which is ahead of us), followed by our
+own orders in the order they were placed.  Volume that turns up at
+the price later on is behind us.
+
+(iii) when the next recorded prices come in, the recorded volume at
+the price of each of our queues may have gone down.  If our price
+was the best on offer, we take it that this volume was matched, so
+it comes off the front of the queue: first the volume ahead of us,
+then our own orders.  Otherwise the volume must have been
+cancelled, and we take it that it was cancelled from the whole
+queue evenly, i.e. the volume ahead of us goes down in proportion.
+Any of our orders that the new prices cross are then matched as for
+a new order (this is the only way the Matcher in backtest.py
+matches orders).
+
+Note our orders are matched at their own price, even if they were
+matched against a better one.  Prices are only compared to the
+nearest 0.01, which is enough for the odds ladders of both
+exchanges.
+
+"""
+
+from collections import deque
+from betman import order
+
+# small number used for fp arithmetic
+_EPS = 0.000001
+
+def _key(price):
+    """Key for a price: the price in hundredths, as an integer."""
+
+    return int(round(price * 100))
+
+def _volume(side, pkey):
+    """Return volume at price with key pkey on one side of the book."""
+
+    for (p, v) in side:
+        if _key(p) == pkey:
+            return v
+    return 0.0
+
+def _crosses(polarity, bookp, price):
+    """Can an order of ours at price be matched against bookp?"""
+
+    if polarity == order.BACK:
+        return bookp >= price - _EPS
+    return bookp <= price + _EPS
+
+def _fill(o, amount):
+    """Match amount of order o."""
+
+    o.matchedstake += amount
+    o.unmatchedstake -= amount
+    if o.unmatchedstake < _EPS:
+        o.unmatchedstake = 0.0
+        o.status = order.MATCHED
+
+class _Queue(object):
+    """Our orders resting at a single price."""
+
+    __slots__ = ('ahead', 'orders')
+
+    def __init__(self, ahead):
+        # recorded volume ahead of the first of our orders
+        self.ahead = ahead
+        self.orders = deque()
+
+class Book(object):
+    """Recorded prices and our own orders for a single selection."""
+
+    def __init__(self):
+        # recorded (price, volume) pairs, best price first, on offer
+        # to back and to lay.
+        self.back = []
+        self.lay = []
+
+        # recorded volume we have taken since the recorded prices
+        # last changed.  Keys are (polarity, price key) where
+        # polarity is that of our orders that took it.
+        self._taken = {}
+
+        # our resting orders.  Keys are (polarity, price key), values
+        # _Queue.  A back order of ours is on offer to lay, and a lay
+        # order on offer to back.
+        self._queues = {}
+
+    def _take_side(self, polarity):
+        return self.back if polarity == order.BACK else self.lay
+
+    def _take(self, o):
+        """
+        Match as much of order o as we can against the recorded
+        prices it crosses; return True if any of it was matched.
+        """
+
+        matched = False
+        for (p, v) in self._take_side(o.polarity):
+            if (o.unmatchedstake < _EPS or
+                not _crosses(o.polarity, p, o.price)):
+                break
+            k = (o.polarity, _key(p))
+            avail = v - self._taken.get(k, 0.0)
+            if avail < _EPS:
+                continue
+            amount = min(avail, o.unmatchedstake)
+            self._taken[k] = self._taken.get(k, 0.0) + amount
+            _fill(o, amount)
+            matched = True
+        return matched
+
+    def place(self, o):
+        """
+        Place order o, which should have status UNMATCHED and
+        matchedstake and unmatchedstake set.  Anything we can't match
+        straight away joins the back of the queue at its price.
+        """
+
+        self._take(o)
+        if o.status != order.UNMATCHED:
+            return
+        k = (o.polarity, _key(o.price))
+        if k not in self._queues:
+            # the recorded volume at our price is ahead of us; note a
+            # back order of ours joins the prices on offer to lay.
+            side = self.lay if o.polarity == order.BACK else self.back
+            self._queues[k] = _Queue(_volume(side, k[1]))
+        self._queues[k].orders.append(o)
+
+    def remove(self, o):
+        """Take order o out of its queue (it loses its place)."""
+
+        k = (o.polarity, _key(o.price))
+        q = self._queues.get(k)
+        if q is None:
+            return
+        try:
+            q.orders.remove(o)
+        except ValueError:
+            return
+        if not q.orders:
+            del self._queues[k]
+
+    def update(self, back, lay):
+        """
+        Set new recorded prices back and lay (lists of (price,
+        volume) pairs, best price first), and return list of our
+        orders that were matched (in part or in full).
+        """
+
+        # the recorded prices each of our queues is in, before and
+        # after.
+        old = {order.BACK: self.lay, order.LAY: self.back}
+        new = {order.BACK: lay, order.LAY: back}
+        self.back = back
+        self.lay = lay
+        self._taken = {}
+
+        changed = []
+        for (pol, pkey), q in self._queues.items():
+            vold = _volume(old[pol], pkey)
+            vnew = _volume(new[pol], pkey)
+            if vnew > vold - _EPS:
+                continue
+            oside = old[pol]
+            if pol == order.BACK:
+                best = (not oside) or (pkey <= _key(oside[0][0]))
+            else:
+                best = (not oside) or (pkey >= _key(oside[0][0]))
+            if best:
+                self._advance(q, vold - vnew, changed)
+            else:
+                q.ahead *= vnew / vold
+
+        # match anything the new prices cross.  Our lowest back
+        # orders and highest lay orders are the best on offer, so
+        # these are matched first.
+        for pol, pkey in sorted(self._queues,
+                                key=lambda k: k[1] if k[0] == order.BACK
+                                else -k[1]):
+            q = self._queues[(pol, pkey)]
+            for o in list(q.orders):
+                if self._take(o):
+                    changed.append(o)
+                    if o.status == order.MATCHED:
+                        q.orders.remove(o)
+
+        for k in [k for k, q in self._queues.items() if not q.orders]:
+            del self._queues[k]
+        return changed
+
+    def _advance(self, q, traded, changed):
+        """Match volume traded from the front of queue q."""
+
+        ahead = min(q.ahead, traded)
+        q.ahead -= ahead
+        traded -= ahead
+        while (traded > _EPS) and q.orders:
+            o = q.orders[0]
+            amount = min(traded, o.unmatchedstake)
+            _fill(o, amount)
+            traded -= amount
+            changed.append(o)
+            if o.status == order.MATCHED:
+                q.orders.popleft()
+
+    def _side(self, recorded, polarity, reverse):
+        """
+        Return (price, volume) pairs on offer on one side of the
+        book, with the recorded volume our orders of the given
+        polarity have taken removed, and our own orders of the other
+        polarity added.
+        """
+
+        vols = {}
+        for (p, v) in recorded:
+            k = _key(p)
+            v -= self._taken.get((polarity, k), 0.0)
+            if v > _EPS:
+                vols[k] = [p, v]
+        own = order.LAY if polarity == order.BACK else order.BACK
+        for (pol, pkey), q in self._queues.items():
+            if pol == own:
+                v = sum(o.unmatchedstake for o in q.orders)
+                if pkey in vols:
+                    vols[pkey][1] += v
+                else:
+                    vols[pkey] = [q.orders[0].price, v]
+        return [tuple(vols[k]) for k in sorted(vols, reverse=reverse)]
+
+    def get_prices(self):
+        """
+        Return (back, lay), the lists of (price, volume) pairs on
+        offer to back and to lay, best price first, including our own
+        orders.  This is what the exchange would show.
+        """
+
+        return (self._side(self.back, order.BACK, True),
+                self._side(self.lay, order.LAY, False))
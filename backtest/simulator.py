@@ -0,0 +1,589 @@
+# simulator.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Local stand-in for the BDAQ and BF exchanges.
+
+The SimExchange replays prices recorded in the tick archive (see
+database/archive.py; an archive can be built from the histselections
+table with archive.archive_from_db), and lets us place, update and
+cancel orders against them, with each selection's orders matched by
+a price-time priority Book (see book.py).  It is for running the
+engine offline: to load test it at realistic order rates, and to
+benchmark the whole tick loop deterministically.
+
+The prices are served over HTTP by a local server, in the formats
+of the BDAQ and BF non-API price pages, so the engine fetches and
+parses them exactly as it does for real (see update_prices in
+core/multi.py).  The prices served include our own unmatched orders.
+
+The order methods of the APIs are SOAP calls made through suds, and
+here we replace them (see install) with methods that return what
+the API parsing functions would, e.g. PlaceOrdersNoReceipt returns a
+dict of UNMATCHED orders keyed by order reference, and the matched
+stakes turn up later from ListOrdersChangedSince.  Each call (and
+each request for prices) can be given a latency, to stand in for
+the round trip to the exchange.
+
+The clock of the exchange only moves when we tell it to: step moves
+it to the next recorded time, so that a benchmark sees the same
+prices and matches on every run.  Alternatively play moves it in
+(scaled) real time on a separate thread.  Typical use is:
+
+sim = SimExchange(latency=0.05)
+sim.start()
+sim.install()
+while sim.step():
+    engine.tick()
+
+"""
+
+import BaseHTTPServer
+import SocketServer
+import copy
+import datetime
+import json
+import re
+import threading
+import time
+import urlparse
+import zlib
+import numpy as np
+from betman import const, order
+from betman.database import archive
+from betman.backtest.book import Book
+
+# the BF non-API price page we serve (the engine adds the types and
+# marketIds).
+_BFPATH = '/bf?currencyCode=GBP&alt=json&locale=en_GB'
+_BDAQPATH = '/bdaq?'
+
+# matches a (quoted) name in json output; the BDAQ price page doesn't
+# quote its names (see _correct_json in bdaqnonapiparse.py).
+_NAMERE = re.compile(r'"([a-zA-Z]\w*)":')
+
+def _pairs(prices, vols):
+    """Return (price, volume) pairs from a recorded side of the book."""
+
+    # note p == p is False if p is NaN, i.e. there is no price.
+    return [(p, v) for (p, v) in zip(prices, vols) if p == p]
+
+def _bdaq_side(pairs):
+    # a single price is sent as a dict rather than a list
+    so = [{'p': p, 'rA': v} for (p, v) in pairs]
+    return so[0] if len(so) == 1 else so
+
+def _bf_side(pairs):
+    return [{'price': p, 'size': v} for (p, v) in pairs]
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the price pages of the simulated exchange."""
+
+    # keep-alive, as for the real websites (see HTTPPool in
+    # api/apiclient.py).
+    protocol_version = 'HTTP/1.1'
+
+    # send the headers and body together (the response is flushed
+    # after each request), or we wait on the client's delayed ACK.
+    wbufsize = -1
+
+    def do_GET(self):
+        sim = self.server.sim
+        parts = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(parts.query)
+        if parts.path == '/bdaq':
+            mids = [int(m) for m in query.get('mid', [])]
+            code, body = sim.get_prices_page(const.BDAQID, mids)
+        elif parts.path == '/bf':
+            mids = [int(m.split('.')[1]) for m in
+                    query.get('marketIds', [''])[0].split(',') if m]
+            code, body = sim.get_prices_page(const.BFID, mids)
+        else:
+            code, body = 404, 'Not Found'
+
+        gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzip:
+            comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = comp.compress(body) + comp.flush()
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't write every request to stderr
+        pass
+
+class SimExchange(object):
+    """Simulated BDAQ and BF exchanges replaying recorded prices."""
+
+    def __init__(self, tarchive=None, markets=None, latency=0.0,
+                 maxmids=None):
+        """
+        tarchive - archive.TickArchive to replay (default is the
+                   archive in const.ARCHIVEDIR).
+        markets  - list of (exid, mid) to replay (default is every
+                   market in the archive).
+        latency  - time in seconds each API call and request for
+                   prices takes.
+        maxmids  - if given, a request for the prices of more than
+                   this many markets gets HTTP 400 (as the real
+                   websites do, see ChunkedNonApiMethod).
+        """
+
+        tarchive = tarchive or archive.TickArchive()
+        if markets is None:
+            markets = tarchive.get_markets()
+        self.latency = latency
+        self.maxmids = maxmids
+
+        # recorded prices of each market, and the number of them we
+        # have replayed.
+        self._recs = {}
+        self._nrecs = {}
+        for (exid, mid) in markets:
+            recs = tarchive.load_market(exid, mid)
+            if len(recs):
+                self._recs[(exid, mid)] = recs
+                self._nrecs[(exid, mid)] = 0
+
+        # every recorded time, and the index of the current one.
+        if self._recs:
+            self.times = np.unique(np.concatenate(
+                [r['tstamp'] for r in self._recs.values()]))
+        else:
+            self.times = np.zeros(0)
+        self._k = -1
+        self.tnow = None
+
+        # keys are (exid, mid), values are dicts mapping selection id
+        # to Book.
+        self._books = {}
+
+        # all orders placed, keyed by (exid, oref).  These are our
+        # own copies: the API methods hand out copies of them.
+        self._orders = {}
+        self._oref = 0L
+
+        # BDAQ orders that have changed since the last call to
+        # ListOrdersChangedSince.
+        self._bdaqchanged = {}
+
+        # number of calls made to each API method, and of requests
+        # for prices.
+        self.ncalls = {}
+
+        # the HTTP server and the thread playing the prices
+        self._server = None
+        self._player = None
+        self._stop = threading.Event()
+        self.url = None
+
+        # attributes replaced by install
+        self._saved = []
+
+        # the API methods (called from the thread pool in multi.py)
+        # and the HTTP server threads share the books.
+        self._lock = threading.RLock()
+
+    # the clock
+
+    def step(self):
+        """
+        Move to the next recorded time, and match our orders against
+        the prices recorded then.  Return False if there are no more
+        recorded prices.
+        """
+
+        if self._k + 1 >= len(self.times):
+            return False
+        self._k += 1
+        self._set_time(self.times[self._k])
+        return True
+
+    def _set_time(self, t):
+        with self._lock:
+            self.tnow = t
+            for key, recs in self._recs.items():
+                i = self._nrecs[key]
+                j = np.searchsorted(recs['tstamp'], t, 'right')
+                if j == i:
+                    continue
+                self._nrecs[key] = j
+                # the latest record of each selection
+                latest = {}
+                for n, sid in enumerate(recs['sid'][i:j].tolist()):
+                    latest[sid] = i + n
+                books = self._books.setdefault(key, {})
+                for sid, n in latest.items():
+                    rec = recs[n]
+                    back = _pairs(rec['back'].tolist(), rec['bvol'].tolist())
+                    lay = _pairs(rec['lay'].tolist(), rec['lvol'].tolist())
+                    if sid not in books:
+                        books[sid] = Book()
+                    for o in books[sid].update(back, lay):
+                        self._changed(o)
+
+    def play(self, speed=1.0):
+        """
+        Move through the recorded times on a separate thread, speed
+        times faster than they were recorded.
+        """
+
+        def _play():
+            wall0 = time.time()
+            t0 = self.times[self._k + 1]
+            while not self._stop.is_set():
+                if self._k + 1 >= len(self.times):
+                    break
+                wait = ((self.times[self._k + 1] - t0) / speed
+                        - (time.time() - wall0))
+                if wait > 0:
+                    self._stop.wait(wait)
+                else:
+                    self.step()
+
+        if len(self.times) > self._k + 1:
+            self._stop.clear()
+            self._player = threading.Thread(target=_play)
+            self._player.setDaemon(True)
+            self._player.start()
+
+    def get_datetime(self):
+        """Return current time of the exchange as a datetime.datetime."""
+
+        if self.tnow is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.tnow)
+
+    # the HTTP server
+
+    def start(self, port=0):
+        """
+        Start serving prices on localhost (port 0 means any free
+        port); self.url is set to the address of the server.
+        """
+
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.sim = self
+        self.url = 'http://127.0.0.1:{0}'.format(self._server.server_port)
+        t = threading.Thread(target=self._server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    def stop(self):
+        """Stop the HTTP server and the clock, and call uninstall."""
+
+        self._stop.set()
+        if self._player is not None:
+            self._player.join()
+            self._player = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.uninstall()
+
+    def _call(self, name):
+        """Count call to name and wait for the latency."""
+
+        with self._lock:
+            self.ncalls[name] = self.ncalls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _live(self, key):
+        """Are we between the first and last recorded prices of market?"""
+
+        recs = self._recs.get(key)
+        return ((recs is not None) and (self._nrecs[key] > 0) and
+                (self.tnow <= recs['tstamp'][-1]))
+
+    def get_prices_page(self, exid, mids):
+        """
+        Return (HTTP status, body) of the non-API price page of
+        exchange exid for market ids mids.  Markets we have no
+        prices for (either not yet or no longer) are left out, as
+        they are by the real websites.
+        """
+
+        self._call('prices')
+        if self.maxmids is not None and len(mids) > self.maxmids:
+            return 400, 'Bad Request'
+
+        with self._lock:
+            markets = []
+            for mid in mids:
+                if not self._live((exid, mid)):
+                    continue
+                sels = []
+                for sid, book in sorted(self._books[(exid, mid)].items()):
+                    back, lay = book.get_prices()
+                    sels.append((sid, back[:const.NUMPRICES],
+                                 lay[:const.NUMPRICES]))
+                markets.append((mid, sels))
+
+        if exid == const.BDAQID:
+            return 200, self._bdaq_page(markets)
+        return 200, self._bf_page(markets)
+
+    def _bdaq_page(self, markets):
+        if not markets:
+            # what BDAQ sends if none of the markets are active
+            return 'EmptyResponse'
+        ecs = []
+        for mid, sels in markets:
+            jsels = []
+            for sid, back, lay in sels:
+                jsel = {'sId': sid, 'mId': mid, 'sN': str(sid), 'sRC': 0}
+                if back:
+                    jsel['fSO'] = _bdaq_side(back)
+                if lay:
+                    jsel['aSO'] = _bdaq_side(lay)
+                jsels.append(jsel)
+            ecs.append({'mkt': {'mId': mid, 'wSN': 0, 'sel': jsels}})
+        data = {'ArrayOfEventClassifier': {'EventClassifier': ecs}}
+        return _NAMERE.sub(r'\1 :', json.dumps(data))
+
+    def _bf_page(self, markets):
+        nodes = []
+        for mid, sels in markets:
+            runners = []
+            for sid, back, lay in sels:
+                ex = {}
+                if back:
+                    ex['availableToBack'] = _bf_side(back)
+                if lay:
+                    ex['availableToLay'] = _bf_side(lay)
+                runners.append({'selectionId': sid,
+                                'description': {'runnerName': str(sid)},
+                                'exchange': ex})
+            nodes.append({'marketId': '1.{0}'.format(mid),
+                          'runners': runners})
+        return json.dumps({'eventTypes':
+                           [{'eventNodes': [{'marketNodes': nodes}]}]})
+
+    # orders
+
+    def _get_book(self, o):
+        books = self._books.setdefault((o.exid, o.mid), {})
+        if o.sid not in books:
+            books[o.sid] = Book()
+        return books[o.sid]
+
+    def _changed(self, o):
+        o.tupdated = self.get_datetime()
+        if o.exid == const.BDAQID:
+            self._bdaqchanged[o.oref] = o
+
+    def _place(self, o):
+        """Place a copy of order o and return it."""
+
+        o = copy.copy(o)
+        self._oref += 1
+        o.oref = self._oref
+        o.status = order.UNMATCHED
+        o.matchedstake = 0.0
+        o.unmatchedstake = o.stake
+        o.tplaced = self.get_datetime()
+        self._get_book(o).place(o)
+        self._orders[(o.exid, o.oref)] = o
+        self._changed(o)
+        return o
+
+    def _cancel(self, o):
+        """Cancel our copy of order o; return False if not unmatched."""
+
+        if o.status != order.UNMATCHED:
+            return False
+        self._get_book(o).remove(o)
+        o.status = order.CANCELLED
+        o.unmatchedstake = 0.0
+        self._changed(o)
+        return True
+
+    def _update(self, o, price, stake):
+        """
+        Change price and stake of our copy of unmatched order o.
+        Reducing the stake keeps the order's place in the queue,
+        anything else sends it to the back (and it may be matched
+        straight away at a new price).
+        """
+
+        book = self._get_book(o)
+        delta = stake - o.stake
+        if o.unmatchedstake + delta < 0.0:
+            delta = -o.unmatchedstake
+        if price == o.price and delta <= 0.0:
+            o.stake += delta
+            o.unmatchedstake += delta
+            if o.unmatchedstake == 0.0:
+                book.remove(o)
+                o.status = (order.MATCHED if o.matchedstake > 0.0
+                            else order.CANCELLED)
+        else:
+            book.remove(o)
+            o.price = price
+            o.stake += delta
+            o.unmatchedstake += delta
+            book.place(o)
+        self._changed(o)
+
+    def _status(self, o, myo):
+        """Set status and stakes of order o to those of our copy myo."""
+
+        o.status = myo.status
+        o.matchedstake = myo.matchedstake
+        o.unmatchedstake = myo.unmatchedstake
+        o.tupdated = myo.tupdated
+
+    # BDAQ API methods (see bdaqapi.py)
+
+    def ListBootstrapOrders(self, snum=-1):
+        self._call('ListBootstrapOrders')
+        return {}
+
+    def ListOrdersChangedSince(self, seqnum=None):
+        self._call('ListOrdersChangedSince')
+        with self._lock:
+            changed = self._bdaqchanged
+            self._bdaqchanged = {}
+            return {oref: copy.copy(o) for oref, o in changed.items()}
+
+    def PlaceOrdersNoReceipt(self, orderlist):
+        self._call('PlaceOrdersNoReceipt')
+        orders = {}
+        with self._lock:
+            for o in orderlist:
+                myo = self._place(o)
+                # as from the API, the order is unmatched for now; we
+                # find out about any match with ListOrdersChangedSince.
+                o = copy.copy(myo)
+                o.status = order.UNMATCHED
+                o.matchedstake = 0.0
+                o.unmatchedstake = o.stake
+                orders[o.oref] = o
+        return orders
+
+    def UpdateOrders(self, orderlist):
+        self._call('UpdateOrders')
+        with self._lock:
+            for o in orderlist:
+                myo = self._orders.get((const.BDAQID, o.oref))
+                if (myo is not None) and (myo.status == order.UNMATCHED):
+                    # the price is already the new price
+                    delta = getattr(o, 'deltastake', 0.0)
+                    self._update(myo, o.price, o.stake + delta)
+                    o.stake = myo.stake
+                    if delta:
+                        del o.deltastake
+        return {o.oref: o for o in orderlist}
+
+    def CancelOrders(self, olist):
+        self._call('CancelOrders')
+        orders = {}
+        with self._lock:
+            for o in olist:
+                myo = self._orders.get((const.BDAQID, o.oref))
+                if (myo is not None) and self._cancel(myo):
+                    o.status = order.CANCELLED
+                    o.tupdated = myo.tupdated
+                    orders[o.oref] = o
+        return orders
+
+    # BF API methods (see bfapi.py)
+
+    def Login(self):
+        self._call('Login')
+
+    def PlaceBets(self, olist):
+        self._call('PlaceBets')
+        with self._lock:
+            return {myo.oref: copy.copy(myo) for myo in
+                    [self._place(o) for o in olist]}
+
+    def UpdateBets(self, olist):
+        """
+        As on BF, changing the price of an order cancels what is
+        left of it, and makes a new order (with a new reference) at
+        the new price.
+        """
+
+        self._call('UpdateBets')
+        orders = {}
+        with self._lock:
+            for o in olist:
+                orders[o.oref] = o
+                myo = self._orders.get((const.BFID, o.oref))
+                if (myo is None) or (myo.status != order.UNMATCHED):
+                    continue
+                newprice = getattr(o, 'newprice', o.price)
+                newstake = getattr(o, 'newstake', o.stake)
+                if newprice == myo.price:
+                    self._update(myo, myo.price, newstake)
+                    self._status(o, myo)
+                    o.stake = myo.stake
+                else:
+                    stake = myo.unmatchedstake
+                    self._cancel(myo)
+                    self._status(o, myo)
+                    newo = copy.copy(myo)
+                    newo.price = newprice
+                    newo.stake = stake
+                    newo = self._place(newo)
+                    orders[newo.oref] = copy.copy(newo)
+        return orders
+
+    def CancelBets(self, olist):
+        self._call('CancelBets')
+        with self._lock:
+            for o in olist:
+                myo = self._orders.get((const.BFID, o.oref))
+                if myo is not None:
+                    self._cancel(myo)
+                    self._status(o, myo)
+        return {o.oref: o for o in olist}
+
+    def GetBetStatus(self, olist):
+        self._call('GetBetStatus')
+        with self._lock:
+            return {o.oref: copy.copy(self._orders[(const.BFID, o.oref)])
+                    for o in olist if (const.BFID, o.oref) in self._orders}
+
+    def install(self):
+        """
+        Point the engine at the simulated exchange: the non-API
+        price clients get their prices from our HTTP server (which
+        must have been started), and the order methods of bdaqapi
+        and bfapi are replaced by ours.  uninstall puts them back.
+        """
+
+        from betman.api.bdaq import bdaqapi
+        from betman.api.bf import bfapi
+
+        self.uninstall()
+        new = [(bdaqapi._ncl, 'pricesurl', self.url + _BDAQPATH),
+               (bfapi.cluknonapi, 'pricesurl', self.url + _BFPATH)]
+        for name in ['ListBootstrapOrders', 'ListOrdersChangedSince',
+                     'PlaceOrdersNoReceipt', 'UpdateOrders',
+                     'CancelOrders']:
+            new.append((bdaqapi, name, getattr(self, name)))
+        for name in ['Login', 'PlaceBets', 'UpdateBets', 'CancelBets',
+                     'GetBetStatus']:
+            new.append((bfapi, name, getattr(self, name)))
+
+        for obj, name, value in new:
+            self._saved.append((obj, name, getattr(obj, name)))
+            setattr(obj, name, value)
+
+    def uninstall(self):
+        for obj, name, value in reversed(self._saved):
+            setattr(obj, name, value)
+        self._saved = []
@@ -0,0 +1,220 @@
+# sweep.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Parameter sweeps of backtests.
+
+We backtest every combination of a grid of strategy parameters over
+every race we have recorded prices for.  Each (parameters, race) pair
+is a separate job for a multiprocessing pool; since the jobs are
+independent, this should scale with the number of cores.  The
+workers read prices from the tick archive, which is memory mapped
+read only (see database/archive.py), so the prices are shared
+between the workers via the OS page cache rather than copied.
+
+The parameters are those hard coded in the horse racing automation
+(see core/automation/hautomation.py), plus the maximum lay odds of
+CXStrategy:
+
+strategy - 'MM' (market making as the automation does) or 'CX'
+           (CXStrategy on the matching BDAQ and BF selections)
+exchange - 'BF', 'BDAQ' or 'BOTH' (market making only)
+maxlay   - only make markets with best lay below this (market making only)
+maxback  - only make markets with best back below this (market making only)
+ufreq    - update frequency of the strategies in (recorded) ticks
+startt   - minutes before the race start that we start
+endt     - minutes before the race start that we finish
+cxmaxlay - CXStrategy.MAXLAYODDS (CX only)
+
+Typical use is:
+
+races = get_races(database.DBMaster())
+res = sweep({'maxlay': [4, 6, 8], 'startt': [10, 20, 30]}, races)
+print_results(res)
+
+"""
+
+import datetime
+import itertools
+import multiprocessing
+from betman import database
+from betman.all.betexception import InternalError
+from betman.backtest import backtest
+from betman.core import managers
+from betman.core.automation.hautomation import MyAutomation
+from betman.database import archive
+from betman.strategy.mmstrategy import MMStrategy
+from betman.strategy.cxstrategy import CXStrategy
+from betman.strategy.bothmmstrategy import BothMMStrategy
+
+# parameters we use unless they are in the grid, which are the
+# values we use for real.
+DEFAULTS = {'strategy': 'MM',
+            'exchange': MyAutomation._EXCHANGE,
+            'maxlay':   MyAutomation._MAXLAY,
+            'maxback':  MyAutomation._MAXBACK,
+            'ufreq':    MyAutomation._UFREQ,
+            'startt':   MyAutomation._STARTT,
+            'endt':     MyAutomation._ENDT,
+            'cxmaxlay': CXStrategy.MAXLAYODDS}
+
+# archive used by each worker process (see _init_worker).
+_tarchive = None
+
+def get_races(dbman, tarchive=None, elist=['Horse Racing']):
+    """Return list of races we can backtest.
+
+    dbman    - database.DBMaster
+    tarchive - archive.TickArchive (default is const.ARCHIVEDIR)
+    elist    - list of BDAQ event names (see
+               DBMaster.return_market_matches)
+
+    Each race is a tuple (starttime, sels), where sels is a list of
+    the matching (BDAQ, BF) selections.  We only return races for
+    which we have prices in the archive for both markets.
+
+    """
+
+    tarchive = tarchive or archive.TickArchive()
+    have = set(tarchive.get_markets())
+
+    races = []
+    for m1, m2 in dbman.return_market_matches(elist):
+        if ((m1.exid, m1.id) in have) and ((m2.exid, m2.id) in have):
+            bdaqsels, bfsels = dbman.return_selection_matches([m1.id])
+            races.append((m1.starttime, zip(bdaqsels, bfsels)))
+    return races
+
+def param_grid(grid):
+    """Return list of parameter dicts for every combination in grid.
+
+    grid is a dict mapping parameter name to list of values; any
+    parameter not in grid takes its value from DEFAULTS.
+
+    """
+
+    for k in grid:
+        if k not in DEFAULTS:
+            raise InternalError, 'unknown parameter {0}'.format(k)
+
+    keys = sorted(grid)
+    plist = []
+    for vals in itertools.product(*[grid[k] for k in keys]):
+        params = dict(DEFAULTS)
+        params.update(zip(keys, vals))
+        plist.append(params)
+    return plist
+
+def make_strategy(params, bt, s1, s2):
+    """
+    Return strategy for matching selections s1 (BDAQ) and s2 (BF),
+    or None if we wouldn't run a strategy on them.  The selections
+    given to the strategy have the first prices in the backtest bt.
+    """
+
+    p1 = bt.get_selection(s1.exid, s1.mid, s1.id, s1._uname)
+    p2 = bt.get_selection(s2.exid, s2.mid, s2.id, s2._uname)
+    if (p1 is None) or (p2 is None):
+        return None
+
+    if params['strategy'] == 'CX':
+        strat = CXStrategy(p1, p2)
+        strat.MAXLAYODDS = params['cxmaxlay']
+    elif params['strategy'] == 'MM':
+        # same choice as MyAutomation.add_strategy
+        exch = params['exchange']
+        sbets = {'BDAQ': [p1], 'BF': [p2], 'BOTH': [p1, p2]}[exch]
+        for sbet in sbets:
+            if not ((sbet.best_lay() < params['maxlay']) and
+                    (sbet.best_back() < params['maxback'])):
+                return None
+        if exch == 'BOTH':
+            strat = BothMMStrategy(p1, p2)
+        else:
+            strat = MMStrategy(sbets[0], auto=True)
+    else:
+        raise InternalError, 'unknown strategy {0}'.format(params['strategy'])
+
+    setattr(strat, managers.UTICK, params['ufreq'])
+    return strat
+
+def backtest_race(params, race, tarchive=None):
+    """Return results array (see Backtest.run) for a single race."""
+
+    starttime, sels = race
+    tstart = starttime - datetime.timedelta(minutes=params['startt'])
+    tend = starttime - datetime.timedelta(minutes=params['endt'])
+
+    bt = backtest.Backtest(tarchive, tstart, tend)
+    for s1, s2 in sels:
+        strat = make_strategy(params, bt, s1, s2)
+        if strat is not None:
+            bt.add_strategy(strat, tend=tend)
+    return bt.run()
+
+def _init_worker(adir):
+    global _tarchive
+    _tarchive = archive.TickArchive(adir)
+
+def _run_job(job):
+    """Run a single job (in a worker process)."""
+
+    pnum, params, race = job
+    return pnum, backtest_race(params, race, _tarchive)
+
+def sweep(grid, races, nproc=None, adir=None):
+    """Backtest every combination of parameters in grid over races.
+
+    grid  - dict of parameter name to list of values (see param_grid)
+    races - list of races (see get_races)
+    nproc - number of worker processes (default is number of cores)
+    adir  - directory of the tick archive (default const.ARCHIVEDIR)
+
+    Returns a list of (params, summary) tuples (summary is a dict
+    returned by backtest.summary), ranked by expected P&L and then
+    fill rate.
+
+    """
+
+    plist = param_grid(grid)
+    jobs = [(pnum, params, race) for (pnum, params) in enumerate(plist)
+            for race in races]
+
+    pool = multiprocessing.Pool(nproc, _init_worker, (adir,))
+    try:
+        results = {}
+        # chunksize 1 since jobs (races) can take very different
+        # amounts of time.
+        for pnum, res in pool.imap_unordered(_run_job, jobs, 1):
+            results.setdefault(pnum, []).append(res)
+    finally:
+        pool.close()
+        pool.join()
+
+    ranked = []
+    for pnum, params in enumerate(plist):
+        res = backtest.concatenate(results.get(pnum, []))
+        ranked.append((params, backtest.summary(res)))
+    ranked.sort(key=lambda r: (r[1]['expected'], r[1]['fillrate']),
+                reverse=True)
+    return ranked
+
+def print_results(ranked, num=20):
+    """Print table of the top num results returned by sweep."""
+
+    keys = sorted(DEFAULTS)
+    print ' '.join(['{0:>8}'.format(k) for k in keys]), \
+          '   strats   orders  matched fillrate   locked expected'
+    for params, summ in ranked[:num]:
+        print ' '.join(['{0:>8}'.format(params[k]) for k in keys]), \
+              '{0:8d} {1:8d} {2:8d} {3:8.3f} {4:8.2f} {5:8.2f}'.\
+              format(summ['strategies'], summ['orders'], summ['matched'],
+                     summ['fillrate'], summ['locked'], summ['expected'])
+
+if __name__ == '__main__':
+    races = get_races(database.DBMaster())
+    print 'backtesting {0} races'.format(len(races))
+    ranked = sweep({'maxlay': [4, 6, 8, 10],
+                    'maxback': [4, 6, 8, 10],
+                    'startt': [10, 20, 30]}, races)
+    print_results(ranked)
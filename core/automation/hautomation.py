@@ -5,7 +5,6 @@ from betman.strategy.mmstrategy import MMStrategy
 from betman.core import managers, stores
 from betman.core.stores import updaters
 from betman.all.betexception import InternalError
-import wx
 
 # note class must be named MyAutomation for GUI loader
 class MyAutomation(Automation):
@@ -81,6 +80,7 @@ class MyAutomation(Automation):
         # store a reference to it.  This is so that when we add or
         # remove strategies we can also do this for the actual app.
         try:
+            import wx
             self.app = wx.GetApp()
         except:
             self.app = None
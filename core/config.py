@@ -21,11 +21,14 @@ class GlobalConfig(object):
     # ManyMarkets - controls whether we kill strategies for a
     # particular market after navigating away from that market.
     # (currently set to False, and not yet implemented)
+    # ThreadedEngine - make network calls on background threads so
+    # that a slow API call doesn't block the tick (see engine.py).
 
     BINARIES = [('BFLogin', 'Login to BF at startup', True),
                 ('EngineStart', 'Start engine at startup', False),
                 #('ManyMarkets', 'Keep trading on markets (NOT)', True),
-                ('PracticeMode', 'Practice Mode', False)]
+                ('PracticeMode', 'Practice Mode', False),
+                ('ThreadedEngine', 'Network calls in background', False)]
 
     def __init__(self, cfg):
         """Read configuration file and set my state.
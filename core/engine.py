@@ -1,5 +1,7 @@
+from betman import const, metrics, betlog
 from betman.strategy import strategy
 import managers
+import multi
 
 """The main engine of the betting application.
 
@@ -9,6 +11,18 @@ command-line based.
 
 """
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('engine')
+
+# time of each phase of the tick (see all/metrics.py); 'submit' is
+# only used by the ThreadedEngine.
+_TIMERS = {p: metrics.histogram('tick_seconds',
+                                'Time of each phase of the engine tick.',
+                                phase=p)
+           for p in ['automations', 'update_order_information',
+                     'update_orders', 'update_prices', 'update_prices_if',
+                     'make_orders', 'submit', 'tick']}
+
 class Engine(object):
     def __init__(self, config):
         """Setup configuration of the engine."""
@@ -28,6 +42,9 @@ class Engine(object):
         # counter to store how many times we have ticked
         self.ticks = 0L
 
+        if const.METRICSPORT is not None:
+            metrics.serve(const.METRICSPORT, const.METRICSHOST)
+
     def setup_managers(self, config):
         """Setup order manager and pricing manager."""
         
@@ -52,6 +69,16 @@ class Engine(object):
         
         self.stratgroup.remove(strat)
 
+    def set_price_depth(self, mids, depth):
+        """
+        Fetch at least depth prices on each side of the book for the
+        markets in mids, a dict with keys const.BDAQID and const.BFID,
+        e.g. for the market shown in the GUI.  If depth is None, go
+        back to the depth the strategies using the markets want.
+        """
+
+        self.pmanager.set_depth(mids, depth)
+
     def get_strategies(self):
         """Return list of currently executing strategies."""
 
@@ -71,6 +98,12 @@ class Engine(object):
             return True
         return False
 
+    def export_metrics(self):
+        """Write the metrics file every const.METRICSTICKS ticks."""
+
+        if (self.ticks % const.METRICSTICKS) == 0:
+            metrics.write(const.METRICSFILE)
+
     def tick(self):
         """Main loop called every tick.
         
@@ -79,12 +112,14 @@ class Engine(object):
         (i) update any 'automations' (which automatically add or
         remove strategies).
 
-        (ii) update order information (using BDAQ/BF API) every tick.
-        We then push this new order information to the strategies.
+        (ii) update order information (using BDAQ/BF API), if it is
+        time to poll each exchange (see managers.OrderPoller).  We
+        then push this new order information to the strategies.
 
         (iii) update price information (using BDAQ/BF API) for all
-        strategies whose update frequency exactly divides the current
-        tick number.  We push these prices to the strategies.  This
+        strategies that are due new prices (see
+        managers.PollScheduler).  We push these prices to the
+        strategies.  This
         triggers the AI for the strategies, which decides whether to
         cancel/modify/create orders etc.
 
@@ -92,41 +127,222 @@ class Engine(object):
         strategies that got new prices (i.e. in part (iii) above) on
         the current tick.
 
+        Each of these is timed (see all/metrics.py).
+
         """
 
+        t0 = metrics.clock()
         self.ticks += 1
 
         # handle any 'automations' we have.  All this does is adds or
         # removes strategies.  We only do this every 60 ticks (60
         # seconds if timebase is set to be 1 second).
-        if (self.ticks % 1) == 0:
-            for a in self.automations:
-                # note we are passing a the automation a reference to
-                # the engine, which it needs in order to add/remove
-                # strategies to the strategy group.
-                a.update(self)
+        with _TIMERS['automations'].time():
+            if (self.ticks % 1) == 0:
+                for a in self.automations:
+                    # note we are passing a the automation a reference
+                    # to the engine, which it needs in order to
+                    # add/remove strategies to the strategy group.
+                    a.update(self)
 
         # update the status of any outstanding (unmatched) orders by
         # polling BF and BDAQ.
-        self.omanager.update_order_information()
+        with _TIMERS['update_order_information'].time():
+            self.omanager.update_order_information()
 
         # feed the order store (which holds the newly updated orders)
         # to the strategies.
-        self.stratgroup.update_orders(self.omanager.ostore)
+        with _TIMERS['update_orders'].time():
+            self.stratgroup.update_orders(self.omanager.ostore)
 
         # get prices for any strategies in the strategy group that
         # want new prices this tick by polling BF and BDAQ.
-        self.pmanager.update_prices(self.ticks)
+        with _TIMERS['update_prices'].time():
+            self.pmanager.update_prices(self.ticks)
 
         # update strategies which got new prices this tick.  As well
         # as feeding the strategy the new prices, we do the thinking
         # 'AI' here, changing state, generating any new orders etc.
-        self.stratgroup.update_prices_if(self.pmanager.pstore.newprices,
-                                         managers.UPDATED)
+        with _TIMERS['update_prices_if'].time():
+            self.stratgroup.update_prices_if(self.pmanager.pstore.newprices,
+                                             managers.UPDATED,
+                                             self.pmanager.pstore.changed)
 
         # cancel, update, and make any new orders (note we only make
         # new orders for strategies that got new prices this tick, see
         # managers.py).
-        self.omanager.make_orders()
+        with _TIMERS['make_orders'].time():
+            self.omanager.make_orders()
+
+        _TIMERS['tick'].observe(metrics.clock() - t0)
+        self.export_metrics()
+
+        log.debug('TICKS {0}', self.ticks)
+
+class ThreadedEngine(Engine):
+    """Engine that makes all network calls off the main thread.
+
+    In Engine.tick, the automations, order polling, price polling and
+    order placement happen one after the other, so a single slow BDAQ
+    or BF call holds up the whole tick (and the GUI, which calls
+    tick).  Here, each of order polling, price polling and order
+    placement has its own background worker (see multi.Worker).  On
+    each tick we collect any results that arrived since the last
+    tick, feed them to the strategies, and then hand new requests to
+    any worker that is idle, so tick itself never waits on the
+    network.
+
+    """
+
+    def __init__(self, config):
+        super(ThreadedEngine, self).__init__(config)
+
+        self._oworker = multi.Worker('order status')
+        self._pworker = multi.Worker('prices')
+        self._mworker = multi.Worker('make orders')
+
+        # strategies that are due new prices, but haven't yet been
+        # sent to the price worker (because it was busy).
+        self._pending = []
+
+        # strategies whose prices the price worker is fetching.
+        self._fetching = []
+
+        # unmatched order dict the order status worker is polling for.
+        self._polling = None
+
+    def tick(self):
+        """Main loop called every tick.
+
+        We do the same things as Engine.tick, but we only ever
+        consume results from the background workers and submit new
+        requests to them, so that this returns without blocking.
+
+        (i) update any 'automations'.
+
+        (ii) collect the results of any orders made since the last
+        tick, and the latest order information, and push this to the
+        strategies.
+
+        (iii) collect any new prices, and push them to the strategies
+        whose prices were fetched (this triggers the AI).
+
+        (iv) queue any orders these strategies want to cancel, update
+        or make.
+
+        (v) submit new order status and price requests to the
+        workers if they are idle.
+
+        """
+
+        t0 = metrics.clock()
+        self.ticks += 1
+
+        with _TIMERS['automations'].time():
+            for a in self.automations:
+                a.update(self)
 
-        print 'TICKS', self.ticks
+        # results of making orders (these must be in the order store
+        # before we process the order status updates, so that we know
+        # about any new BF orders).  If more than one batch of orders
+        # finished since the last tick, merge them so that the store's
+        # 'latest' orders include all of them.
+        with _TIMERS['update_order_information'].time():
+            mresults, merrors = self._mworker.get_results()
+            if mresults:
+                made = [{const.BDAQID: {}, const.BFID: {}} for i in range(3)]
+                failed = {const.BDAQID: [], const.BFID: []}
+                for res in mresults:
+                    for mdict, rdict in zip(made, res[:3]):
+                        for exid in rdict:
+                            mdict[exid].update(rdict[exid])
+                    for exid in res[3]:
+                        failed[exid].extend(res[3][exid])
+                self.omanager.process_made_orders(*made, failed=failed)
+            else:
+                self.omanager.clear_latest()
+
+            # results of polling order status.
+            oresults, oerrors = self._oworker.get_results()
+            if oresults:
+                for updates in oresults:
+                    self.omanager.process_order_information(self._polling,
+                                                            updates)
+                self._polling = None
+            else:
+                self.omanager.ostore.latest_updates.update({const.BDAQID: {},
+                                                            const.BFID: {}})
+
+        with _TIMERS['update_orders'].time():
+            self.stratgroup.update_orders(self.omanager.ostore)
+
+        # results of fetching prices; only the strategies we fetched
+        # prices for are flagged as UPDATED.
+        with _TIMERS['update_prices'].time():
+            presults, perrors = self._pworker.get_results()
+            if presults:
+                for new_prices, emids in presults:
+                    self.pmanager.process_prices(new_prices, emids)
+                strats = [s for s in self._fetching if s in self.stratgroup.strategies]
+                self._fetching = []
+            else:
+                # no new prices this tick.
+                self.pmanager.pstore.clear_newprices()
+                strats = []
+            self.pmanager.set_updated(strats)
+
+        with _TIMERS['update_prices_if'].time():
+            self.stratgroup.update_prices_if(self.pmanager.pstore.newprices,
+                                             managers.UPDATED,
+                                             self.pmanager.pstore.changed)
+
+        # orders are made in the order we queue them, so we never
+        # drop orders even if the make orders worker is busy.
+        with _TIMERS['make_orders'].time():
+            orders = self.omanager.collect_orders()
+            if orders is not None:
+                self._mworker.submit(multi.make_orders, *orders)
+
+        # order status is polled when the order manager says it is
+        # due (see managers.OrderPoller), unless the previous poll is
+        # still running, or we have orders being made whose results
+        # we haven't yet put in the order store.  Otherwise the poll
+        # could finish (and be processed) before the orders were made,
+        # and the result of making them would then overwrite the
+        # newer state from the poll (e.g. an order that was matched
+        # would go back to unmatched); on BDAQ we would never hear of
+        # the change again, since the sequence number has moved on.
+        with _TIMERS['submit'].time():
+            if not (self._oworker.busy() or self._mworker.busy()):
+                unmatched = self.omanager.get_unmatched_orders()
+                if unmatched and (unmatched[const.BDAQID] or unmatched[const.BFID]):
+                    self._polling = unmatched
+                    self._oworker.submit(self.omanager.fetch_order_information,
+                                         unmatched)
+
+            # strategies that are due new prices keep their place in the
+            # queue until the price worker is free.
+            for strat in self.pmanager.get_strategies_to_update(self.ticks):
+                if strat not in self._pending:
+                    self._pending.append(strat)
+
+            if self._pending and not self._pworker.busy():
+                # ignore any strategies removed while they were waiting.
+                self._fetching = [s for s in self._pending
+                                  if s in self.stratgroup.strategies]
+                self._pending = []
+                update_mids = self.pmanager.get_update_mids(self._fetching)
+                self._pworker.submit(multi.update_prices, update_mids,
+                                     self.pmanager.get_depths(update_mids))
+
+        _TIMERS['tick'].observe(metrics.clock() - t0)
+        self.export_metrics()
+
+        log.debug('TICKS {0}', self.ticks)
+
+        # only now raise any error from the workers, so that we never
+        # lose the results of the other calls (in particular, orders
+        # we made, which are live on the exchange).
+        errors = merrors + oerrors + perrors
+        if errors:
+            multi.reraise(errors[0])
@@ -9,21 +9,28 @@ pull the order status from the manager.
 
 """
 
+import collections
 import datetime
-from betman import const, order, betlog
+import heapq
+import time
+from betman import const, order, betlog, exchangedata
 from betman.core import multi
 from betman.api.bf import bfapi
 from betman.api.bdaq import bdaqapi
-from stores import OrderStore, PriceStore
+from stores import (OrderStore, PriceStore, POSFIELDS, net_exposure,
+                    worst_case)
 from operator import attrgetter
-import wx
+
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('managers')
 
 # The following classes can be in an application as follows:
 
 # (i) create a StrategyGroup, and for each strategy added set the
 # attribute 'update_tick', which should be an integer. E.g. setting
 # this to 1 will mean that new prices are fetched every tick, 5 will
-# mean every 5 ticks, etc.
+# mean every 5 ticks, etc.  A strategy can instead give its own
+# polling interval in seconds (see PollScheduler).
 
 # (ii) create PricingManager, and call the tick method on each tick,
 # which should probably be evenly spaced in time (e.g. by 1 second),
@@ -49,6 +56,260 @@ UPDATED = 'updated_last_tick'
 # PRACTICEMODE must be set to False as well.
 UPDATEORDERINFO = True
 
+# indices of the worst case win and lose in a position (see
+# stores.POSFIELDS).
+_WORSTWIN = POSFIELDS.index('worstwin')
+_WORSTLOSE = POSFIELDS.index('worstlose')
+
+class RiskGate(object):
+    """Pre-trade risk checks on the orders made by the strategies.
+
+    Every order we are about to make or update has to pass all of the
+    checks below, otherwise it is dropped (and logged).  Cancelling
+    orders only ever reduces our risk, so these are never dropped.
+
+    (i) Fat finger checks: the stake of an order must be positive and
+    at most MAXSTAKE, and the price must be valid and within MAXTICKS
+    ticks of the mid price of the selection (if we have prices for
+    it).
+
+    (ii) Exposure limits: our net exposure (the most we can lose on a
+    selection, whichever of our unmatched orders are matched, see
+    stores.net_exposure) must stay within MAXSELLIABILITY for each
+    selection, and its sum over the selections must stay within
+    MAXMARKETLIABILITY for each market and MAXLIABILITY over both
+    exchanges.  Each order is checked by how much it changes this, so
+    an order that hedges our matched position always passes, and a
+    market maker's matched round trips don't use up the limits.  Note
+    unmatched orders don't hedge each other, since only one of them
+    may be matched.
+
+    (iii) Order rate limits: at most MAXORDERSPERTICK new and updated
+    orders per tick, and at most MAXORDERSPERMIN in the last minute.
+
+    The exposure is read from the positions kept by the order store,
+    which are kept up to date as orders change (see
+    stores.OrderIndex), so each check is a few dict lookups however
+    many orders we have.
+
+    """
+
+    MAXSTAKE = 50.0
+    MAXTICKS = 30
+    MAXSELLIABILITY = 200.0
+    MAXMARKETLIABILITY = 500.0
+    MAXLIABILITY = 2000.0
+    MAXORDERSPERTICK = 200
+    MAXORDERSPERMIN = 2000
+
+    def __init__(self, ostore, pstore, clock=time.time):
+        """
+        ostore - order store (for exposure)
+        pstore - price store (for the current prices of selections)
+        clock  - function returning the current time in seconds
+        """
+
+        self.ostore = ostore
+        self.pstore = pstore
+        self._clock = clock
+
+        # (time, number) of orders passed by each call to check in
+        # the last minute, and the total number of these orders.
+        self._recent = collections.deque()
+        self._nrecent = 0
+
+        # list of (order, reason) of all orders we dropped on the
+        # last call to check, where reason is a tuple (what, value),
+        # e.g. ('invalid stake', 0.0).
+        self.rejected = []
+
+    def _price_reason(self, o, price):
+        """Return reason to reject order o at price, or None."""
+
+        if not (exchangedata.MINODDS < price <= exchangedata.MAXODDS):
+            return ('invalid price', price)
+        sel = self.pstore.get_selection(o.exid, getattr(o, 'mid', None),
+                                        o.sid)
+        if sel is None:
+            # we don't know the prices, so can't check further
+            return None
+        back, lay = sel.best_back(), sel.best_lay()
+        if (back == exchangedata.MINODDS) or (lay == exchangedata.MAXODDS):
+            # one side of the book is empty
+            return None
+        mid = 0.5 * (back + lay)
+        if abs(exchangedata.ticks_between(o.exid, mid, price)) > self.MAXTICKS:
+            return ('price too far from mid price', (price, mid))
+        return None
+
+    def _exposure_reason(self, o, dwin, dlose, pending):
+        """
+        Return reason to reject order o that would add dwin and dlose
+        to worstwin and worstlose of its selection, or None.  pending
+        is a dict of the changes made by orders we already passed this
+        call (but which the order store doesn't know about yet):
+        (worstwin, worstlose) of each selection, and the change in
+        exposure of each market and overall.  This is updated if we
+        pass the order.
+        """
+
+        mid = getattr(o, 'mid', None)
+        (win, lose, _), mktexp, totexp = \
+                        self.ostore.get_exposure(o.exid, mid, o.sid)
+        skey, mkey = ('sel', o.exid, o.sid), ('market', o.exid, mid)
+        win, lose = pending.get(skey, (win, lose))
+        oldexp = net_exposure(win, lose)
+        win, lose = win + dwin, lose + dlose
+        newexp = net_exposure(win, lose)
+        dexp = newexp - oldexp
+
+        if dexp > 0.0:
+            if newexp > self.MAXSELLIABILITY:
+                return ('sel liability over limit', self.MAXSELLIABILITY)
+            if mktexp + pending.get(mkey, 0.0) + dexp > self.MAXMARKETLIABILITY:
+                return ('market liability over limit', self.MAXMARKETLIABILITY)
+            if totexp + pending.get('all', 0.0) + dexp > self.MAXLIABILITY:
+                return ('all liability over limit', self.MAXLIABILITY)
+
+        pending[skey] = (win, lose)
+        pending[mkey] = pending.get(mkey, 0.0) + dexp
+        pending['all'] = pending.get('all', 0.0) + dexp
+        return None
+
+    def _order_reason(self, o, price, stake, dwin, dlose, pending):
+        """
+        Return reason to reject order o as a tuple (what, value), or
+        None.  We don't format the reason unless we log it.
+        """
+
+        if not (0.0 < stake <= self.MAXSTAKE):
+            return ('invalid stake', stake)
+        return (self._price_reason(o, price) or
+                self._exposure_reason(o, dwin, dlose, pending))
+
+    def _update_price_stake(self, o):
+        """Return (price, stake) an order will have after updating."""
+
+        if o.exid == const.BDAQID:
+            # note Order.update has already changed the price.
+            return o.price, o.stake + getattr(o, 'deltastake', 0.0)
+        return (getattr(o, 'newprice', o.price),
+                getattr(o, 'newstake', o.stake))
+
+    def check(self, ocancel, oupdate, onew):
+        """Return (ocancel, oupdate, onew) with risky orders dropped.
+
+        ocancel, oupdate, onew - dicts with keys const.BDAQID and
+        const.BFID, values that are lists of order objects (as
+        returned by the strategy group).
+
+        """
+
+        self.rejected = []
+        pending = {}
+
+        # forget orders that are more than a minute old.
+        tnow = self._clock()
+        while self._recent and (self._recent[0][0] < tnow - 60.0):
+            self._nrecent -= self._recent.popleft()[1]
+        nleft = min(self.MAXORDERSPERTICK,
+                    self.MAXORDERSPERMIN - self._nrecent)
+
+        passed = []
+        for odict, isnew in [(oupdate, False), (onew, True)]:
+            for exid in [const.BDAQID, const.BFID]:
+                olist = []
+                for o in odict.get(exid, []):
+                    if isnew:
+                        price, stake = o.price, o.stake
+                        dwin, dlose = worst_case(o.polarity, price, 0.0,
+                                                 stake)
+                    else:
+                        price, stake = self._update_price_stake(o)
+                        # the change over what the order had; the
+                        # matched part stays as it is.
+                        ms = getattr(o, 'matchedstake', 0.0) or 0.0
+                        dwin, dlose = worst_case(o.polarity, price, ms,
+                                                 max(0.0, stake - ms))
+                        opos = self.ostore.get_order_position(exid, o.oref)
+                        dwin -= opos[_WORSTWIN]
+                        dlose -= opos[_WORSTLOSE]
+                    if nleft <= 0:
+                        reason = ('order rate over limit',
+                                  (self.MAXORDERSPERTICK,
+                                   self.MAXORDERSPERMIN))
+                    else:
+                        reason = self._order_reason(o, price, stake, dwin,
+                                                    dlose, pending)
+                    if reason is None:
+                        olist.append(o)
+                        nleft -= 1
+                    else:
+                        self.rejected.append((o, reason))
+                        log.info('Risk: not making order {0}: {1[0]} {1[1]}',
+                                 o, reason)
+                passed.append(olist)
+
+        npassed = sum(len(olist) for olist in passed)
+        if npassed:
+            self._recent.append((tnow, npassed))
+            self._nrecent += npassed
+
+        oupdate = {const.BDAQID: passed[0], const.BFID: passed[1]}
+        onew = {const.BDAQID: passed[2], const.BFID: passed[3]}
+        return ocancel, oupdate, onew
+
+class OrderPoller(object):
+    """Decide when to poll each exchange for the status of our orders.
+
+    Rather than polling every tick while we have any unmatched
+    orders, each exchange has its own polling interval.  This is
+    MINPOLL seconds right after we make or update orders on the
+    exchange, or after the prices of a selection we have unmatched
+    orders on change (when our orders are likely to be matched).
+    Each time we poll and nothing has changed, the interval doubles,
+    up to MAXPOLL seconds, so we poll less when the book is quiet.
+
+    Note on BDAQ, ListOrdersChangedSince only returns the orders that
+    changed since the last call (see the sequence number in
+    bdaqapimethod.py), so nothing is lost by polling less often.
+
+    """
+
+    MINPOLL = 1.0
+    MAXPOLL = 16.0
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._interval = {const.BDAQID: self.MINPOLL,
+                          const.BFID: self.MINPOLL}
+        # time at which we next poll each exchange.
+        self._next = {const.BDAQID: 0.0, const.BFID: 0.0}
+
+    def poke(self, exid):
+        """Poll exchange exid as soon as possible."""
+
+        self._interval[exid] = self.MINPOLL
+        self._next[exid] = 0.0
+
+    def due(self, exid):
+        """Is it time to poll exchange exid?"""
+
+        return self._clock() >= self._next[exid]
+
+    def polled(self, exid, changed):
+        """
+        Record that we just polled exid, and whether any of our
+        orders had changed.
+        """
+
+        if changed:
+            self._interval[exid] = self.MINPOLL
+        else:
+            self._interval[exid] = min(2.0 * self._interval[exid],
+                                       self.MAXPOLL)
+        self._next[exid] = self._clock() + self._interval[exid]
+
 class OrderManager(object):
     def __init__(self, stratgroup, config):
 
@@ -64,6 +325,13 @@ class OrderManager(object):
         # information to the database as required.
         self.ostore = OrderStore.Instance()
 
+        # every new and updated order has to pass the pre-trade risk
+        # checks before we make it.
+        self.riskgate = RiskGate(self.ostore, PriceStore.Instance())
+
+        # decides when we poll for the status of our orders.
+        self.poller = OrderPoller()
+
         # call startup routine to bootstap BDAQ order information, and
         # login to betfair.
         self.bootstrap()
@@ -104,8 +372,13 @@ class OrderManager(object):
 
         return self.stratgroup.get_orders_to_update_if(UPDATED)
 
-    def make_orders(self):
-        """Use BDAQ/BF Apis to cancel, update, and make new orders"""
+    def collect_orders(self):
+        """Return cancel, update and new order dicts from the strategies.
+
+        If there are no orders to cancel, update or make, or if we are
+        in practice mode, return None.
+
+        """
 
         # orders to cancel from all of the strategies
         ocancel = self.get_cancel_orders()
@@ -115,6 +388,12 @@ class OrderManager(object):
 
         # new orders from all of the strategies
         onew = self.get_new_orders()
+
+        # drop any orders that don't pass the risk checks (we don't
+        # count orders towards the rate limits in practice mode).
+        if not self.gconf.PracticeMode:
+            ocancel, oupdate, onew = self.riskgate.check(ocancel, oupdate,
+                                                         onew)
         
         # do we need to cancel, update, or make new orders?
         tocancel = bool(ocancel[const.BDAQID] or ocancel[const.BFID])
@@ -122,89 +401,392 @@ class OrderManager(object):
         tonew = bool(onew[const.BDAQID] or onew[const.BFID])
 
         if tocancel:
-            betlog.betlog.debug('cancelling orders: {0}'.format(ocancel))
+            log.debug('cancelling orders: {0}', ocancel)
 
         if toupdate:
-            betlog.betlog.debug('updating orders: {0}'.format(oupdate))
+            log.debug('updating orders: {0}', oupdate)
 
         if tonew:
-            betlog.betlog.debug('making new orders: {0}'.format(onew))
-
-        if (tocancel or toupdate or tonew):
-            
-            # we could instead do 'monkey patching' here so we don't
-            # need to check this every tick...
-            if self.gconf.PracticeMode:
-                # we don't make any real money bets in practice mode
-                print 'bets not made since in practice mode'
-                return
-
-            # call multithreaded make orders so that we make all order
-            # requests (cancelling, updating, making new) for BDAQ and
-            # BF simultaneously.
-            corders, uorders, neworders = multi.\
-                                          make_orders(ocancel, oupdate, onew)
-
-            # save the full order information to the order store (this will
-            # handle writing to the DB, etc.)
-            self.ostore.add_orders(corders, uorders, neworders)
+            log.debug('making new orders: {0}', onew)
 
-        else:
-            
+        if not (tocancel or toupdate or tonew):
+            return None
+
+        # we could instead do 'monkey patching' here so we don't
+        # need to check this every tick...
+        if self.gconf.PracticeMode:
+            # we don't make any real money bets in practice mode
+            log.info('bets not made since in practice mode')
+            return None
+
+        # the order store tells the strategies when their new orders
+        # have been placed.
+        self.ostore.expect_orders(onew,
+                                  self.stratgroup.get_order_owners_if(UPDATED))
+
+        return ocancel, oupdate, onew
+
+    def clear_latest(self):
+        """Set latest cancel, update, new orders in the store to be empty."""
+
+        self.ostore.latest = [{const.BDAQID: {}, const.BFID: {}}, 
+                              {const.BDAQID: {}, const.BFID: {}}, 
+                              {const.BDAQID: {}, const.BFID: {}}]
+
+    def process_made_orders(self, corders, uorders, neworders,
+                            failed=None):
+        """Save the result of making orders to the order store."""
+
+        # the order store will handle writing to the DB, etc.
+        self.ostore.add_orders(corders, uorders, neworders)
+
+        # the strategies that made any orders we failed to place
+        # shouldn't wait for them any longer.
+        if failed:
+            self.ostore.unexpect_orders(failed)
+
+        # poll the status of new and updated orders soon.
+        for exid in [const.BDAQID, const.BFID]:
+            if uorders.get(exid) or neworders.get(exid):
+                self.poller.poke(exid)
+
+    def make_orders(self):
+        """Use BDAQ/BF Apis to cancel, update, and make new orders"""
+
+        orders = self.collect_orders()
+
+        if orders is None:
             # we need to set latest cancel, update, new orders to be
             # empty.
-            self.ostore.latest = [{const.BDAQID: {}, const.BFID: {}}, 
-                                  {const.BDAQID: {}, const.BFID: {}}, 
-                                  {const.BDAQID: {}, const.BFID: {}}]
+            self.clear_latest()
+            return
 
-    def update_order_information(self):
+        # call multithreaded make orders so that we make all order
+        # requests (cancelling, updating, making new) for BDAQ and
+        # BF simultaneously.
+        corders, uorders, neworders, failed = multi.make_orders(*orders)
+
+        # save the full order information to the order store.
+        self.process_made_orders(corders, uorders, neworders, failed)
+
+    def get_unmatched_orders(self):
+        """Return dict of unmatched orders we need to poll for.
+
+        The dict has keys const.BDAQID and const.BFID, and values
+        that are lists of order objects.  The list is empty for an
+        exchange we don't need to poll this tick (see OrderPoller).
+        If we shouldn't be updating order information at all, return
+        None.
+
+        """
 
         if self.gconf.PracticeMode or (not UPDATEORDERINFO):
-            return
+            return None
 
         # if we don't have any strategies, don't update.  We might
         # want to change this at some point, but doing anything
         # different from this is a little complicated.
         if not self.stratgroup.strategies:
-            return
+            return None
+
+        changed = PriceStore.Instance().changed
+        unmatched = {const.BDAQID: [], const.BFID: []}
+        for exid in unmatched:
+            olist = self.ostore.get_unmatched_orders(exid)
+            # poll soon if the prices of a selection we have unmatched
+            # orders on changed.
+            for o in olist:
+                if (exid, getattr(o, 'mid', None), o.sid) in changed:
+                    self.poller.poke(exid)
+                    break
+            if self.poller.due(exid):
+                unmatched[exid] = olist
+        return unmatched
+
+    def fetch_order_information(self, unmatched):
+        """Poll BDAQ and BF for the status of the unmatched orders.
+
+        unmatched - dict returned by get_unmatched_orders.
+
+        Returns dict with keys const.BDAQID and const.BFID, values
+        that are the order dicts returned by the API (an exchange is
+        missing if we didn't need to call its API).  This method only
+        makes the API calls, it does not touch the order store.
+
+        """
+
+        # note the BDAQ and BF calls are made at the same time, and BF
+        # orders are polled in batches (see multi.get_order_status).
+        updates = multi.get_order_status(unmatched)
+
+        if log.enabled(betlog.DEBUG):
+            for o in updates.get(const.BDAQID, {}).values():
+                log.debug('{0}', o.as_dict())
+
+        return updates
 
-        # get list of unmatched orders on BDAQ
-        bdaqunmatched = self.ostore.get_unmatched_orders(const.BDAQID)
-            
-        # get list of unmatched orders on BF
-        bfunmatched = self.ostore.get_unmatched_orders(const.BFID)
+    def orders_changed(self, exid, odict, ounmatched):
+        """Return True if any orders changed, compared to the store.
+
+        odict and ounmatched are as for
+        OrderStore.process_order_updates.  Note BF returns all of the
+        unmatched orders, whether or not they changed.
+
+        """
+
+        for oref, o in odict.items():
+            old = self.ostore.get_order(exid, oref)
+            if ((old is None) or (old.status != o.status) or
+                (getattr(old, 'matchedstake', None) !=
+                 getattr(o, 'matchedstake', None))):
+                return True
+        # unmatched orders BF didn't return were cancelled (BDAQ only
+        # returns the orders that changed).
+        if exid == const.BFID:
+            return any(o.oref not in odict for o in ounmatched)
+        return False
+
+    def process_order_information(self, unmatched, updates):
+        """Save the result of fetch_order_information to the order store."""
 
         # set latest_updates dict in order store to be empty
         self.ostore.latest_updates.update({const.BDAQID: {}, const.BFID: {}})
 
-        # only want to call BDAQ API if we have unmatched bets
-        if bdaqunmatched:
-            # this should automatically keep track of a 'sequence
-            # number', so that we are updating information about all
-            # orders.
-            bdaqors = bdaqapi.ListOrdersChangedSince()
-            # debug
-            for o in bdaqors.values():
-                print o.__dict__
+        for exid in [const.BDAQID, const.BFID]:
+            if exid in updates:
+                changed = self.orders_changed(exid, updates[exid],
+                                              unmatched[exid])
+                self.ostore.process_order_updates(exid, updates[exid],
+                                                  unmatched[exid])
+                self.poller.polled(exid, changed)
+
+    def update_order_information(self):
+
+        unmatched = self.get_unmatched_orders()
+        if unmatched is None:
+            return
+
+        updates = self.fetch_order_information(unmatched)
 
-            self.ostore.process_order_updates(const.BDAQID, bdaqors, 
-                                              bdaqunmatched)
+        self.process_order_information(unmatched, updates)
 
-        if bfunmatched:
-            # we pass this function the list of order objects;
-            bfors = bfapi.GetBetStatus(bfunmatched)
+class PollScheduler(object):
+    """Decide which markets to fetch prices for, and when.
 
-            self.ostore.process_order_updates(const.BFID, bfors, 
-                                              bfunmatched)
+    Each strategy has a polling interval in seconds, which is its
+    UTICK attribute times the tick length, unless the strategy says
+    otherwise (see Strategy.get_poll_interval, which can e.g. ask
+    for prices more often close to the start of a race).  A market
+    is due when the first of the strategies using it is due, and we
+    keep the markets in a heap ordered by due time, so that finding
+    the due markets costs O(due log n) rather than a walk over every
+    strategy.
+
+    Note intervals shorter than the tick length are allowed, but
+    prices are still only fetched at most once per tick.  The markets
+    of a strategy are read when it is added, so a strategy that
+    changes its markets should be removed and added again.
+
+    We also keep the number of prices we need on each side of the
+    book for each market, which is the most any of the strategies
+    using it wants (see Strategy.get_price_depth), or more if
+    something other than a strategy, e.g. the price panel of the GUI,
+    asked for more (see set_depth).
+
+    """
+
+    _EPS = 1e-6
+
+    def __init__(self, ticklength=const.TICKLENGTH):
+        self.ticklength = ticklength
+
+        # (due time, (exid, mid)) for each market.  When a market's
+        # due time changes we just push a new entry, and skip the old
+        # one when we pop it (since it won't match self._mnext).
+        self._heap = []
+
+        # (exid, mid) -> due time of the market
+        self._mnext = {}
+
+        # (exid, mid) -> list of strategies using the market
+        self._subs = {}
+
+        # strategy -> (due time, list of (exid, mid) it uses)
+        self._snext = {}
+
+        # (exid, mid) -> price depth
+        self._depth = {}
+
+        # (exid, mid) -> price depth asked for by set_depth
+        self._mindepth = {}
+
+    def __contains__(self, strat):
+        return strat in self._snext
+
+    def __len__(self):
+        return len(self._snext)
+
+    def interval(self, strat):
+        """Return the polling interval of strat in seconds."""
+
+        default = getattr(strat, UTICK, 1) * self.ticklength
+        return strat.get_poll_interval(default)
+
+    def _keys(self, strat):
+        mids = strat.get_marketids()
+        return [(exid, mid) for exid in mids for mid in mids[exid]]
+
+    def _set_market(self, key, due):
+        self._mnext[key] = due
+        heapq.heappush(self._heap, (due, key))
+
+    def add(self, strat, now):
+        """Add strategy strat, which is due prices straight away."""
+
+        if strat in self._snext:
+            return
+        keys = self._keys(strat)
+        self._snext[strat] = (now, keys)
+        depth = strat.get_price_depth()
+        for key in keys:
+            self._subs.setdefault(key, []).append(strat)
+            self._depth[key] = max(depth, self._depth.get(key, 0),
+                                   self._mindepth.get(key, 0))
+            if self._mnext.get(key, now + 1.0) > now:
+                self._set_market(key, now)
+
+    def remove(self, strat):
+        """Remove strategy strat."""
+
+        if strat not in self._snext:
+            return
+        due, keys = self._snext.pop(strat)
+        for key in keys:
+            subs = self._subs[key]
+            subs.remove(strat)
+            if not subs:
+                # any heap entries for the market are now stale
+                del self._subs[key]
+                del self._mnext[key]
+                del self._depth[key]
+            else:
+                self._depth[key] = self._market_depth(key)
+
+    def _market_depth(self, key):
+        depths = [s.get_price_depth() for s in self._subs[key]]
+        return max(depths + [self._mindepth.get(key, 0)])
+
+    def set_depth(self, exid, mid, depth):
+        """
+        Fetch at least depth prices on each side of the book for
+        market mid whenever the market is due, whatever the strategies
+        using it want.  This is for the markets shown in the GUI,
+        which displays more than the best price.  If depth is None,
+        go back to the depth the strategies want.
+        """
+
+        key = (exid, mid)
+        if depth is None:
+            self._mindepth.pop(key, None)
+        else:
+            self._mindepth[key] = depth
+        if key in self._subs:
+            self._depth[key] = self._market_depth(key)
+
+    def sync(self, strategies):
+        """Add and remove strategies so that we have strategies."""
+
+        current = set(strategies)
+        for strat in [s for s in self._snext if s not in current]:
+            self.remove(strat)
+        for strat in strategies:
+            self.add(strat, 0.0)
+
+    def due(self, now):
+        """
+        Return (list of strategies, dict of mids) that are due new
+        prices at time now (in seconds).  The dict has keys
+        const.BDAQID and const.BFID, and values that are lists of
+        market ids.  The strategies returned are not due again until
+        their polling interval has passed.
+        """
+
+        # allow for rounding error in the due times, which are sums
+        # of intervals.
+        limit = now + self._EPS
+
+        # markets that are due
+        keys = []
+        while self._heap and (self._heap[0][0] <= limit):
+            due, key = heapq.heappop(self._heap)
+            if self._mnext.get(key) == due:
+                keys.append(key)
+                # so we don't add the market twice
+                self._mnext[key] = None
+
+        # strategies that are due; note a strategy using more than
+        # one market is due in all of them.
+        strats = []
+        for key in keys:
+            for strat in self._subs[key]:
+                sdue, skeys = self._snext[strat]
+                if sdue <= limit:
+                    strats.append(strat)
+                    # when we are next due
+                    self._snext[strat] = (now + self.interval(strat),
+                                          skeys)
+
+        # the next due time of each market we are fetching.
+        for key in keys:
+            self._set_market(key, min([self._snext[s][0]
+                                       for s in self._subs[key]]))
+
+        mids = {const.BDAQID: [], const.BFID: []}
+        for exid, mid in keys:
+            mids[exid].append(mid)
+        return strats, mids
+
+    def get_depths(self, mids):
+        """
+        Return dict with keys const.BDAQID and const.BFID, and values
+        that are dicts mapping each market id in mids (a dict of the
+        same form) to its price depth.
+        """
+
+        depths = {}
+        for exid in mids:
+            depths[exid] = {mid: self._depth.get((exid, mid),
+                                                 const.NUMPRICES)
+                            for mid in mids[exid]}
+        return depths
+
+    def get_mids(self, strats):
+        """Return dict of mids used by the strategies in strats."""
+
+        mids = {const.BDAQID: set(), const.BFID: set()}
+        for strat in strats:
+            if strat in self._snext:
+                keys = self._snext[strat][1]
+            else:
+                keys = self._keys(strat)
+            for exid, mid in keys:
+                mids[exid].add(mid)
+        return {exid: list(mids[exid]) for exid in mids}
 
 class PricingManager(object):
-    def __init__(self, stratgroup):
+    def __init__(self, stratgroup, ticklength=const.TICKLENGTH):
 
         self.stratgroup = stratgroup
 
         # the price store actually holds the data
         self.pstore = PriceStore.Instance()
 
+        # decides which strategies and markets are due new prices;
+        # we bring this up to date whenever strategies are added to
+        # or removed from the group.
+        self.scheduler = PollScheduler(ticklength)
+        self._version = None
+
     def get_strategy_with_mid(bdaqmid):
         """
         Return strategy with given bdaqmid.  If multiple strategies
@@ -224,44 +806,57 @@ class PricingManager(object):
         if strats:
             return strats[0]
         return None
+
+    def get_due(self, ticks):
+        """
+        Return (list of strategies, dict of mids) that want new
+        prices this tick (see PollScheduler.due).
+        """
+
+        if self._version != self.stratgroup.version:
+            self.scheduler.sync(self.stratgroup.strategies)
+            self._version = self.stratgroup.version
+        return self.scheduler.due(ticks * self.scheduler.ticklength)
     
-    def update_prices(self, ticks):
-        """Update the pricing dictionary."""
+    def get_strategies_to_update(self, ticks):
+        """Return list of strategies that want new prices this tick."""
 
-        # dictionary of mids (market ids) to update
-        update_mids = {const.BDAQID: [], const.BFID: []}
+        return self.get_due(ticks)[0]
 
-        print len(self.stratgroup), 'strategies to update'
+    def set_updated(self, strats):
+        """Set UPDATED flag on strategies in strats, and unset on the rest."""
 
-        # figure out which strategies in the stratgroup need new
-        # prices this tick, and add their mids to update_mids.
         for strat in self.stratgroup:
-            if (ticks % getattr(strat, UTICK) == 0):
-                # add the mids used by the strategy to the list of
-                # mids to update.
-                mids = strat.get_marketids()
-
-                # note we may only have BDAQ mids or BF mids
-                update_mids[const.BDAQID] += mids.get(const.BDAQID, [])
-                update_mids[const.BFID] += mids.get(const.BFID, [])
-
-                # set flag on strategy to indicate that we were
-                # updated on the last tick.
-                setattr(strat, UPDATED, True)
-            else:
-                setattr(strat, UPDATED, False)
+            setattr(strat, UPDATED, False)
+        for strat in strats:
+            setattr(strat, UPDATED, True)
 
-        # remove duplicate mids
-        if const.BDAQID in update_mids:
-            update_mids[const.BDAQID] = list(set(update_mids[const.BDAQID]))
-        if const.BFID in update_mids:
-            update_mids[const.BFID] = list(set(update_mids[const.BFID]))
+    def get_update_mids(self, strats):
+        """Return dictionary of mids used by the strategies in strats."""
 
-        if update_mids[const.BDAQID] or update_mids[const.BFID]:
-            print 'updating mids', update_mids
+        return self.scheduler.get_mids(strats)
 
-        # call BDAQ and BF API
-        new_prices, emids = multi.update_prices(update_mids)
+    def get_depths(self, update_mids):
+        """
+        Return the number of prices to fetch on each side of the book
+        for the markets in update_mids (see PollScheduler).
+        """
+
+        return self.scheduler.get_depths(update_mids)
+
+    def set_depth(self, mids, depth):
+        """
+        Fetch at least depth prices on each side of the book for the
+        markets in mids, a dict with keys const.BDAQID and const.BFID
+        (see PollScheduler.set_depth).
+        """
+
+        for exid in mids:
+            for mid in mids[exid]:
+                self.scheduler.set_depth(exid, mid, depth)
+
+    def process_prices(self, new_prices, emids):
+        """Save the result of multi.update_prices to the price store."""
 
         # remove any strategies from the strategy list that depend on
         # any of the BDAQ or BF markets in emids.
@@ -271,3 +866,23 @@ class PricingManager(object):
 
         # add the new prices to the price store
         self.pstore.add_prices(new_prices)
+
+    def update_prices(self, ticks):
+        """Update the pricing dictionary."""
+
+        log.debug('{0} strategies to update', len(self.stratgroup))
+
+        # figure out which strategies in the stratgroup need new
+        # prices this tick, and set flag on these strategies to
+        # indicate that we were updated on the last tick.
+        strats, update_mids = self.get_due(ticks)
+        self.set_updated(strats)
+
+        if update_mids[const.BDAQID] or update_mids[const.BFID]:
+            log.debug('updating mids {0}', update_mids)
+
+        # call BDAQ and BF API
+        new_prices, emids = multi.update_prices(update_mids,
+                                                self.get_depths(update_mids))
+
+        self.process_prices(new_prices, emids)
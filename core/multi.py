@@ -4,60 +4,343 @@
 
 """Any multithreaded methods."""
 
-from betman import const, betexception
+from betman import const, betexception, metrics, betlog
 from betman.api.bf import bfapi
 from betman.api.bdaq import bdaqapi
-from threading import Thread, active_count
-from Queue import Queue
+from threading import Thread, Event, Lock, active_count
+from Queue import Queue, Empty
 from urllib2 import URLError
+import sys
+import time
 
-def update_prices(middict):
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('multi')
+
+# maximum number of API calls we make at once to each exchange.  Note
+# that for BF we need a separate API call for each market when making
+# orders (see make_orders below), so we allow more calls.
+MAXCALLS = {const.BDAQID: 4, const.BFID: 8}
+
+class Worker(object):
+    """Make calls one at a time on a long-lived background thread.
+
+    Requests are submitted from the main (tick) thread, and the
+    results are collected later, again from the main thread, using
+    get_results.  This means we never touch the stores from the
+    background thread.  Any exception raised by a call is caught and
+    handed back (with its traceback) alongside the results, so that
+    it can be re-raised in single thread land once the results of the
+    other calls have been dealt with.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+        # (func, args) tuples waiting to be called
+        self._requests = Queue()
+
+        # (result, exc_info) tuples waiting to be collected
+        self._results = Queue()
+
+        # number of requests submitted but not yet collected
+        self._outstanding = 0
+
+        t = Thread(target = self._run, name = name)
+        t.setDaemon(True)
+        t.start()
+
+    def _run(self):
+        while True:
+            func, args = self._requests.get()
+            try:
+                self._results.put((func(*args), None))
+            except Exception:
+                self._results.put((None, sys.exc_info()))
+
+    def submit(self, func, *args):
+        """Queue func(*args) to be called on the worker thread."""
+
+        self._outstanding += 1
+        self._requests.put((func, args))
+
+    def busy(self):
+        """Do we have any submitted requests not yet collected?"""
+
+        return self._outstanding > 0
+
+    def get_results(self):
+        """Return results of all calls finished since last time.
+
+        This does not block.  We return (results, errors), lists of
+        the results of the calls that succeeded and of the exc_info
+        of those that raised, so that the caller can deal with every
+        result (e.g. orders that were made) before raising any error
+        with reraise.
+
+        """
+
+        results, errors = [], []
+        while True:
+            try:
+                res, exc_info = self._results.get_nowait()
+            except Empty:
+                break
+            self._outstanding -= 1
+            if exc_info is not None:
+                errors.append(exc_info)
+            else:
+                results.append(res)
+        return results, errors
+
+def reraise(exc_info):
+    """Raise exception from exc_info with its original traceback."""
+
+    raise exc_info[0], exc_info[1], exc_info[2]
+
+class Job(object):
+    """A single call to be made by the Pool."""
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        # sys.exc_info() if the call raised
+        self.exc_info = None
+
+        # time the job was submitted, and time spent waiting in the
+        # queue before a thread picked it up.
+        self.tsubmit = time.time()
+        self.twait = None
+
+        self.cancelled = False
+        self._started = False
+        self._lock = Lock()
+        self._done = Event()
+
+    def start(self):
+        """Called by the pool thread: return False if cancelled."""
+
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._started = True
+        self.twait = time.time() - self.tsubmit
+        return True
+
+    def finish(self, result=None, exc_info=None):
+        self.result = result
+        self.exc_info = exc_info
+        self._done.set()
+
+    def cancel(self):
+        """Cancel the job if it hasn't started; return True if cancelled."""
+
+        with self._lock:
+            if self._started:
+                return False
+            self.cancelled = True
+        self._done.set()
+        return True
+
+    def get(self, timeout=None):
+        """Wait for the job to finish and return the result.
+
+        Any exception raised by the call is re-raised here, with its
+        original traceback.  If the job was cancelled, or didn't
+        finish within timeout seconds, we raise InternalError.
+
+        """
+
+        if not self._done.wait(timeout):
+            raise betexception.InternalError, 'job did not finish in time'
+        if self.cancelled:
+            raise betexception.InternalError, 'job was cancelled'
+        if self.exc_info is not None:
+            reraise(self.exc_info)
+        return self.result
+
+# time jobs wait in the Pool queue of each exchange before a thread
+# picks them up (see all/metrics.py).
+_WAITTIME = {exid: metrics.histogram('pool_wait_seconds',
+                                     'Time API calls wait for a thread.',
+                                     exchange=exname)
+             for (exid, exname) in [(const.BDAQID, 'BDAQ'),
+                                    (const.BFID, 'BF')]}
+
+class Pool(object):
+    """Long-lived, bounded set of threads for making API calls.
+
+    Each exchange gets its own queue and its own threads, so that at
+    most MAXCALLS[exid] calls are made at once to each exchange, and
+    a backlog of calls on one exchange doesn't hold up the other.
+    Threads are started the first time a job is submitted, and then
+    live for the rest of the application, so we don't pay for thread
+    creation on every tick.
+
+    """
+
+    def __init__(self, maxcalls):
+        self._maxcalls = maxcalls
+        self._queues = {exid: Queue() for exid in maxcalls}
+        self._started = False
+        self._lock = Lock()
+
+    def _start(self):
+        for exid in self._maxcalls:
+            for i in range(self._maxcalls[exid]):
+                t = Thread(target = self._worker, args = (exid,))
+                t.setDaemon(True)
+                t.start()
+        self._started = True
+
+    def _worker(self, exid):
+        q = self._queues[exid]
+        while True:
+            job = q.get()
+            if job.start():
+                _WAITTIME[exid].observe(job.twait)
+                try:
+                    job.finish(result=job.func(*job.args))
+                except Exception:
+                    job.finish(exc_info=sys.exc_info())
+            q.task_done()
+
+    def submit(self, exid, func, *args):
+        """Queue func(*args) to be called on one of exid's threads.
+
+        Returns a Job object; call its get method for the result.
+
+        """
+
+        if not self._started:
+            # the ThreadedEngine workers can all submit at once on the
+            # first tick, so check again under the lock.
+            with self._lock:
+                if not self._started:
+                    self._start()
+        job = Job(func, args)
+        self._queues[exid].put(job)
+        return job
+
+    def cancel(self, jobs):
+        """Cancel any of the jobs in list jobs that haven't started yet."""
+
+        for job in jobs:
+            job.cancel()
+
+# the pool shared by update_prices and make_orders below.
+pool = Pool(MAXCALLS)
+
+def update_prices(middict, depths=None):
     """
     Get new prices.  Here middict is a dictionary with keys
     const.BDAQID, const.BFID, and items which are the market ids.
     Return two dictionaries, first contains market information, second
     contains any erroneous mids, which may be e.g. those markets that
     have now finished.
+
+    depths, if given, is a dictionary with keys const.BDAQID,
+    const.BFID, and items which are dicts mapping market id to the
+    number of prices we want on each side of the book (see
+    PricingManager.get_depths).  Markets not in depths get
+    const.NUMPRICES prices.
+
+    Each exchange only lets us ask for so many markets in one request
+    (see ChunkedNonApiMethod in api/apimethod.py), so we split the
+    market ids into chunks and fetch all of the chunks, for both
+    exchanges, at the same time.
     """
 
-    q = Queue()
     prices = {} # the prices
     emids = {}  # the market ids we didn't get prices for
 
-    def _worker():
-        func, mids, myid = q.get()
+    # list of (exid, job), one for each chunk of market ids
+    jobs = []
+    for myid, meth in [(const.BDAQID, bdaqapi.nApiGetPrices),
+                       (const.BFID, bfapi.nApiGetPrices)]:
+        prices[myid], emids[myid] = {}, []
+        # each chunk is for markets with the same depth.
+        mdepths = (depths or {}).get(myid, {})
+        bydepth = {}
+        for mid in middict.get(myid, []):
+            bydepth.setdefault(mdepths.get(mid, const.NUMPRICES),
+                               []).append(mid)
+        for depth, dmids in bydepth.items():
+            for ids in meth.plan(dmids):
+                jobs.append((myid, pool.submit(myid, meth.call_chunk, ids,
+                                               depth)))
+
+    # block and wait for finish
+    for myid, job in jobs:
         try:
-            prices[myid], emids[myid] = func(mids)
+            p, e = job.get()
         except URLError:
             # the nApi functions will raise URLError if there is no
             # network access etc.  There is a choice to be made here.
-            # The 'safest' thing to do (maybe) is to set emids to the
-            # complete list of mids.  This will mean that all
-            # strategies (for this exchange - either BDAQ or BF) will
-            # be removed by the engine (see update_prices in
-            # managers.py).  Instead, we can set prices to be an empty
-            # dict and emids to be an empty list.  This won't remove
-            # the strategy.
-            prices[myid] = {}
-            emids[myid] = []
-        q.task_done()
-
-    # start the threads: note we always start two threads here, even
-    # when we are only fetching prices from either BDAQ or BF.
-    for i in range(2):
-        t = Thread(target = _worker)
-        t.setDaemon(True)
-        t.start()
-
-    # tuple we put on the queue is function to call, argument, exid
-    q.put((bdaqapi.GetPrices_nApi, middict[const.BDAQID], const.BDAQID))
-    q.put((bfapi.GetPrices_nApi, middict[const.BFID], const.BFID))
-    
-    # block and wait for finish    
-    q.join()
+            # The 'safest' thing to do (maybe) is to add the chunk of
+            # mids to emids.  This will mean that all strategies
+            # using these markets will be removed by the engine (see
+            # update_prices in managers.py).  Instead, we just don't
+            # return prices for the chunk.  This won't remove the
+            # strategies.
+            continue
+        prices[myid].update(p)
+        emids[myid].extend(e)
 
     return prices, emids
 
+def get_order_status(unmatched):
+    """Get the current state of unmatched orders on BDAQ and BF.
+
+    unmatched - dict with keys const.BDAQID and const.BFID, values
+                that are lists of unmatched order objects.
+
+    Returns dict with keys const.BDAQID and const.BFID, values that
+    are dicts of order objects returned by the API (keyed by order
+    reference).  An exchange is missing if it had no unmatched
+    orders, or if any call to it failed.
+
+    For BDAQ we make a single call to ListOrdersChangedSince.  For BF
+    we can only get the status of bfapi.MAXBETSTATUS orders in a
+    single call, so we split the orders into as few batches as
+    possible (whatever markets they are in) and make the calls at the
+    same time.  If any BF call fails, we log the error and leave out
+    BF altogether, rather than return the status of only some of the
+    orders (since the order store takes any unmatched BF order we
+    don't return to have been cancelled).  The BDAQ result is
+    returned whatever happens to the BF calls: ListOrdersChangedSince
+    has already moved on the sequence number, so we would never see
+    these changes again.
+
+    """
+
+    jobs = []
+    if unmatched.get(const.BDAQID):
+        jobs.append((const.BDAQID,
+                     pool.submit(const.BDAQID, bdaqapi.ListOrdersChangedSince)))
+
+    bforders = unmatched.get(const.BFID, [])
+    nmax = bfapi.MAXBETSTATUS
+    for i in range(0, len(bforders), nmax):
+        jobs.append((const.BFID, pool.submit(const.BFID, bfapi.GetBetStatus,
+                                             bforders[i:i + nmax])))
+
+    updates = {}
+    failed = set()
+    for exid, job in jobs:
+        if exid in failed:
+            continue
+        try:
+            updates.setdefault(exid, {}).update(job.get())
+        except Exception, e:
+            log.error('getting order status for id {0} failed: {1!r}',
+                      exid, e)
+            failed.add(exid)
+            updates.pop(exid, None)
+            pool.cancel([j for (eid, j) in jobs if eid == exid])
+    return updates
+
 def _get_bf_orderlist(olist):
     
     odict = {}
@@ -74,6 +357,15 @@ def _get_bf_orderlist(olist):
     # (necessarily) preserve ordering, which is totally ok here.
     return odict.values()
 
+# number of orders we have sent to each exchange, keyed by (exchange
+# id, action), see all/metrics.py.
+_ORDERCOUNT = {(exid, action): metrics.counter('orders_total',
+                                               'Orders sent to the exchanges.',
+                                               exchange=exname, action=action)
+               for (exid, exname) in [(const.BDAQID, 'BDAQ'),
+                                      (const.BFID, 'BF')]
+               for action in ['cancel', 'update', 'place']}
+
 def make_orders(ocancel, oupdate, onew):
     """Cancel/update/make new orders.
 
@@ -85,79 +377,72 @@ def make_orders(ocancel, oupdate, onew):
     are lists of order objects.
 
     We return three dictionaries corresponding to the output of
-    cancelling, updating and making new orders.
+    cancelling, updating and making new orders, and a fourth with the
+    same keys, and items which are lists of the new orders (from
+    onew) that we failed to place, i.e. that were sent in a call that
+    raised ApiError or returned no orders.
 
     """
 
-    q = Queue()
     # the order dictionaries we return
     corders = {const.BDAQID: {}, const.BFID: {}}
     uorders = {const.BDAQID: {}, const.BFID: {}}
     neworders = {const.BDAQID: {}, const.BFID: {}}
-
-    def _worker():
-        """
-        Note this is a slightly different worker to the one used for
-        update_prices above.  Also note that we are catching API
-        errors...
-        """
-
-        func, olist, eid, rdict = q.get()
-        try:
-            ords = func(olist)
-        except betexception.ApiError:
-            print 'api error when placing following bets for id {0}:'.format(eid)
-            print olist
-            ords = {}
-
-        # need to update since we may have more than one thread
-        # for the BF bets.
-        rdict[eid].update(ords)
-        q.task_done()
+    failed = {const.BDAQID: [], const.BFID: []}
 
     # list of order dictionary, BDAQ function, BF function, return
     # dictionary for cancelling, updating, and making new orders
     # respectively.
-    ostuff = [[ocancel, bdaqapi.CancelOrders, bfapi.CancelBets, corders],
-              [oupdate, bdaqapi.UpdateOrders, bfapi.UpdateBets, uorders],
-              [onew, bdaqapi.PlaceOrdersNoReceipt, bfapi.PlaceBets, neworders]]
+    ostuff = [[ocancel, bdaqapi.CancelOrders, bfapi.CancelBets, corders,
+               'cancel'],
+              [oupdate, bdaqapi.UpdateOrders, bfapi.UpdateBets, uorders,
+               'update'],
+              [onew, bdaqapi.PlaceOrdersNoReceipt, bfapi.PlaceBets, neworders,
+               'place']]
+
+    # list of (job, order list, exid, return dictionary)
+    jobs = []
 
-    for odict, bdaqfunc, bffunc, retdict in ostuff:
+    for odict, bdaqfunc, bffunc, retdict, action in ostuff:
 
-        # we start at most one thread for the BDAQ orders, since we
-        # can place on multiple markets with a single API call
+        for exid in [const.BDAQID, const.BFID]:
+            if odict.get(exid):
+                _ORDERCOUNT[(exid, action)].inc(len(odict[exid]))
+
+        # we need at most one call for the BDAQ orders, since we can
+        # place on multiple markets with a single API call
         if odict.get(const.BDAQID, []):
-            bdaq_threads = 1
-        else:
-            bdaq_threads = 0
+            jobs.append((pool.submit(const.BDAQID, bdaqfunc,
+                                     odict[const.BDAQID]),
+                         odict[const.BDAQID], const.BDAQID, retdict))
 
         # for BF, we need one API call for each separate market id.  So
         # first get a list of lists,
         # [[mid1_o1,mid1_o2,...],[mid2_o1,mid2_o2,...],...] Each list will
-        # be given a single thread, and a BF API call.
-        bf_betlist = _get_bf_orderlist(odict[const.BFID])
-
-        # get list of lists, orders on each market.
-        bf_threads = len(bf_betlist)
+        # be given a single BF API call.
+        bf_betlist = _get_bf_orderlist(odict.get(const.BFID, []))
     
-        # debug
-        print 'number of bf_threads', bf_threads
+        log.debug('number of bf calls {0}', len(bf_betlist))
         for olist in bf_betlist:
-            print olist
-    
-        for i in range(bdaq_threads + bf_threads):
-            t = Thread(target = _worker)
-            t.setDaemon(True)
-            t.start()
-
-        # tuple we put on the queue is function to call, argument, exid
-        if bdaq_threads:
-            q.put((bdaqfunc, odict[const.BDAQID],
-                   const.BDAQID, retdict))
-        for i in range(bf_threads):
-            q.put((bffunc, bf_betlist[i], const.BFID, retdict))
-        
-    # block and wait for finish
-    q.join()
+            log.debug('{0}', olist)
+            jobs.append((pool.submit(const.BFID, bffunc, olist),
+                         olist, const.BFID, retdict))
+
+    # block and wait for finish.  Note that we are catching API
+    # errors...
+    for job, olist, eid, rdict in jobs:
+        try:
+            ords = job.get()
+        except betexception.ApiError:
+            log.error('api error when placing following bets for id {0}: {1}',
+                      eid, olist)
+            ords = {}
+
+        # need to update since we may have more than one call for
+        # the BF bets.
+        rdict[eid].update(ords)
+
+        if (rdict is neworders) and (not ords):
+            failed[eid].extend(olist)
 
-    return corders, uorders, neworders
+    return corders, uorders, neworders, failed
@@ -7,9 +7,420 @@ and price information to the database.
 
 """
 
-from betman import const, database, order, util
+import bisect
+import datetime
+import itertools
+from betman import const, database, order, util, betlog
 from betman.all.singleton import Singleton
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('orderstore')
+
+# fields of a position (see order_position).  win and lose are our
+# returns if the selection wins and loses, from the matched part of
+# the orders only, winif and loseif are these returns if all of the
+# orders were matched.  matched and unmatched are total stakes, and
+# liability and liabilityif the most we can lose.  worstwin and
+# worstlose are our net profit if the selection wins and loses in the
+# worst case, i.e. from the matched part of the orders, and the
+# unmatched part of only those orders that would make it worse (see
+# worst_case).
+POSFIELDS = ('win', 'winif', 'lose', 'loseif', 'matched', 'unmatched',
+             'liability', 'liabilityif', 'worstwin', 'worstlose')
+_NOPOS = (0.0,) * len(POSFIELDS)
+_WORSTWIN = POSFIELDS.index('worstwin')
+_WORSTLOSE = POSFIELDS.index('worstlose')
+
+def liability(polarity, price, stake):
+    """Return most we can lose on (matched) order."""
+
+    if polarity == order.LAY:
+        return stake * (price - 1.0)
+    return stake
+
+def worst_case(polarity, price, ms, us):
+    """
+    Return (worstwin, worstlose), the contribution of an order with
+    matched stake ms and unmatched stake us to our net profit if the
+    selection wins and loses, in the worst case.
+
+    The unmatched part of the order may or may not be matched, so it
+    only counts where it would lose us money: e.g. an unmatched back
+    order counts against us if the selection loses, but not for us if
+    it wins.  So an unmatched back and lay on the same selection
+    don't hedge each other, since either could be matched without
+    the other.
+    """
+
+    if polarity == order.LAY:
+        win, lose = -(price - 1.0), 1.0
+    else:
+        win, lose = price - 1.0, -1.0
+    return (ms * win + min(0.0, us * win),
+            ms * lose + min(0.0, us * lose))
+
+def net_exposure(worstwin, worstlose):
+    """
+    Return the most we can lose on a selection, given worstwin and
+    worstlose of its position (see worst_case).  A matched back and
+    lay of the same stake on the same selection hedge each other, so
+    a market maker's matched round trips don't add to this.
+    """
+
+    return max(0.0, -min(worstwin, worstlose))
+
+def order_position(o):
+    """Return contribution of order o to a position (see POSFIELDS).
+
+    Only the matched part of cancelled (or settled etc.) orders
+    contributes, and void and unplaced orders don't contribute.
+
+    """
+
+    if o.status == order.MATCHED:
+        ms, us = o.stake, 0.0
+    elif o.status == order.UNMATCHED:
+        # careful here, since the order could be 'part' matched.
+        ms = getattr(o, 'matchedstake', 0.0) or 0.0
+        us = getattr(o, 'unmatchedstake', o.stake) or 0.0
+    elif o.status in (order.VOID, order.NOTPLACED):
+        return _NOPOS
+    else:
+        ms, us = getattr(o, 'matchedstake', 0.0) or 0.0, 0.0
+
+    if o.polarity == order.LAY:
+        dwm, dwu = -ms * o.price, -us * o.price
+        dlm, dlu = ms, us
+    else: # back
+        dwm, dwu = ms * o.price, us * o.price
+        dlm, dlu = -ms, -us
+    lm = liability(o.polarity, o.price, ms)
+    lu = liability(o.polarity, o.price, us)
+    return ((dwm, dwm + dwu, dlm, dlm + dlu, ms, us, lm, lm + lu) +
+            worst_case(o.polarity, o.price, ms, us))
+
+def _addpos(pos, new, old):
+    """Add new - old to the position (list) pos, element-wise."""
+
+    for i in xrange(len(pos)):
+        pos[i] += new[i] - old[i]
+
+class OrderIndex(object):
+    """Current state of orders, indexed for fast lookup.
+
+    As well as the main dictionaries of orders by order reference (one
+    for each exchange), we keep secondary indexes of the orders by
+    status, market id and selection id, and a list of the orders
+    placed by each strategy ordered by time placed.  A full day of
+    market making leaves tens of thousands of orders in the store, so
+    we don't want to scan all of them to find e.g. the unmatched
+    orders on every tick.
+
+    We also keep the positions (see POSFIELDS) of each strategy, of
+    each selection, of each market and of each exchange as a whole.
+    These are updated with the change in the contribution of an order
+    whenever the order changes, so reading them costs the same however
+    many orders we have.  Likewise we keep our net exposure (see
+    net_exposure) of each selection, and its sum over the selections
+    of each market, of each exchange and over everything, for the risk
+    checks (see managers.RiskGate) and the GUI.
+
+    The indexes and positions are kept up to date by add, which must
+    be called every time the state of an order changes, including
+    when the status of an order object is changed in place.
+
+    Finally, we keep an index of which strategy made each order, so
+    that we can tell the strategy (see dispatch) when one of its
+    orders is placed or changes, rather than each strategy searching
+    through all of the new orders for its own.
+
+    """
+
+    def __init__(self):
+
+        # order reference to order object (the current state).
+        self.orders = {const.BDAQID: {}, const.BFID: {}}
+
+        # secondary indexes: key (status, market id or selection id)
+        # to dict of order reference to order object.
+        self._bystatus = {const.BDAQID: {}, const.BFID: {}}
+        self._bymarket = {const.BDAQID: {}, const.BFID: {}}
+        self._bysel = {const.BDAQID: {}, const.BFID: {}}
+
+        # order reference to the (status, mid, sid) the order is
+        # currently filed under in the secondary indexes.
+        self._keys = {const.BDAQID: {}, const.BFID: {}}
+
+        # strategy to list of (tplaced, seq, exid, oref), sorted.  seq
+        # breaks ties between orders placed at the same time, so that
+        # these are kept in the order they were added.
+        self._bystrategy = {}
+        self._seq = itertools.count()
+
+        # order reference to the contribution of the order to the
+        # positions (as the order was when last added), and to the
+        # strategy that placed it.
+        self._pos = {const.BDAQID: {}, const.BFID: {}}
+        self._owner = {const.BDAQID: {}, const.BFID: {}}
+
+        # positions (lists, see POSFIELDS) of each strategy, each
+        # selection (keyed by selection id), each market (keyed by
+        # market id) and each exchange.
+        self._stratpos = {}
+        self._selpos = {const.BDAQID: {}, const.BFID: {}}
+        self._marketpos = {const.BDAQID: {}, const.BFID: {}}
+        self._exchangepos = {const.BDAQID: [0.0] * len(POSFIELDS),
+                             const.BFID: [0.0] * len(POSFIELDS)}
+
+        # net exposure of each selection, as (exposure, market id)
+        # keyed by selection id, and its sum for each market, each
+        # exchange and over both exchanges.
+        self._selexp = {const.BDAQID: {}, const.BFID: {}}
+        self._marketexp = {const.BDAQID: {}, const.BFID: {}}
+        self._exchangeexp = {const.BDAQID: 0.0, const.BFID: 0.0}
+        self._totalexp = 0.0
+
+        # (order, strategy that made it) for orders we don't yet have
+        # the order reference of, keyed by (exid, sid, polarity) of
+        # the order, oldest first, and order reference to the strategy
+        # that made the order (note for BothMMStrategy, this is one of
+        # its two strategies, not the owner of the order in
+        # self._owner).
+        self._waiting = {}
+        self._callbacks = {const.BDAQID: {}, const.BFID: {}}
+
+    def get(self, exid, oref):
+        """Return current state of order, or None if no order found."""
+
+        return self.orders[exid].get(oref)
+
+    def add(self, exid, oref, o):
+        """Add or update order o with reference oref."""
+
+        key = (o.status, getattr(o, 'mid', None), o.sid)
+        oldkey = self._keys[exid].get(oref)
+        self._update_positions(exid, oref, o, key, oldkey or key)
+        if oldkey is not None:
+            for idx, k, oldk in zip((self._bystatus[exid],
+                                     self._bymarket[exid],
+                                     self._bysel[exid]), key, oldkey):
+                if k != oldk:
+                    bucket = idx[oldk]
+                    del bucket[oref]
+                    if not bucket:
+                        del idx[oldk]
+
+        self._bystatus[exid].setdefault(key[0], {})[oref] = o
+        self._bymarket[exid].setdefault(key[1], {})[oref] = o
+        self._bysel[exid].setdefault(key[2], {})[oref] = o
+        self._keys[exid][oref] = key
+        self.orders[exid][oref] = o
+
+    def _update_positions(self, exid, oref, o, key, oldkey):
+        """Update positions for new state of order o.
+
+        key and oldkey are the (status, mid, sid) of the order now
+        and when it was last added (the same if it is a new order).
+
+        """
+
+        new = order_position(o)
+        old = self._pos[exid].get(oref, _NOPOS)
+        if (new == old) and (key[1:] == oldkey[1:]):
+            return
+        self._pos[exid][oref] = new
+
+        _addpos(self._exchangepos[exid], new, old)
+        owner = self._owner[exid].get(oref)
+        if owner is not None:
+            _addpos(self._stratpos[owner], new, old)
+
+        # the market and selection ids shouldn't change, but if they
+        # do we move the order to the new market or selection.
+        for k, oldk, allpos in [(key[1], oldkey[1], self._marketpos[exid]),
+                                (key[2], oldkey[2], self._selpos[exid])]:
+            if k == oldk:
+                _addpos(allpos.setdefault(k, [0.0] * len(POSFIELDS)),
+                        new, old)
+            else:
+                if oldk in allpos:
+                    _addpos(allpos[oldk], _NOPOS, old)
+                _addpos(allpos.setdefault(k, [0.0] * len(POSFIELDS)),
+                        new, _NOPOS)
+
+        self._update_exposure(exid, key[2], key[1])
+        if oldkey[2] != key[2]:
+            self._update_exposure(exid, oldkey[2], oldkey[1])
+
+    def _update_exposure(self, exid, sid, mid):
+        """Update net exposure of selection sid in market mid."""
+
+        pos = self._selpos[exid].get(sid, _NOPOS)
+        new = net_exposure(pos[_WORSTWIN], pos[_WORSTLOSE])
+        old, oldmid = self._selexp[exid].get(sid, (0.0, mid))
+        if (new == old) and (mid == oldmid):
+            return
+        self._selexp[exid][sid] = (new, mid)
+        mexp = self._marketexp[exid]
+        mexp[oldmid] = mexp.get(oldmid, 0.0) - old
+        mexp[mid] = mexp.get(mid, 0.0) + new
+        self._exchangeexp[exid] += new - old
+        self._totalexp += new - old
+
+    def update(self, exid, odict):
+        """Add or update all orders in odict (order ref to order)."""
+
+        for oref, o in odict.items():
+            self.add(exid, oref, o)
+
+    def set_status(self, exid, oref, status):
+        """Set status of an order we already have."""
+
+        o = self.orders[exid][oref]
+        o.status = status
+        self.add(exid, oref, o)
+
+    def with_status(self, exid, status):
+        """Return list of orders with the given status."""
+
+        return self._bystatus[exid].get(status, {}).values()
+
+    def in_market(self, exid, mid):
+        """Return list of orders in market mid."""
+
+        return self._bymarket[exid].get(mid, {}).values()
+
+    def for_selection(self, exid, sid):
+        """Return list of orders for selection sid."""
+
+        return self._bysel[exid].get(sid, {}).values()
+
+    def add_strategy_order(self, strategy, exid, oref, tplaced):
+        """Record that order oref was placed by strategy at tplaced."""
+
+        bisect.insort(self._bystrategy.setdefault(strategy, []),
+                      (tplaced, next(self._seq), exid, oref))
+
+        # the order is (usually) already in the store, so add what it
+        # contributes so far to the position of the strategy.
+        pos = self._stratpos.setdefault(strategy, [0.0] * len(POSFIELDS))
+        if self._owner[exid].get(oref) is None:
+            self._owner[exid][oref] = strategy
+            _addpos(pos, self._pos[exid].get(oref, _NOPOS), _NOPOS)
+
+    def expect(self, o, strategy):
+        """Record that strategy is making order o (not yet placed)."""
+
+        self._waiting.setdefault((o.exid, o.sid, o.polarity),
+                                 []).append((o, strategy))
+
+    def unexpect(self, o):
+        """Forget that a strategy is making order o (see expect).
+
+        This is for orders that failed to be placed, which we will
+        never get an order reference for.
+
+        """
+
+        key = (o.exid, o.sid, o.polarity)
+        waiting = self._waiting.get(key, [])
+        for i, (wo, strategy) in enumerate(waiting):
+            if wo is o:
+                del waiting[i]
+                break
+        if not waiting:
+            self._waiting.pop(key, None)
+
+    def dispatch(self, exid, odict, ostore):
+        """Tell the strategies that made any of the orders in odict.
+
+        For an order we haven't seen before, the strategy that made
+        it is the first one waiting for an order with the same
+        exchange, selection and polarity (see expect), and we call
+        its order_placed method.  Otherwise we call the order_changed
+        method of the strategy.  Each is called with the order and
+        ostore.
+
+        """
+
+        callbacks = self._callbacks[exid]
+        for oref, o in odict.items():
+            strat = callbacks.get(oref)
+            if strat is not None:
+                strat.order_changed(o, ostore)
+                continue
+            waiting = self._waiting.get((exid, o.sid, o.polarity))
+            if waiting:
+                strat = waiting.pop(0)[1]
+                if not waiting:
+                    del self._waiting[(exid, o.sid, o.polarity)]
+                callbacks[oref] = strat
+                strat.order_placed(o, ostore)
+
+    def strategy_orders(self, strategy):
+        """
+        Return list of current state of orders placed by strategy,
+        ordered by time placed (oldest first).
+        """
+
+        return [self.orders[exid][oref] for (t, seq, exid, oref)
+                in self._bystrategy.get(strategy, [])]
+
+    def strategy_position(self, strategy):
+        """Return position (tuple, see POSFIELDS) of strategy."""
+
+        return _round(self._stratpos.get(strategy, _NOPOS))
+
+    def order_position(self, exid, oref):
+        """
+        Return contribution of order to the positions (tuple, see
+        POSFIELDS) as the order was when it was last added.
+        """
+
+        return self._pos[exid].get(oref, _NOPOS)
+
+    def exposure(self, exid, mid, sid):
+        """
+        Return (worstwin, worstlose, exposure) of selection sid, and
+        the net exposure (see net_exposure) of market mid and of both
+        exchanges.
+        """
+
+        pos = self._selpos[exid].get(sid, _NOPOS)
+        sel = self._selexp[exid].get(sid, (0.0, mid))[0]
+        return ((pos[_WORSTWIN], pos[_WORSTLOSE], sel),
+                self._marketexp[exid].get(mid, 0.0), self._totalexp)
+
+    def selection_position(self, exid, sid):
+        """Return position (tuple, see POSFIELDS) of selection sid."""
+
+        return _round(self._selpos[exid].get(sid, _NOPOS))
+
+    def market_position(self, exid, mid):
+        """Return position (tuple, see POSFIELDS) of market mid."""
+
+        return _round(self._marketpos[exid].get(mid, _NOPOS))
+
+    def exchange_position(self, exid):
+        """Return position (tuple, see POSFIELDS) of exchange exid."""
+
+        return _round(self._exchangepos[exid])
+
+    def market_exposure(self, exid, mid):
+        """Return net exposure of market mid (see net_exposure)."""
+
+        return round(self._marketexp[exid].get(mid, 0.0), 8)
+
+    def exchange_exposure(self, exid):
+        """Return net exposure of exchange exid (see net_exposure)."""
+
+        return round(self._exchangeexp[exid], 8)
+
+def _round(pos):
+    # since the positions are running sums, we round off the
+    # floating point error so that e.g. a flat position is zero.
+    return tuple([round(p, 8) for p in pos])
+
 @Singleton
 class OrderStore(object):
     """Class for storing information on orders made.
@@ -24,8 +435,10 @@ class OrderStore(object):
         # the current state of all orders placed since the start of
         # the application.  The keys to each sub-dictionary are the
         # order ids, with values that are the order objects. Note each
-        # order object will typically be updated multiple times.
-        self._orders = {const.BDAQID: {}, const.BFID: {}}
+        # order object will typically be updated multiple times.  We
+        # also index the orders by status, market, selection and
+        # strategy (see OrderIndex).
+        self._orders = OrderIndex()
 
         # the state of all orders immediately after they were placed.
         # Among other things, these order objects are useful since
@@ -51,13 +464,47 @@ class OrderStore(object):
         # order status via the API).
         self.latest_updates = {const.BDAQID: {}, const.BFID: {}}
 
-        # store dict used by strategies to seach for order references
-        # immediately after order placed.  Since we get the order
-        # reference when placing bets on BF, we write to this when
-        # placing bets.  But when placing bets on BDAQ, we don't get
-        # the order reference, so instead this is written when we call
-        # ListOrdersChangedSince.
-        self.orders_tosearch = {const.BDAQID: {}, const.BFID: {}}
+        # note the strategies don't search through the new orders for
+        # their own, instead the strategies are told about their
+        # orders as they are placed and change (see expect_orders
+        # and OrderIndex.dispatch).
+
+    def expect_orders(self, onew, owners):
+        """Record which strategies are making the new orders in onew.
+
+        onew   - dict with keys const.BDAQID and const.BFID, values
+                 that are lists of orders about to be placed.
+        owners - dict mapping id of each order object in onew to the
+                 strategy that made it (see
+                 StrategyGroup.get_order_owners_if).
+
+        """
+
+        for olist in onew.values():
+            for o in olist:
+                strat = owners.get(id(o))
+                if strat is not None:
+                    self._orders.expect(o, strat)
+
+    def unexpect_orders(self, ofailed):
+        """Forget the strategies that made the orders in ofailed.
+
+        ofailed - dict with keys const.BDAQID and const.BFID, values
+                  that are lists of orders that we tried to place,
+                  but that were not placed (see multi.make_orders).
+
+        """
+
+        for olist in ofailed.values():
+            for o in olist:
+                self._orders.unexpect(o)
+
+    def _dispatch(self, odict):
+        """Tell the strategies about orders in odict (see OrderIndex)."""
+
+        for exid in [const.BDAQID, const.BFID]:
+            if odict.get(exid):
+                self._orders.dispatch(exid, odict[exid], self)
 
     def get_tplaced(self, o):
         """Return time placed (a datetime.datetime object_ for order o."""
@@ -78,11 +525,11 @@ class OrderStore(object):
         """
         
         if exid == const.BDAQID: # easy!
-            return self._orders[exid].get(oref)
+            return self._orders.get(exid, oref)
 
         else:
             # TODO: make things work properly for BF...
-            return self._orders[exid].get(oref)   
+            return self._orders.get(exid, oref)
 
     def set_tplaced(self, olist):
         """Set time placed for every order in olist."""
@@ -100,7 +547,109 @@ class OrderStore(object):
         return {const.BDAQID: bdolist, const.BFID: bfolist}
 
     def get_current_orders(self, exid):
-        return self._orders[exid]
+        return self._orders.orders[exid]
+
+    def get_orders_with_status(self, exid, status):
+        """Return list of orders on exchange exid with given status."""
+
+        return self._orders.with_status(exid, status)
+
+    def get_market_orders(self, exid, mid):
+        """Return list of orders on exchange exid in market mid."""
+
+        return self._orders.in_market(exid, mid)
+
+    def get_selection_orders(self, exid, sid):
+        """Return list of orders on exchange exid for selection sid."""
+
+        return self._orders.for_selection(exid, sid)
+
+    def add_strategy_order(self, strategy, o):
+        """Record that (placed) order o belongs to strategy.
+
+        This is called by the strategies when they find the order
+        reference of an order they placed (see
+        Strategy.add_placed_order).
+
+        """
+
+        tplaced = (self._tplaced[o.exid].get(o.oref) or
+                   getattr(o, 'tplaced', None) or datetime.datetime.now())
+        self._orders.add_strategy_order(strategy, o.exid, o.oref, tplaced)
+
+    def get_strategy_orders(self, strategy):
+        """
+        Return list of orders placed by strategy, ordered by time
+        placed (oldest first).
+        """
+
+        return self._orders.strategy_orders(strategy)
+
+    def get_strategy_position(self, strategy):
+        """Return position of strategy (tuple, see POSFIELDS)."""
+
+        return self._orders.strategy_position(strategy)
+
+    def get_order_position(self, exid, oref):
+        """
+        Return contribution of order to the positions (tuple, see
+        POSFIELDS) as of the last time the order changed.
+        """
+
+        return self._orders.order_position(exid, oref)
+
+    def get_exposure(self, exid, mid, sid):
+        """
+        Return ((worstwin, worstlose, exposure) of selection sid, exposure
+        of market mid, exposure over both exchanges), where exposure
+        is the most we could lose net of hedging (see net_exposure).
+        This is cheaper than getting the full positions.
+        """
+
+        return self._orders.exposure(exid, mid, sid)
+
+    def get_selection_position(self, exid, sid):
+        """
+        Return position of all of our orders for selection sid (tuple,
+        see POSFIELDS).
+        """
+
+        return self._orders.selection_position(exid, sid)
+
+    def get_market_position(self, exid, mid):
+        """
+        Return position of all of our orders in market mid (tuple, see
+        POSFIELDS).  Note win and lose are summed over the selections
+        of the market, so they are not what we make or lose on the
+        market; for that see get_market_exposure.
+        """
+
+        return self._orders.market_position(exid, mid)
+
+    def get_exchange_position(self, exid):
+        """
+        Return position of all of our orders on exchange exid (tuple,
+        see POSFIELDS).
+        """
+
+        return self._orders.exchange_position(exid)
+
+    def get_market_exposure(self, exid, mid):
+        """
+        Return the most we could lose in market mid, whichever of our
+        unmatched orders are matched, i.e. the sum over its selections
+        of the worst case of each (see net_exposure).
+        """
+
+        return self._orders.market_exposure(exid, mid)
+
+    def get_exchange_exposure(self, exid):
+        """
+        Return the most we could lose on exchange exid (see
+        get_market_exposure).
+        """
+
+        return self._orders.exchange_exposure(exid)
 
     def add_orders(self, corders, uorders, neworders):
         """Add cancel, update and new order dicts to the store.
@@ -140,8 +689,9 @@ class OrderStore(object):
         self._cancelorders[const.BFID].update(odict.get(const.BFID, {}))
 
         # update the current order state dictionary
-        self._orders[const.BDAQID].update(odict.get(const.BDAQID, {}))
-        self._orders[const.BFID].update(odict.get(const.BFID, {}))
+        self._orders.update(const.BDAQID, odict.get(const.BDAQID, {}))
+        self._orders.update(const.BFID, odict.get(const.BFID, {}))
+        self._dispatch(odict)
 
         # save to DB
         self._dbman.write_orders(util.flattendict(odict))
@@ -163,8 +713,8 @@ class OrderStore(object):
         self._neworders[const.BFID].update(odict.get(const.BFID, {}))
 
         # update the current order state dictionary
-        self._orders[const.BDAQID].update(odict.get(const.BDAQID, {}))
-        self._orders[const.BFID].update(odict.get(const.BFID, {}))
+        self._orders.update(const.BDAQID, odict.get(const.BDAQID, {}))
+        self._orders.update(const.BFID, odict.get(const.BFID, {}))
 
         # get flat list of all order objects
         ordlist = util.flattendict(odict)
@@ -173,8 +723,8 @@ class OrderStore(object):
         for o in ordlist:
             self._tplaced[o.exid][o.oref] = o.tplaced
 
-        # we already have the order ref from BF
-        self.orders_tosearch[const.BFID] = odict[const.BFID]
+        # tell the strategies that made the orders
+        self._dispatch(odict)
 
         # write to DB
         self._dbman.write_orders(ordlist)
@@ -192,23 +742,20 @@ class OrderStore(object):
 
         # this won't actually add any new orders, since updating a
         # BDAQ order doesn't produce new orders on BDAQ.
-        self._orders[const.BDAQID].update(odict.get(const.BDAQID, {}))
+        self._orders.update(const.BDAQID, odict.get(const.BDAQID, {}))
 
         # but this will add new orders, and the status of the old
         # orders will be set to CANCELLED.
-        self._orders[const.BFID].update(odict.get(const.BFID, {}))
+        self._orders.update(const.BFID, odict.get(const.BFID, {}))
+        self._dispatch(odict)
 
         # save to DB
         self._dbman.write_orders(util.flattendict(odict))
 
     def get_unmatched_orders(self, exid):
         """Return list of unmatched orders for exchange exid."""
-        
-        unmatched = []
-        for o in self._orders[exid].values():
-            if o.status == order.UNMATCHED:
-                unmatched.append(o)
-        return unmatched
+
+        return self._orders.with_status(exid, order.UNMATCHED)
 
     def process_order_updates(self, exid, odict, ounmatched):
         """Process updating status of currently existing orders.
@@ -235,18 +782,18 @@ class OrderStore(object):
             unmatcheddict = {o.oref: o for o in ounmatched}
             for oid in unmatcheddict:
                 if oid not in odict:
-                    print 'order id {0} was CANCELLED'.format(oid), self._orders[exid][oid]
-                    self._orders[exid][oid].status = order.CANCELLED
+                    log.debug('order id {0} was CANCELLED {1}', oid,
+                              self._orders.get(exid, oid))
+                    self._orders.set_status(exid, oid, order.CANCELLED)
                                         
         # update main order dictionary
-        self._orders[exid].update(odict)
+        self._orders.update(exid, odict)
 
         # latest updates
         self.latest_updates[exid] = odict
 
-        # we need to seach this dict to get oref of placed order
-        if (exid == const.BDAQID):
-            self.orders_tosearch[exid] = odict
+        # tell the strategies that made the orders
+        self._dispatch({exid: odict})
 
         # save to DB
-        self._dbman.write_orders({exid: odict.values()})
+        self._dbman.write_orders(odict.values())
@@ -23,8 +23,57 @@ class PriceStore(object):
         # engine; it will be fed to the strategies.
         self.newprices = {const.BDAQID: {}, const.BFID: {}}
 
-        # for writing to database
-        self._dbman = database.DBMaster()
+        # set of (exid, mid, sid) tuples of the selections in
+        # newprices whose prices, volumes or reset counts differ from
+        # the previous prices we had for them.  Strategies that only
+        # care about these selections need not wake up otherwise.
+        self.changed = set()
+
+        # for writing to database; this writes in the background so
+        # that we don't wait for the commit every tick.
+        self._writer = database.SelectionWriter()
+
+    def _selection_changed(self, old, new):
+        """Return True if selection new differs from old (the last
+        prices we got for the same selection)."""
+
+        return ((not old.same_prices(new))
+                or (old.src != new.src) or (old.wsn != new.wsn))
+
+    def get_changed(self, prices):
+        """Return set of (exid, mid, sid) of selections in prices that
+        have changed since we last got prices for them."""
+
+        changed = set()
+        for exid in prices:
+            oldmarkets = self._prices[exid]
+            for mid, sels in prices[exid].items():
+                oldsels = oldmarkets.get(mid, {})
+                for sid, sel in sels.items():
+                    old = oldsels.get(sid)
+                    # the BDAQ parser hands back the same object if
+                    # nothing changed (see bdaqnonapiparse.py).
+                    if old is sel:
+                        continue
+                    if (old is None) or self._selection_changed(old, sel):
+                        changed.add((exid, mid, sid))
+        return changed
+
+    def get_selection(self, exid, mid, sid):
+        """Return latest Selection object we have, or None."""
+
+        return self._prices[exid].get(mid, {}).get(sid)
+
+    def has_changed(self, exid, mid, sid):
+        """Did selection with exid, mid, sid change in newprices?"""
+
+        return (exid, mid, sid) in self.changed
+
+    def clear_newprices(self):
+        """Set newprices to be empty (i.e. no prices this tick)."""
+
+        self.newprices = {const.BDAQID: {}, const.BFID: {}}
+        self.changed = set()
 
     def add_prices(self, prices):
         """Add prices to the store.
@@ -35,14 +84,20 @@ class PriceStore(object):
 
         """
 
+        # compute the changed selections before we overwrite the
+        # previous prices.
+        self.changed = self.get_changed(prices)
+
         # we store the most recent prices in their own dict
         self.newprices = prices
 
-        self._prices.update(prices)
+        # keep the latest prices for every market we have seen, not
+        # only the markets in this update.
+        for exid in prices:
+            self._prices[exid].update(prices[exid])
 
         # write prices to database
         if prices[const.BDAQID] or prices[const.BFID]:
             bdaqsels = util.flattendict(prices[const.BDAQID])
             bfsels = util.flattendict(prices[const.BFID])
-            self._dbman.write_selections(bdaqsels + bfsels, 
-                                         datetime.datetime.now())
+            self._writer.write(bdaqsels + bfsels, datetime.datetime.now())
@@ -0,0 +1,145 @@
+# archive.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Columnar archive of historical selection prices.
+
+The histselections table has a row per selection per tick, and
+reading it back means building a Selection object per row.  Here we
+store the same information as one append-only binary file per
+market, each record of which is a fixed-width NumPy record (see
+TICKDTYPE).  Reading a market is then a memory-mapped (zero-copy)
+view of the file, with a column for each of the timestamp, selection
+id, and back/lay prices and volumes.
+
+Missing prices and volumes (i.e. fewer than const.NUMPRICES on one
+side of the book) are stored as NaN.
+
+"""
+
+import os
+import time
+import numpy as np
+from betman import const
+
+# one record per selection per tick.  tstamp is seconds since the
+# epoch (local time, as for the datetimes stored in the database).
+TICKDTYPE = np.dtype([('tstamp', '<f8'),
+                      ('sid',    '<i8'),
+                      ('back',   '<f8', (const.NUMPRICES,)),
+                      ('bvol',   '<f8', (const.NUMPRICES,)),
+                      ('lay',    '<f8', (const.NUMPRICES,)),
+                      ('lvol',   '<f8', (const.NUMPRICES,))])
+
+def _nan(x):
+    return np.nan if x is None else x
+
+def _market_path(exid, mid, adir=None):
+    return os.path.join(adir or const.ARCHIVEDIR,
+                        '{0}_{1}.ticks'.format(exid, mid))
+
+def to_epoch(tstamp):
+    """Return datetime.datetime tstamp as seconds since the epoch."""
+
+    return time.mktime(tstamp.timetuple()) + tstamp.microsecond / 1e6
+
+def selection_records(selections, tstamp):
+    """Return dict mapping (exid, mid) to array of TICKDTYPE records."""
+
+    t = to_epoch(tstamp)
+    n2 = 2 * const.NUMPRICES
+    rows = {}
+    for s in selections:
+        p = s.get_flat_prices(np.nan)
+        rows.setdefault((s.exid, s.mid), []).append((t, s.id,
+                                                     p[0:n2:2], p[1:n2:2],
+                                                     p[n2::2], p[n2 + 1::2]))
+
+    return {k: np.array(v, dtype=TICKDTYPE) for k, v in rows.items()}
+
+class TickArchive(object):
+    """Append-only archive of selection prices, one file per market."""
+
+    def __init__(self, adir=None):
+        self.adir = adir or const.ARCHIVEDIR
+        if not os.path.isdir(self.adir):
+            os.makedirs(self.adir)
+
+    def write(self, selections, tstamp):
+        """Append prices of selections (taken at time tstamp)."""
+
+        for (exid, mid), recs in selection_records(selections,
+                                                   tstamp).items():
+            self.append(exid, mid, recs)
+
+    def append(self, exid, mid, recs):
+        """Append array recs of TICKDTYPE records for market mid."""
+
+        with open(_market_path(exid, mid, self.adir), 'ab') as f:
+            f.write(recs.tostring())
+
+    def get_markets(self):
+        """Return list of (exid, mid) of all markets in the archive."""
+
+        markets = []
+        for fname in os.listdir(self.adir):
+            name, ext = os.path.splitext(fname)
+            if ext == '.ticks':
+                exid, mid = name.split('_')
+                markets.append((int(exid), int(mid)))
+        return markets
+
+    def load_market(self, exid, mid):
+        """Return read-only memmap of all records for market mid.
+
+        If we have no prices for the market, return an empty array.
+
+        """
+
+        path = _market_path(exid, mid, self.adir)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=TICKDTYPE)
+
+        # if a write is in progress we may have a partial record at
+        # the end of the file, which we ignore.
+        nrecs = os.path.getsize(path) // TICKDTYPE.itemsize
+        return np.memmap(path, dtype=TICKDTYPE, mode='r', shape=(nrecs,))
+
+    def load_selection(self, exid, mid, sid):
+        """Return array of records (ordered by time) for a single selection."""
+
+        recs = self.load_market(exid, mid)
+        return recs[recs['sid'] == sid]
+
+def archive_from_db(dbman, archive):
+    """Copy everything in the histselections table into archive.
+
+    This is for building an archive from a database written before
+    we had the archive; note it doesn't check for records already in
+    the archive.
+
+    """
+
+    from betman.database import schema
+
+    res = dbman.cursor.execute('SELECT * FROM {0} ORDER BY tstamp'\
+                               .format(schema.HISTSELECTIONS))
+    n = const.NUMPRICES
+    while True:
+        rows = res.fetchmany(10000)
+        if not rows:
+            break
+        recs = {}
+        for r in rows:
+            # columns are exchange_id, market_id, selection_id, name,
+            # then (price, volume) pairs for back then lay.
+            back = r[4:4 + 2*n]
+            lay = r[4 + 2*n:4 + 4*n]
+            recs.setdefault((r[0], r[1]), []).\
+                append((to_epoch(r[-1]), r[2],
+                        [_nan(p) for p in back[0::2]],
+                        [_nan(v) for v in back[1::2]],
+                        [_nan(p) for p in lay[0::2]],
+                        [_nan(v) for v in lay[1::2]]))
+        for (exid, mid), v in recs.items():
+            archive.append(exid, mid, np.array(v, dtype=TICKDTYPE))
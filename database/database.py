@@ -6,10 +6,150 @@
 
 import os
 import sqlite3
-from betman import const, Market, Selection, util, order
+import atexit
+from threading import Thread
+from Queue import Queue, Empty
+from betman import const, Market, Selection, util, order, metrics, betlog
 from betman.all.betexception import DbError, DbCorruptError
 from betman.matching.matchconst import EVENTMAP
 import schema
+import archive
+
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('database')
+
+# insert (or replace, if we already have a row with the same
+# exchange_id, market_id, selection_id) a row in the selections
+# table, or insert a row in the histselections table.
+_QSELINS = ('INSERT {0} INTO {1} (exchange_id, market_id, '
+            'selection_id, name, b_1, bvol_1, b_2, bvol_2, b_3, '
+            'bvol_3, b_4, bvol_4, b_5, bvol_5, lay_1, lvol_1, '
+            'lay_2, lvol_2, lay_3, lvol_3, lay_4, lvol_4, '
+            'lay_5, lvol_5, src, wsn, dorder, tstamp) values '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,'
+            ' ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+QSELUPSERT = _QSELINS.format('OR REPLACE', schema.SELECTIONS)
+QHISTSELINS = _QSELINS.format('', schema.HISTSELECTIONS)
+
+def _connect():
+    """Return new connection to the database, using WAL journalling.
+
+    WAL means that writing to the database doesn't block readers
+    (and vice versa), and commits are much cheaper.
+
+    """
+
+    # detect types means we can read and write datetime objects no
+    # problemo.
+    conn = sqlite3.connect(const.MASTERDB,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def selection_rows(selections, tstamp):
+    """Return list of rows for the selections/histselections tables."""
+
+    return [(s.exid, s.mid, s.id, s.name) + tuple(s.get_flat_prices())
+            + (s.src, s.wsn, s.dorder, tstamp)
+            for s in selections]
+
+# time of each batch written by the SelectionWriter (the DBMaster
+# writes are timed by decorating them, see all/metrics.py).
+_WRITERTIME = metrics.histogram('db_seconds', 'Time of each database write.',
+                                op='selection_writer')
+
+class SelectionWriter(object):
+    """Write selection prices to the database on a background thread.
+
+    Each call to write puts the selections on a bounded queue and
+    returns immediately.  The writer thread takes everything on the queue
+    (i.e. possibly several ticks worth of prices) and writes it in a
+    single transaction.  If the queue is full, write blocks until
+    the writer catches up, so we never build up an unbounded backlog
+    of prices in memory.
+
+    """
+
+    # maximum number of writes (ticks) waiting on the queue.
+    MAXQUEUE = 50
+
+    # singleton design pattern (as for DBMaster)
+    _instance = None
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(SelectionWriter, cls).__new__(cls, *args,
+                                                                **kwargs)
+            cls._instance._started = False
+        return cls._instance
+
+    def __init__(self):
+        if self._started:
+            return
+
+        self._queue = Queue(self.MAXQUEUE)
+
+        # make sure the database exists before the writer thread
+        # connects to it.
+        DBMaster()
+
+        t = Thread(target = self._run)
+        t.setDaemon(True)
+        t.start()
+        self._started = True
+
+        # write anything still on the queue when the app exits
+        atexit.register(self.flush)
+
+    def write(self, selections, tstamp):
+        """Queue selections to be written to selections and
+        histselections (and the tick archive, if const.WRITEARCHIVE)."""
+
+        self._queue.put((selections, tstamp))
+
+    def flush(self):
+        """Block until everything queued has been written."""
+
+        self._queue.join()
+
+    def _run(self):
+        # sqlite connections can only be used in the thread that
+        # created them, so the writer has its own.
+        conn = _connect()
+        tarchive = archive.TickArchive() if const.WRITEARCHIVE else None
+        while True:
+            # wait for some rows, then take everything else queued.
+            batches = [self._queue.get()]
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except Empty:
+                    break
+
+            # whatever goes wrong, the thread must carry on and mark
+            # the batches done: otherwise write blocks for good once
+            # the queue is full, and so does flush when we exit.
+            try:
+                self._write(conn, tarchive, batches)
+            except Exception, e:
+                log.error('error writing selections: {0}', e)
+            finally:
+                for b in batches:
+                    self._queue.task_done()
+
+    def _write(self, conn, tarchive, batches):
+        rows = [r for (sels, tstamp) in batches
+                for r in selection_rows(sels, tstamp)]
+        try:
+            with _WRITERTIME.time(), conn:
+                conn.executemany(QSELUPSERT, rows)
+                conn.executemany(QHISTSELINS, rows)
+        except sqlite3.Error, e:
+            log.error('error writing selections to database: {0}', e)
+
+        if tarchive:
+            for sels, tstamp in batches:
+                tarchive.write(sels, tstamp)
 
 class DBMaster(object):
     """Simple interface to the main database"""
@@ -34,10 +174,7 @@ class DBMaster(object):
 
     def open(self):
         if not self._isopen:
-            # detect types means we can read and write datetime
-            # objects no problemo.
-            self.conn = sqlite3.connect(const.MASTERDB,
-                                        detect_types=sqlite3.PARSE_DECLTYPES)
+            self.conn = _connect()
             self.cursor = self.conn.cursor()
             self._isopen = True
 
@@ -46,6 +183,8 @@ class DBMaster(object):
         self.conn.close()
         self._isopen = False
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_order_matches')
     def write_order_matches(self, omatches, tplaced):
         """Write to matchorders table"""
         # check database is open
@@ -62,6 +201,8 @@ class DBMaster(object):
         self.cursor.executemany(qins, alldata)
         self.conn.commit()
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_selection_matches')
     def write_selection_matches(self, selmatches):
         """Write to matchselections table"""
         # check database is open
@@ -255,6 +396,8 @@ class DBMaster(object):
             bfsels.append(ex2sel[0])
         return bdaqsels, bfsels
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_market_matches')
     def write_market_matches(self, matches):
         """Write to matchingmarkets table"""
 
@@ -277,6 +420,8 @@ class DBMaster(object):
                 pass
         self.conn.commit()
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_selections')
     def write_selections(self, selections, tstamp):
         """Write to selections table"""
 
@@ -284,53 +429,20 @@ class DBMaster(object):
         if not self._isopen:
             self.open()
         
-        # if a row doesn't exist with this exchange id and market id
-        # we insert it, otherwise we update (since inrunning could have
-        # changed).  This is probably not the most efficient way of
-        # accomplishing that.
-        qins = ('INSERT INTO {0} (exchange_id, market_id, '
-                'selection_id, name, b_1, bvol_1, b_2, bvol_2, b_3, '
-                'bvol_3, b_4, bvol_4, b_5, bvol_5, lay_1, lvol_1, '
-                'lay_2, lvol_2, lay_3, lvol_3, lay_4, lvol_4, '
-                'lay_5, lvol_5, src, wsn, dorder, tstamp) values '
-                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,'
-                ' ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
-        qupd = ('UPDATE {0} SET b_1=?, bvol_1=?, b_2=?, bvol_2=?, '
-                'b_3=?, bvol_3=?, b_4=?, bvol_4=?, b_5=?, bvol_5=?, '
-                'lay_1=?, lvol_1=?, lay_2=?, lvol_2=?, lay_3=?, lvol_3=?, '
-                'lay_4=?, lvol_4=?, lay_5=?, lvol_5=?, src=?, wsn=?, dorder=?,'
-                'tstamp=? '
-                'WHERE exchange_id=? and market_id=? and selection_id=?'\
-                .format(schema.SELECTIONS))
-
         # all the data to insert
-        alldata = [(s.exid, s.mid, s.id, s.name, s.padback[0][0],
-                    s.padback[0][1],
-                    s.padback[1][0], s.padback[1][1], s.padback[2][0],
-                    s.padback[2][1], s.padback[3][0], s.padback[3][1],
-                    s.padback[4][0], s.padback[4][1], s.padlay[0][0],
-                    s.padlay[0][1], s.padlay[1][0], s.padlay[1][1],
-                    s.padlay[2][0], s.padlay[2][1], s.padlay[3][0],
-                    s.padlay[3][1], s.padlay[4][0], s.padlay[4][1],
-                    s.src, s.wsn, s.dorder, tstamp)
-                   for s in selections]
-
-        # write to the current selections table; we have to do this
-        # one entry at a time
-
-        for d in alldata:
-            try:
-                self.cursor.execute(qins.format(schema.SELECTIONS), d)
-            except sqlite3.IntegrityError:
-                # already have (exchange_id, market_id, selection_id)
-                # update prices
-                self.cursor.execute(qupd, d[4:] + d[:3])
+        alldata = selection_rows(selections, tstamp)
+
+        # write to the current selections table, replacing any row
+        # we already have for (exchange_id, market_id, selection_id).
+        self.cursor.executemany(QSELUPSERT, alldata)
 
         # write to the historical selections table
-        self.cursor.executemany(qins.format(schema.HISTSELECTIONS), alldata)
+        self.cursor.executemany(QHISTSELINS, alldata)
             
         self.conn.commit()
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_account_balance')
     def write_account_balance(self, exid, accinfo, tstamp):
         """Write account balance information to accountinfo table"""
         assert len(accinfo) == 4
@@ -466,6 +578,8 @@ class DBMaster(object):
         
         return selections
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_markets')
     def write_markets(self, markets, tstamp):
         """Write to markets table."""
 
@@ -500,6 +614,8 @@ class DBMaster(object):
                                            m.exid, m.id))
         self.conn.commit()
 
+    @metrics.timer('db_seconds', 'Time of each database write.',
+                   op='write_orders')
     def write_orders(self, olist):
         """Write to orders table
 
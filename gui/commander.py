@@ -12,7 +12,10 @@ from betman import clock
 
 # configure engine and clock
 conf = config.GlobalConfig(const.CFGFILE)
-eng = engine.Engine(conf)
+if conf.ThreadedEngine:
+    eng = engine.ThreadedEngine(conf)
+else:
+    eng = engine.Engine(conf)
 clk = clock.Clock(const.TICK_LENGTH_MS / 1000.0)
 # first tick initialises clock
 clk.tick()
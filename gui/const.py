@@ -1,3 +1,5 @@
+from betman import const as _bconst
+
 # app name
 NAME = "Match GUI"
 
@@ -21,4 +23,4 @@ BLACK   = (0,   0,   0)
 
 # each tick in the application corresponds to this time in
 # milliseconds.
-TICK_LENGTH_MS = 1200
+TICK_LENGTH_MS = int(1000 * _bconst.TICKLENGTH)
@@ -10,6 +10,7 @@ from pricepanel import PricePanel
 from controlpanel import ControlPanel
 from imgpanel import SplashPanel
 import models
+from betman import const as bconst
 
 class MyFrame(wx.Frame):
     """Main window.
@@ -57,8 +58,9 @@ class MyFrame(wx.Frame):
         # menus
         self.CreateMenus()
 
-        # StatusBar
-        self.CreateStatusBar()
+        # StatusBar: the second field shows our global position
+        self.CreateStatusBar(2)
+        self.app.posmodel.AddListener(self.OnUpdatePosition)
 
         # event handler for close
         self.Bind(wx.EVT_CLOSE, self.OnClose)
@@ -235,6 +237,22 @@ class MyFrame(wx.Frame):
         else:
             frame.Raise()
 
+    def OnUpdatePosition(self, posmodel):
+        """
+        Show our position on each exchange in the status bar.  Note
+        this 'view' function is called by the listener function of
+        the model.
+        """
+
+        text = []
+        for exid, exname in [(bconst.BDAQID, 'BDAQ'), (bconst.BFID, 'BF')]:
+            pos = posmodel.GetExchangePosition(exid)
+            text.append(('{0}: matched {1:.2f} unmatched {2:.2f} '
+                         'exposure {3:.2f}').format(exname, pos['matched'],
+                                                    pos['unmatched'],
+                                                    pos['exposure']))
+        self.SetStatusText(' | '.join(text), 1)
+
     def OnClose(self, event):
         result = wx.MessageBox("Are you sure you want to close?",
                                style=wx.CENTER|wx.ICON_QUESTION\
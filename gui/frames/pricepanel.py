@@ -58,8 +58,18 @@ class PricePanel(scrolledpanel.ScrolledPanel):
         # remove any previous event from the panel if necessary
         self.Clear()
 
+        # the market we showed before no longer needs the full depth
+        # of prices.
+        self.app.engine.set_price_depth(self.pmodel.GetMidDict(), None)
+
         # configure pricing model
         self.pmodel.SetBDAQMid(bdaqmid)
+
+        # we show const.NPRICES prices on each side of the book, so
+        # fetch that many even if the strategies on the market only
+        # want the best prices (see Strategy.get_price_depth).
+        self.app.engine.set_price_depth(self.pmodel.GetMidDict(),
+                                        const.NPRICES)
         
         # get selection information from BDAQ and BF; we won't get
         # fresh prices from the API via this call unless we absolutely
@@ -18,7 +18,10 @@ class MyApp(wx.App):
         self.gconfig = self.ReadConfigFromFile()
 
         # setup the engine
-        self.engine = engine.Engine(self.gconfig)
+        if self.gconfig.ThreadedEngine:
+            self.engine = engine.ThreadedEngine(self.gconfig)
+        else:
+            self.engine = engine.Engine(self.gconfig)
 
         # models for MVC style 
         self.SetupModels()
@@ -126,6 +129,7 @@ class MyApp(wx.App):
         
         self.pmodel = models.PriceModel.Instance()
         self.omodel = models.OrderModel.Instance()
+        self.posmodel = models.PositionModel.Instance()
         self.strat_models = {}
         self.graph_models = {}
 
@@ -178,7 +182,10 @@ class MyApp(wx.App):
         # (ii) order model.
         self.omodel.Update(self._ostore)
 
-        # (iii) strategy models (keyed by BDAQ selection name).  note
+        # (iii) global position model.
+        self.posmodel.Update(self._ostore)
+
+        # (iv) strategy models (keyed by BDAQ selection name).  note
         # that updating these models is distinct from updating the
         # underlying strategies (which is done by the engine).  The
         # models are updated here so that the views seen by the user
@@ -188,7 +195,7 @@ class MyApp(wx.App):
         for k in self.strat_models:
             self.strat_models[k].Update(self._pstore.newprices)
 
-        # (iv) graph models (keyed by BDAQ selection name).
+        # (v) graph models (keyed by BDAQ selection name).
         for k in self.graph_models:
             self.graph_models[k].Update(self._pstore.newprices)
 
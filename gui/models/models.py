@@ -126,6 +126,52 @@ class OrderModel(AbstractModel):
 
         return self._neworders
 
+@Singleton
+class PositionModel(AbstractModel):
+    """Model for the global position of all of our orders (shown in
+    the status bar of the main frame, see mainframe.py).
+
+    The positions (see stores.POSFIELDS) and exposures of each
+    exchange and of each market we have orders in are kept up to
+    date by the order store as orders change, so updating this model
+    every tick is cheap.
+
+    The position we give for an exchange or a market is the matched
+    and unmatched stake, and the exposure, which is the most we could
+    lose whichever of our unmatched orders are matched, taking the
+    worst case of each selection separately (see
+    stores.net_exposure).  Note we don't give win and lose: these
+    are only meaningful for a single selection.
+
+    """
+
+    def __init__(self):
+        AbstractModel.__init__(self)
+
+        self._ostore = None
+
+    def Update(self, ostore):
+        self._ostore = ostore
+        self.UpdateViews()
+
+    def _Position(self, pos, exposure):
+        pos = dict(zip(stores.POSFIELDS, pos))
+        return {'matched': pos['matched'],
+                'unmatched': pos['unmatched'],
+                'exposure': exposure}
+
+    def GetExchangePosition(self, exid):
+        """Return dict of position of all orders on exchange exid."""
+
+        return self._Position(self._ostore.get_exchange_position(exid),
+                              self._ostore.get_exchange_exposure(exid))
+
+    def GetMarketPosition(self, exid, mid):
+        """Return dict of position of all orders in market mid."""
+
+        return self._Position(self._ostore.get_market_position(exid, mid),
+                              self._ostore.get_market_exposure(exid, mid))
+
 @Singleton
 class PriceModel(AbstractModel):
     """Model used for displaying market prices on the main panel.  
@@ -168,6 +214,16 @@ class PriceModel(AbstractModel):
     def GetMids(self):
         return self._bdaqmid, self._bfmid
 
+    def GetMidDict(self):
+        """Return dict with keys const.BDAQID and const.BFID of mids."""
+
+        mids = {const.BDAQID: [], const.BFID: []}
+        if self._bdaqmid is not None:
+            mids[const.BDAQID].append(self._bdaqmid)
+        if self._bfmid is not None:
+            mids[const.BFID].append(self._bfmid)
+        return mids
+
     def SetSels(self, refresh=False):
         """Initialize selections in the correct display order."""
 
@@ -309,7 +365,9 @@ class StrategyModel(AbstractModel):
         # messages from the strategy
         self.visited_states = []
 
-        # length of self.visited_states
+        # number of states the strategy had visited when we last
+        # looked (the strategy only remembers the most recent ones,
+        # so this can be more than len(self.visited_states)).
         self._nvisited = 0
 
         # string name of strategy in the GUI (see pricepanel.py),
@@ -359,12 +417,12 @@ class StrategyModel(AbstractModel):
                 # note we have to do it this way since the strategy
                 # could have visited multiple states in a single
                 # update.
-                nvisited = self.strategy.brain.get_num_visited_states()
+                brain = self.strategy.brain
+                nvisited = brain.get_num_visited_states()
                 if nvisited != self._nvisited:
-                    self.visited_states = self.strategy.\
-                                          brain.get_visited_states()
+                    self.visited_states = brain.get_visited_states()
                     # the 'new_states' is accessed by the view
-                    self.new_states = self.visited_states[self._nvisited:]
+                    self.new_states = brain.get_visited_states(self._nvisited)
                     self._nvisited = nvisited
 
                 self.UpdateViews()
@@ -45,36 +45,62 @@ def get_match_markets(m1s, m2s):
     m2s are BF markets.
     """
 
-    matchms = []
-    # we need to go match m1s and m2s by event types
-    # first get all event names for markets in m1s
-    # converting to set is a trick to give unique elements,
-    # then back to list again to sort
-    m1names = list(set([m.eventname for m in m1s]))
-    m1names.sort()
+    # we need to go match m1s and m2s by event types, so first
+    # group the markets on each exchange by event name (in a single
+    # pass over each list).
+    bdaqbyevent = _group_by_event(m1s)
+    bfbyevent = _group_by_event(m2s)
+
     matchms = []
     # match markets for each event in turn
-    for name in m1names:
-        bdaqms = [m for m in m1s if m.eventname == name]
-        bfms = [m for m in m2s if m.eventname == EVENTMAP[name]]
-        matchms += (_matchevent(bdaqms, bfms, name))
-
-        nomatch = [m.name for m in bdaqms if not m
-                   in [a[0] for a in matchms]]
+    for name in sorted(bdaqbyevent):
+        bdaqms = bdaqbyevent[name]
+        bfms = bfbyevent.get(EVENTMAP[name], [])
+        ematchms = _matchevent(bdaqms, bfms, name)
+        matchms.extend(ematchms)
+
+        matched = set([id(a[0]) for a in ematchms])
+        nomatch = [m.name for m in bdaqms if id(m) not in matched]
         betlog.betlog.debug("Matched {0}/{1} BDAQ {2} markets"\
-                            .format(len(matchms), len(bdaqms),
-                                    name))
+                            .format(len(bdaqms) - len(nomatch),
+                                    len(bdaqms), name))
     
     return matchms
 
-def _matchselection(sel, sellist):
-    """
-    Return selection in sellist that 'matches' sel, or None if no
-    match found.
+def _group_by_event(markets):
+    """Return dict mapping event name to list of markets."""
+
+    byevent = {}
+    for m in markets:
+        byevent.setdefault(m.eventname, []).append(m)
+    return byevent
 
-    Here sel is a BDAQ selection names, and sellist is a list of BF
-    selections.
+# number at the start of some BF selection names (see _bfnames)
+_NUMRE = re.compile(r'\d+')
+
+def _bfnames(sellist):
+    """
+    Return two dicts mapping the normalised name of each BF selection
+    in sellist to the selection; the first uses the full name, the
+    second the name with any leading number removed.  If two
+    selections have the same normalised name, we keep the first (as
+    _matchselection would).
     """
+
+    names = {}
+    nonumber = {}
+    for s in sellist:
+        names.setdefault(s.name.strip().lower(), s)
+        # This is for matching horse racing selections on US markets
+        # which look like '7. mazzy'
+        mat = _NUMRE.match(s.name)
+        if mat:
+            sn = s.name[mat.end() + 2:]
+            nonumber.setdefault(sn.strip().lower(), s)
+    return names, nonumber
+
+def _bdaqname(sel):
+    """Return the normalised name of BDAQ selection sel."""
     
     # Horse Racing: the BDAQ horse racing selections have numbers in
     # them, but the BF ones dont', so lets remove the numbers from the
@@ -94,24 +120,28 @@ def _matchselection(sel, sellist):
     # Vettel'.  This is clearly a bit cheeky.  Lets strip any
     # whitespace at start and end of name, and for both exchanges just
     # in case.
-    selname = selname.strip().lower()
+    return selname.strip().lower()
 
-    for s in sellist:
-        if s.name.strip().lower() == selname:
-            return s
+def _matchselection(sel, bfnames):
+    """
+    Return BF selection that 'matches' sel, or None if no match
+    found.
 
-    # if we haven't matched here, try removing numbers with dot from
-    # the BF selection name.  This is for matching horse racing
-    # selections on US markets which look like '7. mazzy'
-    for s in sellist:
-        mat = re.match('\d+', s.name)
-        if mat:
-            sn = s.name[mat.end() + 2:]
-            if sn.strip().lower() == selname:
-                return s
+    Here sel is a BDAQ selection, and bfnames are the dicts returned
+    by _bfnames for the BF selections of the market.
+    """
+
+    names, nonumber = bfnames
+    selname = _bdaqname(sel)
+
+    s = names.get(selname)
+    if s is None:
+        # if we haven't matched here, try removing numbers with dot
+        # from the BF selection name.
+        s = nonumber.get(selname)
 
-    # we tried everything, so give up
-    return None
+    # if s is None, we tried everything, so give up
+    return s
 
 def get_match_selections(m1sels, m2sels):
     """
@@ -131,8 +161,10 @@ def get_match_selections(m1sels, m2sels):
     for (sel1list, sel2list) in zip(m1sels, m2sels):
         # match the selections for this market: go through each bdaq
         # selection in turn and try to find a matching BF selection.
+        # We normalise the BF names once per market.
+        bfnames = _bfnames(sel2list)
         for sel in sel1list:
-            matchsel = _matchselection(sel, sel2list)
+            matchsel = _matchselection(sel, bfnames)
             if matchsel:
                 # a matching selection was found
                 matchsels.append((sel, matchsel))
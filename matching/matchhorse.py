@@ -97,6 +97,9 @@ COURSES = {
 _BDAQ_COURSES = {i: None for i in COURSES.values()}
 _BF_COURSES = {i: None for i in COURSES.keys()}
 
+# e.g. 'Race 5' in a BDAQ US race name (see _add_course_BDAQ)
+_RACERE = re.compile(r'Race \d+')
+
 def _is_bst():
     """Are we currently in BST (British Summer Time)"""
 
@@ -125,7 +128,7 @@ def _add_course_BDAQ(m):
         # ok, assume races names like so:
         # |Horse Racing|US Racing|Turfway Park (7th February 2014)|01:11 Turfway Park Race 5|Place Market
         # in which case we need to remove the 'Race 5' part
-        mat = re.search('Race \d+', course)
+        mat = _RACERE.search(course)
         if mat:
             course = course[:mat.start() - 1]
         if course not in _BDAQ_COURSES:
@@ -134,9 +137,9 @@ def _add_course_BDAQ(m):
             # in which case we need to look at a level deeper
             # i.e. names[-3], and remove everything after the bracket (and the space before).
             course = names[-3]
-            mat = re.search('\(', course)
-            if mat:
-                course = course[:mat.start() - 1]
+            bracket = course.find('(')
+            if bracket != -1:
+                course = course[:bracket - 1]
 
     # assign course to the market object
     m.course = course
@@ -181,15 +184,16 @@ def match_horse(bdaqmarkets, bfmarkets):
 
     # get dictionary of all the courses for BDAQ markets
     allcourses = {}
-    for c in [m.course for m in bdaqwinmarkets]:
-        if c not in allcourses:
-            allcourses[c] = None
+    for m in bdaqwinmarkets:
+        allcourses[m.course] = None
 
     betlog.betlog.debug('Found BDAQ horse races for courses: {0}'\
                         .format('\n'.join([c for c in allcourses])))
 
-    # get all the BF races happening at one of these courses
-    bfmarks = []
+    # get all the BF races happening at one of these courses.  We
+    # index these by (course, start time), so that we can look up the
+    # match for each BDAQ market directly.
+    bfindex = {}
     for m in bfmarkets:
         names = m.name.split('|')
         
@@ -227,19 +231,14 @@ def match_horse(bdaqmarkets, bfmarkets):
             (names[2]  == 'ANTEPOST')):
             continue
         
-        # we passed all the criteria: add to list of possible markets
-        bfmarks.append(m)
+        # we passed all the criteria: add to index of possible markets
+        bfindex.setdefault((m.course, m.starttime), []).append(m)
 
     # go through each bdaq market in turn, try to find a matching bf
-    # market.
+    # market: same course and same start time, so same race.
     matchmarks = []
     for m1 in bdaqwinmarkets:
-        for m2 in bfmarks:
-            # check races are happening on same course
-            if m1.course == m2.course:
-                # check start time of races are the same
-                if m1.starttime == m2.starttime:
-                    # same course and same start time, so same race
-                    matchmarks.append((m1, m2))
+        for m2 in bfindex.get((m1.course, m1.starttime), []):
+            matchmarks.append((m1, m2))
 
     return matchmarks
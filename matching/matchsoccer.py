@@ -6,14 +6,19 @@ from betman import database, const, betlog
 import numpy as np
 import re
 
+# regular expressions used by bdaqconvert
+_BRACKETRE = re.compile(r' *\(.*?\) *')
+_TIMERE = re.compile(r'[0-9][0-9]:[0-9][0-9] *')
+_COLONRE = re.compile(r' *:.*')
+
 def bdaqconvert(s):
     # first remove anything in brackets, including spaces around
     # brackets
-    s = re.sub(r' *\(.*?\) *', '', s)
+    s = _BRACKETRE.sub('', s)
     # strip any times like 19:30 out as well as trailing spaces
-    s = re.sub(r'[0-9][0-9]:[0-9][0-9] *', '', s)    
+    s = _TIMERE.sub('', s)
     # strip a colon, anything following and any spaces before...
-    s = re.sub(r' *:.*', '', s)
+    s = _COLONRE.sub('', s)
     # remove 'The - matches the championship
     s = s.replace('The ','')
     # english leagues 1, 2
@@ -54,16 +59,20 @@ def match_soccer(BDAQMarkets, BFMarkets):
              'First Scoring Play': ['First Scoring Play'],
              'Top 4 Finish': ['Top 4 Finish','Top 4 Finish 2013/2014']
              }
+    # index the BF markets by (market name, level up name); we keep
+    # the position of the first BF market with each key, since we
+    # match with the first BF market in the list.
+    bfindex = {}
+    for (i, m2) in enumerate(BFMarkets):
+        sp2 = m2.name.split('|')
+        bfindex.setdefault((sp2[-1], bfconvert(sp2[-2])), (i, m2))
+
     matches = []
     for m1 in BDAQMarkets:
         sp1 = m1.name.split('|')
         n1 = bdaqconvert(sp1[-2])
-        for m2 in BFMarkets:
-            sp2 = m2.name.split('|')
-            if sp2[-1] in mname.get(sp1[-1],[]):
-                # go to level up
-                n2 = bfconvert(sp2[-2])
-                if (n1 == n2):
-                    matches.append((m1,m2))
-                    break
+        found = [bfindex[(n, n1)] for n in mname.get(sp1[-1], [])
+                 if (n, n1) in bfindex]
+        if found:
+            matches.append((m1, min(found)[1]))
     return matches
@@ -4,7 +4,7 @@
 
 """Market making strategy for both exchanges simultaneously."""
 
-from betman import const, order, util
+from betman import const
 from betman.strategy import strategy, mmstrategy
 
 class BothMMStrategy(strategy.Strategy):
@@ -24,14 +24,19 @@ class BothMMStrategy(strategy.Strategy):
         self.strat1 = mmstrategy.MMStrategy(sel1)
         self.strat2 = mmstrategy.MMStrategy(sel2)
 
-        # overload certain functionality of self.brain.  The above
-        # super() call gives us self.brain, but really we are using
-        # self.strat1.brain and self.strat2.brain to do the reasoning.
-        # Since the monitorframe accesses information of self.brain
-        vs = lambda : self.strat1.brain.get_visited_states() + self.strat2.brain.get_visited_states()
-        nvs = lambda : self.strat1.brain.get_num_visited_states() + self.strat2.brain.get_num_visited_states()
-        self.brain.get_visited_states = vs
-        self.brain.get_num_visited_states = nvs
+        # the order store files the orders of both strategies under
+        # this strategy (so that e.g. PositionTracker sees them all).
+        self.strat1.owner = self
+        self.strat2.owner = self
+
+        # the above super() call gives us self.brain, but really we
+        # are using self.strat1.brain and self.strat2.brain to do the
+        # reasoning.  Since the monitorframe reads the visited states
+        # of self.brain, all three share one history.  Both
+        # strategies are MMStrategy, so they have the same states with
+        # the same ids, and the names of strat1's serve for both.
+        self.strat2.brain.history = self.strat1.brain.history
+        self.brain.history = self.strat1.brain.history
 
     def get_marketids(self):
         mids1 = self.strat1.get_marketids()
@@ -41,13 +46,31 @@ class BothMMStrategy(strategy.Strategy):
             allids[k] = mids1.get(k, []) + mids2.get(k, []) 
         return allids
         
-    def get_orders_to_place(self):
-        pl1 = self.strat1.get_orders_to_place()
-        pl2 = self.strat2.get_orders_to_place()
-        allpl = {const.BDAQID: [], const.BFID: []}
+    def get_selections(self):
+        return self.strat1.get_selections() + self.strat2.get_selections()
+
+    def get_selectionids(self):
+        return self.strat1.get_selectionids() + self.strat2.get_selectionids()
+
+    def _merge(self, d1, d2):
+        """Return merged dict of orders (or orefs) from both strategies."""
+
+        allo = {const.BDAQID: [], const.BFID: []}
         for k in [const.BDAQID, const.BFID]:
-            allpl[k] = pl1.get(k, []) + pl2.get(k, []) 
-        return allpl
+            allo[k] = d1.get(k, []) + d2.get(k, [])
+        return allo
+
+    def get_orders_to_place(self):
+        return self._merge(self.strat1.get_orders_to_place(),
+                           self.strat2.get_orders_to_place())
+
+    def get_orders_to_cancel(self):
+        return self._merge(self.strat1.get_orders_to_cancel(),
+                           self.strat2.get_orders_to_cancel())
+
+    def get_orders_to_update(self):
+        return self._merge(self.strat1.get_orders_to_update(),
+                           self.strat2.get_orders_to_update())
 
     def update_prices(self, prices):
         """Update price info (from API) for both strategies."""
@@ -61,7 +84,27 @@ class BothMMStrategy(strategy.Strategy):
         self.strat1.update_orders(orders)
         self.strat2.update_orders(orders)
 
-    def get_allorefs(self):
+    def update_ttl(self, ttl):
+        """Update time to live of both strategies."""
+
+        self.strat1.update_ttl(ttl)
+        self.strat2.update_ttl(ttl)
+
+    def get_price_depth(self):
+        return max(self.strat1.get_price_depth(),
+                   self.strat2.get_price_depth())
+
+    def get_poll_interval(self, default):
+        """Poll as often as the faster of the two strategies wants."""
+
+        return min(self.strat1.get_poll_interval(default),
+                   self.strat2.get_poll_interval(default))
+
+    def get_order_owners(self):
+        return (self.strat1.get_order_owners() +
+                self.strat2.get_order_owners())
+
+    def get_all_orefs(self):
         # return dictionary of all order refs
-        return util.cdict(self.strat1.get_allorefs(), 
-                          self.strat2.get_allorefs())
+        return self._merge(self.strat1.get_all_orefs(),
+                           self.strat2.get_all_orefs())
@@ -11,6 +11,10 @@ from betman import const, database, order, exchangedata, betlog
 from betman.strategy import strategy
 from betman.api.bdaq import bdaqapi
 
+# ids of the states (see StateMachine in strategy.py)
+(NOOPP, INSTANTOPP, OPP, LAYPLACED, BOTHPLACED, LAYMATCHED, BACKMATCHED,
+ BOTHMATCHED) = range(8)
+
 # commission on winnings taken from both exchanges.
 _COMMISSION = {const.BDAQID: 0.05, const.BFID: 0.05}
 
@@ -25,6 +29,10 @@ class CXStrategy(strategy.Strategy):
     ex2sel - Selection object for exchange 2 (Betfair)
     """
     
+    # we only place bets when the lay odds are less than this (see
+    # filter_bets).
+    MAXLAYODDS = 20
+
     def __init__(self, ex1sel = None, ex2sel = None,
                  instantonly = True):
         """
@@ -70,7 +78,7 @@ class CXStrategy(strategy.Strategy):
         self.brain.add_state(both_matched_state)        
 
         # initialise into noopp state
-        self.brain.set_state(noopp_state.name)
+        self.brain.set_state(NOOPP)
 
     def __str__(self):
         return self.sel1.name
@@ -80,6 +88,22 @@ class CXStrategy(strategy.Strategy):
         
         return {const.BDAQID: [self.sel1.mid],
                 const.BFID: [self.sel2.mid]}
+
+    def get_selections(self):
+        """Return list of both selections."""
+
+        return [self.sel1, self.sel2]
+
+    def get_selectionids(self):
+        """Return list of (exid, mid, sid) of both selections."""
+
+        return [(self.sel1.exid, self.sel1.mid, self.sel1.id),
+                (self.sel2.exid, self.sel2.mid, self.sel2.id)]
+
+    def get_price_depth(self):
+        """We only look at the best back and lay prices."""
+
+        return 1
     
     def get_orders_to_place(self):
         """Return dictionary of orders to place."""
@@ -129,7 +153,7 @@ class CXStrategy(strategy.Strategy):
             # back selection at best current price
             oback = s2.best_back()
 
-            if oback == exchange.MAXODDS:
+            if oback == exchangedata.MAXODDS:
                 return False
 
             if self._backlay(oback, olay):
@@ -292,14 +316,35 @@ class CXStrategy(strategy.Strategy):
             return True
         return False
 
-    def update_orders(self, orders):
+    def find_order(self, o, ostore):
+        """Return current state of order o from the order store.
+
+        If we don't know the order reference yet (i.e. the order was
+        only just placed), look for the order in the orders the store
+        told us were placed (see Strategy.order_placed).  If we can't
+        find the order, return o.
+
+        """
+
+        if hasattr(o, 'oref'):
+            newo = ostore.get_order(o.exid, o.oref)
+            return o if newo is None else newo
+
+        newo = self.find_placed_order(o)
+        return o if newo is None else newo
+
+    def update_orders(self, ostore):
+        """
+        Update order information for any outstanding orders for this
+        strategy, then do the thinking.
+
+        ostore - the order store (see core/stores/orderstore.py).
+        """
 
         if hasattr(self, 'border'):
-            if self.border.oref in orders:
-                self.border = orders[self.border.oref]
+            self.border = self.find_order(self.border, ostore)
         if hasattr(self, 'lorder'):
-            if self.lorder.oref in orders:
-                self.lorder = orders[self.lorder.oref]
+            self.lorder = self.find_order(self.lorder, ostore)
 
         # AI
         self.brain.update()
@@ -342,11 +387,11 @@ class CXStrategy(strategy.Strategy):
         
         # if we are in 'bothplaced' state, the opportunity was instant
         # so we don't want to filter any bets.
-        if self.brain.active_state.name == 'bothplaced':
+        if self.brain.active == BOTHPLACED:
             return
 
         # only interested in opportunities for which lay odds are
-        # less than 20 for now and for which lay price is greater
+        # less than MAXLAYODDS for now and for which lay price is greater
         # than the min odds (i.e. order book is non-empty on this
         # side).
         # go through each exchange number in turn
@@ -367,7 +412,7 @@ class CXStrategy(strategy.Strategy):
                         self.toplace = {}
                         return
 
-                    if o.price > 20:
+                    if o.price > self.MAXLAYODDS:
                         # delete bets from dictionary
                         betlog.betlog.debug(('Filter: deleting bets since layprice '
                                              '{0}'.format(o.price)))
@@ -377,6 +422,8 @@ class CXStrategy(strategy.Strategy):
 class CXStateInstantOpp(strategy.State):
     """An instant opportunity."""
     
+    sid = INSTANTOPP
+
     def __init__(self, cxstrat):
         super(CXStateInstantOpp, self).__init__('instantopp')
         self.cxstrat = cxstrat
@@ -387,10 +434,13 @@ class CXStateInstantOpp(strategy.State):
         self.cxstrat.toplace[self.cxstrat.lorder.exid] = [self.cxstrat.lorder]
 
         # change state again
-        self.cxstrat.brain.set_state('bothplaced')
+        self.cxstrat.brain.set_state(BOTHPLACED)
 
 class CXStateLayPlaced(strategy.State):
     """Lay bet placed (not matched as far as we know)"""
+
+    sid = LAYPLACED
+
     def __init__(self, cxstrat):
         super(CXStateLayPlaced, self).__init__('layplaced')
         self.cxstrat = cxstrat
@@ -406,7 +456,7 @@ class CXStateLayPlaced(strategy.State):
         lmatch = self.cxstrat.lay_order_matched()
 
         if lmatch:
-            return 'laymatched'
+            return LAYMATCHED
         # if lay bet not matched, don't change the state
         return None
 
@@ -417,6 +467,8 @@ class CXStateLayPlaced(strategy.State):
 class CXStateBothPlaced(strategy.State):
     """Both bets placed (neither matched as far as we know)."""
     
+    sid = BOTHPLACED
+
     def __init__(self, cxstrat):
         super(CXStateBothPlaced, self).__init__('bothplaced')
         self.cxstrat = cxstrat
@@ -428,17 +480,19 @@ class CXStateBothPlaced(strategy.State):
 
         if bmatch:
             if lmatch:
-                return 'bothmatched'
+                return BOTHMATCHED
             else:
-                return 'backmatched'
+                return BACKMATCHED
         elif lmatch:
-            return 'laymatched'
+            return LAYMATCHED
         # if neither bet matched, don't change the state
         return None
 
 class CXStateLayMatched(strategy.State):
     """Lay bet matched, back bet placed."""
     
+    sid = LAYMATCHED
+
     def __init__(self, cxstrat):
         super(CXStateLayMatched, self).__init__('laymatched')
         self.cxstrat = cxstrat
@@ -449,11 +503,13 @@ class CXStateLayMatched(strategy.State):
 
         if bmatch:
             # the trade has been completed
-            return 'bothmatched'
+            return BOTHMATCHED
     
 class CXStateBackMatched(strategy.State):
     """Back bet matched."""
     
+    sid = BACKMATCHED
+
     def __init__(self, cxstrat):
         super(CXStateBackMatched, self).__init__('backmatched')
         self.cxstrat = cxstrat
@@ -461,17 +517,21 @@ class CXStateBackMatched(strategy.State):
 class CXStateBothMatched(strategy.State):
     """Both bets matched."""
     
+    sid = BOTHMATCHED
+
     def __init__(self, cxstrat):
         super(CXStateBothMatched, self).__init__('bothmatched')
         self.cxstrat = cxstrat
 
     def check_conditions(self):
         # the trade has been completed, go back to 'noopp' state
-        return 'noopp'
+        return NOOPP
 
 class CXStateOpp(strategy.State):
     """An opportunity."""
     
+    sid = OPP
+
     def __init__(self, cxstrat):
         super(CXStateOpp, self).__init__('opp')
         self.cxstrat = cxstrat
@@ -481,13 +541,17 @@ class CXStateOpp(strategy.State):
         self.cxstrat.make_lay_order()
 
         # change state again
-        self.cxstrat.brain.set_state('layplaced')
+        self.cxstrat.brain.set_state(LAYPLACED)
 
     def do_actions(self):
         pass
         
 class CXStateNoOpp(strategy.State):
     """No betting opportunity."""
+
+    sid = NOOPP
+
+    pricesonly = True
     
     def __init__(self, cxstrat):
         super(CXStateNoOpp, self).__init__('noopp')
@@ -501,12 +565,12 @@ class CXStateNoOpp(strategy.State):
         
         # check if there is an instant opportunity
         if self.cxstrat.check_instant_opportunity():
-            return 'instantopp'
+            return INSTANTOPP
         
         # only check for non instant opportunities if we have that
         # flag set.
         if not self.cxstrat.ionly:
             if self.cxstrat.check_opportunity():
-                return 'opp'
+                return OPP
         # if no opportunities, don't change state
         return None
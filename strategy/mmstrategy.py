@@ -4,9 +4,16 @@
 
 """Market making strategy."""
 
-from betman import const, order, exchangedata
+from betman import const, order, exchangedata, betlog
 from betman.strategy import strategy
 
+# logger for this module (see all/betlog.py)
+log = betlog.get_logger('mmstrategy')
+
+# ids of the states (see StateMachine in strategy.py)
+(NOOPP, OPP, BOTHPLACED, BACKMATCHED, LAYMATCHED, BOTHMATCHED,
+ FINISHED) = range(7)
+
 # commission on winnings taken from both exchanges.
 _COMMISSION = {const.BDAQID: 0.05, const.BFID: 0.05}
 
@@ -26,6 +33,11 @@ class MMStrategy(strategy.Strategy):
     # if added by an automation, this sets the ttl before we close out
     # the position.
     TTL_CLOSE = 60
+
+    # if added by an automation, we poll prices twice as often when
+    # the ttl is less than this (the book moves fastest near the
+    # start of the race).
+    TTL_FAST = 300
     
     def __init__(self, sel=None, auto=False):
         """
@@ -75,7 +87,7 @@ class MMStrategy(strategy.Strategy):
         self.brain.add_state(finished_state)
 
         # initialise into noopp state
-        self.brain.set_state(noopp_state.name)
+        self.brain.set_state(NOOPP)
 
     def __str__(self):
         return '{0} ({1})'.format(self.sel.name, self.sel.exid)
@@ -83,23 +95,11 @@ class MMStrategy(strategy.Strategy):
     def get_marketids(self):
         return {self.sel.exid: [self.sel.mid]}
 
-    def find_order_in_dict(self, order, orders):
-        """Find order in dict (to get oref)
-
-        This assumes we didn't just make more than one bet on a
-        selection on the given exchange with a single polarity.
-
-        """
+    def get_selections(self):
+        return [self.sel]
 
-        exid = order.exid
-        sid = order.sid
-        pol = order.polarity
-        for o in orders[exid].values():
-            if ((o.exid == exid) and (o.sid == sid)
-                and (o.polarity == pol)):
-                return o
-        # no order found
-        return None
+    def get_selectionids(self):
+        return [(self.sel.exid, self.sel.mid, self.sel.id)]
 
     def get_orders_to_place(self):
         return self.toplace
@@ -121,19 +121,18 @@ class MMStrategy(strategy.Strategy):
                 border = ostore.get_order(self.border.exid, self.border.oref)
                 if border is not None:
                     self.border = border
-            else: # we need to figure out which order in the orders
-                  # dictionary is ours! (we should only have to do
-                  # this once, on the tick after which the order was
-                  # placed).
-                  border = self.find_order_in_dict(self.border, ostore.orders_tosearch)
+            else: # we need to figure out which of the orders the
+                  # store told us were placed is ours (we should only
+                  # have to do this once, on the tick after which the
+                  # order was placed).
+                  border = self.find_placed_order(self.border)
                   if border:
-                      print 'found order with id', border.oref, border.polarity, border.price, border.stake, border.status
+                      log.debug('found order with id {0} {1} {2} {3} {4}',
+                                border.oref, border.polarity, border.price,
+                                border.stake, border.status)
                       self.border = border
-                      # add the order to the list of successfully
-                      # placed orders
-                      self.allorefs[border.exid].append(border.oref)
                   else:
-                      print 'warning: could not find border in dictionary!'
+                      log.debug('could not find border in dictionary!')
 
         if hasattr(self, 'lorder'):
             if hasattr(self.lorder, 'oref'):
@@ -142,19 +141,18 @@ class MMStrategy(strategy.Strategy):
                 lorder = ostore.get_order(self.lorder.exid, self.lorder.oref)
                 if lorder is not None:
                     self.lorder = lorder
-            else: # we need to figure out which order in the orders
-                  # dictionary is ours! (we should only have to do
-                  # this once, on the tick after which the order was
-                  # placed).
-                  lorder = self.find_order_in_dict(self.lorder, ostore.orders_tosearch)
+            else: # we need to figure out which of the orders the
+                  # store told us were placed is ours (we should only
+                  # have to do this once, on the tick after which the
+                  # order was placed).
+                  lorder = self.find_placed_order(self.lorder)
                   if lorder:
-                      print 'found order with id', lorder.oref, lorder.polarity, lorder.price, lorder.stake, lorder.status
+                      log.debug('found order with id {0} {1} {2} {3} {4}',
+                                lorder.oref, lorder.polarity, lorder.price,
+                                lorder.stake, lorder.status)
                       self.lorder = lorder
-                      # add the order to the list of successfully
-                      # placed orders
-                      self.allorefs[lorder.exid].append(lorder.oref)
                   else:
-                      print 'warning: could not find lorder in dictionary!'
+                      log.debug('could not find lorder in dictionary!')
 
     def update_prices(self, prices):
         """
@@ -189,10 +187,22 @@ class MMStrategy(strategy.Strategy):
     def update_ttl(self, ttl):
         """Update time to live (if added by automation only)."""
 
-        print 'updated ttl of strategy {0} to {1}'.format(self.sel.name, ttl)
+        log.debug('updated ttl of strategy {0} to {1}', self.sel.name, ttl)
 
         self.ttl = ttl
 
+    def get_price_depth(self):
+        """We only look at the best back and lay prices."""
+
+        return 1
+
+    def get_poll_interval(self, default):
+        """Poll faster when we are close to the end (see TTL_FAST)."""
+
+        if self.auto and (self.ttl < self.TTL_FAST):
+            return default / 2.0
+        return default
+
     def can_make(self):
         """Return True if we 'can' make a market here"""
 
@@ -312,6 +322,10 @@ class MMStrategy(strategy.Strategy):
 class MMStateNoOpp(strategy.State):
     """No betting opportunity."""
 
+    sid = NOOPP
+
+    pricesonly = True
+
     def __init__(self, mmstrat):
         super(MMStateNoOpp, self).__init__('noopp')
         self.mmstrat = mmstrat
@@ -325,7 +339,7 @@ class MMStateNoOpp(strategy.State):
         if self.mmstrat.can_make():
             # create the back and lay orders
             self.mmstrat.create_orders()
-            return 'opp'
+            return OPP
         
         # if no opportunities, don't change state
         return None
@@ -333,6 +347,8 @@ class MMStateNoOpp(strategy.State):
 class MMStateOpp(strategy.State):
     """An opportunity to make the market."""
 
+    sid = OPP
+
     def __init__(self, mmstrat):
         super(MMStateOpp, self).__init__('opp')
         self.mmstrat = mmstrat
@@ -343,7 +359,7 @@ class MMStateOpp(strategy.State):
                                                        self.mmstrat.lorder]
 
         # change state again
-        self.mmstrat.brain.set_state('bothplaced')
+        self.mmstrat.brain.set_state(BOTHPLACED)
 
     def do_actions(self):
         pass
@@ -355,6 +371,8 @@ class MMStateOpp(strategy.State):
         return None
 
 class MMStateBothPlaced(strategy.State):
+    sid = BOTHPLACED
+
     def __init__(self, mmstrat):
         super(MMStateBothPlaced, self).__init__('bothplaced')
         self.mmstrat = mmstrat
@@ -371,49 +389,55 @@ class MMStateBothPlaced(strategy.State):
 
         if bm:
             if lm:
-                return 'bothmatched'
+                return BOTHMATCHED
             else:
-                return 'backmatched'
+                return BACKMATCHED
         if lm:
-            return 'laymatched'
+            return LAYMATCHED
 
         # if we are part of an automation and have limited time to
         # live, close out position and go into 'finished' state.
         if self.mmstrat.ttl < self.mmstrat.TTL_CLOSE:
             self.mmstrat.close_position()
-            return 'finished'
+            return FINISHED
 
 class MMStateBackMatched(strategy.State):
+    sid = BACKMATCHED
+
     def __init__(self, mmstrat):
         super(MMStateBackMatched, self).__init__('backmatched')
         self.mmstrat = mmstrat
 
     def check_conditions(self):
         if self.mmstrat.lay_bet_matched():
-            return 'bothmatched'
+            return BOTHMATCHED
 
         # if we are part of an automation and have limited time to
         # live, close out position and go into 'finished' state.
         if self.mmstrat.ttl < self.mmstrat.TTL_CLOSE:
             self.mmstrat.close_position()
-            return 'finished'
+            return FINISHED
 
 class MMStateLayMatched(strategy.State):
+    sid = LAYMATCHED
+
     def __init__(self, mmstrat):
         super(MMStateLayMatched, self).__init__('laymatched')
         self.mmstrat = mmstrat
 
     def check_conditions(self):
         if self.mmstrat.back_bet_matched():
-            return 'bothmatched'
+            return BOTHMATCHED
 
         # if we are part of an automation and have limited time to
         # live, close out position and go into 'finished' state.
         if self.mmstrat.ttl < self.mmstrat.TTL_CLOSE:
             self.mmstrat.close_position()
-            return 'finished'
+            return FINISHED
 
 class MMStateBothMatched(strategy.State):
+    sid = BOTHMATCHED
+
     def __init__(self, mmstrat):
         super(MMStateBothMatched, self).__init__('bothmatched')
         self.mmstrat = mmstrat
@@ -421,9 +445,11 @@ class MMStateBothMatched(strategy.State):
     def entry_actions(self):
         # change state immediately back to noop state, ready to sense
         # another opportunity.
-        self.mmstrat.brain.set_state('noopp')
+        self.mmstrat.brain.set_state(NOOPP)
 
 class MMStateFinished(strategy.State):
+    sid = FINISHED
+
     def __init__(self, mmstrat):
         super(MMStateFinished, self).__init__('finished')
         self.mmstrat = mmstrat
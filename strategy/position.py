@@ -4,8 +4,8 @@
 
 """Class for monitoring net position for strategy."""
 
+import numpy as np
 from betman import const, order, util
-from operator import attrgetter
 from betman.core import stores
 
 class PositionTracker(object):
@@ -24,16 +24,10 @@ class PositionTracker(object):
         placed (oldest first).
         """
         
-        # dictionary of order references
-        orefdict = self.strategy.get_all_orefs()
-        
-        # dictionary of the actual order objects
-        odict = self.ostore.get_orders_from_oref_dict(orefdict)
-
-        # get a single list of order objects ordered by time placed
-        olist = odict[const.BDAQID] + odict[const.BFID]
+        # the order store keeps the orders of each strategy ordered
+        # by time placed.
+        olist = self.ostore.get_strategy_orders(self.strategy)
         self.ostore.set_tplaced(olist)
-        olist.sort(key=attrgetter('tplaced'))
 
         return olist
 
@@ -49,48 +43,50 @@ class PositionTracker(object):
         # (ii) our return if the selection loses.  We want this in two
         # cases: (i) currently (i.e. with the current set of unmatched
         # bets) and (ii) if all of the bets made are matched.  So we
-        # have 4 numbers.
+        # have 4 numbers.  The order store keeps these up to date as
+        # the orders change (see orderstore.order_position), so we
+        # don't need to go through the orders here.
 
-        win_pos = 0.0
-        win_posif = 0.0
-        lose_pos = 0.0
-        lose_posif = 0.0
-        
-        for o in self.get_all_orders():
-            # add this to all positions
+        win_pos, win_posif, lose_pos, \
+        lose_posif = self.ostore.get_strategy_position(self.strategy)[:4]
+
+        return win_pos, win_posif, lose_pos, lose_posif
+
+    def get_order_arrays(self):
+        """
+        Return NumPy arrays sign, price, stake, mstake, ustake for all
+        orders the strategy has placed (oldest first).
+
+        sign   - +1 for a back, -1 for a lay
+        price  - odds of the order
+        stake  - stake of the order
+        mstake - matched stake
+        ustake - unmatched stake (nonzero for unmatched orders only)
+
+        Unlike get_positions, we keep the matched part of any orders
+        that were cancelled after being part matched.
+        """
+
+        olist = self.get_all_orders()
+        n = len(olist)
+        sign = np.empty(n)
+        price = np.empty(n)
+        stake = np.empty(n)
+        mstake = np.zeros(n)
+        ustake = np.zeros(n)
+        for i, o in enumerate(olist):
+            sign[i] = 1.0 if o.polarity == order.BACK else -1.0
+            price[i] = o.price
+            stake[i] = o.stake
             if o.status == order.MATCHED:
-                if o.polarity == order.LAY:
-                    dw = -o.stake * o.price
-                    dl = o.stake
-                else: # back
-                    dw = o.stake * o.price
-                    dl = -o.stake
-                win_pos += dw
-                lose_pos += dl
-                win_posif += dw
-                lose_posif += dl
+                mstake[i] = o.stake
             elif o.status == order.UNMATCHED:
-                # careful here, since the order could be 'part'
-                # matched.
-                ms, us = o.matchedstake, o.unmatchedstake
-                # compute win/loss amounts for matched and unmatched
-                # parts separately.
-                if o.polarity == order.LAY:
-                    dwm = -ms * o.price
-                    dwu = -us * o.price
-                    dlm = ms
-                    dlu = us
-                else: # back
-                    dwm = ms * o.price
-                    dwu = us * o.price
-                    dlm = -ms
-                    dlu = -us
-                win_pos += dwm
-                lose_pos += dlm
-                win_posif += dwm + dwu
-                lose_posif += dlm + dlu
+                mstake[i] = getattr(o, 'matchedstake', 0.0)
+                ustake[i] = getattr(o, 'unmatchedstake', o.stake)
+            else:
+                mstake[i] = getattr(o, 'matchedstake', 0.0) or 0.0
 
-        return win_pos, win_posif, lose_pos, lose_posif
+        return sign, price, stake, mstake, ustake
 
     def get_unmatched_bets(self):
 
@@ -100,6 +96,24 @@ class PositionTracker(object):
                 unmatched.append(o)
 
         return unmatched
+
+    def get_position(self):
+        """Return dict of full position of strategy (see POSFIELDS)."""
+
+        return dict(zip(stores.POSFIELDS,
+                        self.ostore.get_strategy_position(self.strategy)))
                 
     def get_all_bets(self):
         return self.strategy.get_all_orders()
+
+def net_returns(sign, price, stake):
+    """
+    Return (win, lose), our net return if the selection wins and if
+    it loses, from arrays of order sign (+1 back, -1 lay), price and
+    stake (as returned by PositionTracker.get_order_arrays).  Note this
+    is before any commission is taken.
+    """
+
+    win = np.sum(sign * stake * (price - 1.0))
+    lose = -np.sum(sign * stake)
+    return win, lose
@@ -4,7 +4,14 @@
 
 """Base classes Strategy, StrategyGroup, StateMachine"""
 
-from betman import const, betlog
+from collections import deque
+from itertools import islice
+from betman import const, betlog, metrics
+
+# time of each update of the state machine of a strategy, i.e. of the
+# 'AI' (see all/metrics.py).
+_STATETIME = metrics.histogram('state_seconds',
+                               'Time of each StateMachine.update.')
 
 class Strategy(object):
     """Base class - a strategy should inherit from this."""
@@ -26,6 +33,16 @@ class Strategy(object):
         # ordered by time placed (with the oldest order being the
         # first in the list).
         self.allorefs = {const.BDAQID: [], const.BFID: []}
+
+        # strategy that the order store files our orders under (see
+        # add_placed_order); this is only different from self when
+        # the strategy is part of another strategy.
+        self.owner = self
+
+        # orders we made that the order store has told us were
+        # placed (see order_placed), but which we haven't yet matched
+        # up with our own order objects (see find_placed_order).
+        self.newplaced = []
         
     def get_marketids(self):
         """
@@ -35,6 +52,44 @@ class Strategy(object):
 
         return {const.BDAQID: [], const.BFID: []}
 
+    def get_selections(self):
+        """
+        Return list of the Selection objects the strategy reads
+        prices for (as of the last price update).
+        """
+
+        return []
+
+    def get_selectionids(self):
+        """
+        Return list of (exid, mid, sid) tuples of the selections the
+        strategy reads prices for.  An empty list means we don't know,
+        and the strategy will be updated whenever it gets new prices.
+        """
+
+        return []
+
+    def can_skip_update(self, changed):
+        """
+        Return True if we don't need to be fed new prices, given the
+        set changed of (exid, mid, sid) of selections whose prices
+        changed.  This is only the case if the active state depends
+        on prices alone, and none of our selections changed.
+        """
+
+        state = self.brain.active_state
+        if (state is None) or (not state.pricesonly):
+            return False
+
+        selids = self.get_selectionids()
+        if not selids:
+            return False
+
+        for selid in selids:
+            if selid in changed:
+                return False
+        return True
+
     def get_orders_to_place(self):
         """Return a dictionary of orders to be placed.
 
@@ -64,6 +119,60 @@ class Strategy(object):
 
         return self.allorefs
 
+    def add_placed_order(self, o, ostore):
+        """
+        Add order o, which we have just found in the order store
+        ostore, to the list of successfully placed orders.
+        """
+
+        self.allorefs[o.exid].append(o.oref)
+        ostore.add_strategy_order(self.owner, o)
+
+    def order_placed(self, o, ostore):
+        """
+        Called by the order store ostore when order o, which we made,
+        has been placed (so that o has an order reference).
+        """
+
+        self.add_placed_order(o, ostore)
+        self.newplaced.append(o)
+
+    def order_changed(self, o, ostore):
+        """
+        Called by the order store ostore when order o, which we made
+        and have already been told was placed, changes.  Strategies
+        usually get the latest state of their orders from the store
+        in update_orders, so by default we do nothing here.
+        """
+
+        pass
+
+    def get_order_owners(self):
+        """
+        Return list of (order, strategy) for each order to place,
+        where strategy made the order (this is only not self for
+        strategies made of other strategies).
+        """
+
+        return [(o, self) for olist in self.get_orders_to_place().values()
+                for o in olist]
+
+    def find_placed_order(self, o):
+        """
+        Return the placed order (see order_placed) for our order o,
+        which has the same exchange, selection and polarity, or None
+        if it hasn't been placed yet.  The placed order is removed
+        from self.newplaced.
+        """
+
+        # most recently placed first
+        for i in xrange(len(self.newplaced) - 1, -1, -1):
+            newo = self.newplaced[i]
+            if ((newo.exid == o.exid) and (newo.sid == o.sid)
+                and (newo.polarity == o.polarity)):
+                return self.newplaced.pop(i)
+        return None
+
     def update_prices(self, prices):
         """
         Update prices of any selections using the prices dict passed
@@ -82,12 +191,47 @@ class Strategy(object):
 
         pass
 
+    def update_ttl(self, ttl):
+        """
+        Update time to live (in seconds) of the strategy; this is
+        called by automations that will remove the strategy when the
+        ttl reaches zero.
+        """
+
+        pass
+
+    def get_price_depth(self):
+        """
+        Return the number of prices we need on each side of the book
+        of our selections.  Strategies that only look at the best
+        prices should return 1, so that we parse and store less
+        (see managers.PollScheduler).
+        """
+
+        return const.NUMPRICES
+
+    def get_poll_interval(self, default):
+        """
+        Return the time in seconds we want between price updates.
+        default is the interval given by our update_tick attribute
+        (see managers.PollScheduler), which we return unless a
+        strategy wants to poll faster or slower, e.g. close to the
+        start of a race.  This is asked again after every update.
+        """
+
+        return default
+
 class StrategyGroup(object):
     """Stores a group (i.e. one or more) of strategies."""
     
     def __init__(self):
         self.strategies = []
 
+        # incremented whenever strategies are added or removed, so
+        # that the pricing manager knows when to bring its schedule
+        # up to date.
+        self.version = 0
+
     def __len__(self):
         return len(self.strategies)
 
@@ -96,15 +240,18 @@ class StrategyGroup(object):
 
     def add(self, strategy):
         self.strategies.append(strategy)
+        self.version += 1
 
     def remove(self, strategy):
         try:
             self.strategies.remove(strategy)
+            self.version += 1
         except ValueError:
             print 'no strategy found to remove'
 
     def clear(self):
         self.strategies = []
+        self.version += 1
 
     def update_prices(self, prices):
         """Update all strategies in the group."""
@@ -118,16 +265,23 @@ class StrategyGroup(object):
         for strat in self.strategies:
             strat.update_orders(orders)
 
-    def update_prices_if(self, prices, attr='__dict__'):
+    def update_prices_if(self, prices, attr='__dict__', changed=None):
         """
         Update all strategies in group if attr of strategy is True.
 
         The default attribute will simply mean that all strategies are
-        updated.
+        updated.  If changed (set of (exid, mid, sid) of selections
+        whose prices changed) is given, strategies that can skip the
+        update (see Strategy.can_skip_update) are not updated, and we
+        set attr to False for them, so that we don't pick up their
+        orders again.
         """
 
         for strat in self.strategies:
             if getattr(strat, attr):
+                if (changed is not None) and strat.can_skip_update(changed):
+                    setattr(strat, attr, False)
+                    continue
                 strat.update_prices(prices)
 
     # not currently used (instead we are using get_orders_to_place_if)
@@ -164,6 +318,19 @@ class StrategyGroup(object):
         
         return toplace
 
+    def get_order_owners_if(self, attr='__dict__'):
+        """
+        Return dict mapping the id of each order object returned by
+        get_orders_to_place_if to the strategy that made it.
+        """
+
+        owners = {}
+        for strat in self.strategies:
+            if getattr(strat, attr):
+                for o, owner in strat.get_order_owners():
+                    owners[id(o)] = owner
+        return owners
+
     def get_orders_to_cancel_if(self, attr='__dict__'):
         """
         Return dictionary with keys that are the exchange ids, and
@@ -237,9 +404,28 @@ class StrategyGroup(object):
                                         format(s, str(strat)))
                     # remove strategy
                     self.strategies.remove(strat)
+                    self.version += 1
 
 class State(object):
-    """Base class - a state should inherit from this."""
+    """Base class - a state should inherit from this.
+
+    A derived class should set sid, the integer id of the state, and
+    check_conditions should return the id of the state to change to
+    (or None), e.g. the module constants in mmstrategy.py.  The ids of
+    the states of a StateMachine should be small integers, since they
+    index its table.
+
+    """
+
+    # id of the state; if None, the StateMachine gives the state the
+    # next free id when it is added.
+    sid = None
+
+    # set to True in a derived class if check_conditions depends only
+    # on the prices of the strategy's selections (and not e.g. on
+    # order status), so that the strategy need not be updated when
+    # these prices haven't changed.
+    pricesonly = False
     
     def __init__(self, name):
         self.name = name
@@ -256,44 +442,149 @@ class State(object):
     def exit_actions(self):
         pass
 
+def _hook(state, name):
+    """
+    Return bound method name of state, or None if it is the (empty)
+    method of the base class State, so that we needn't call it.
+    """
+
+    meth = getattr(state, name)
+    if getattr(meth, '__func__', None) is getattr(State, name).__func__:
+        return None
+    return meth
+
+class StateHistory(object):
+    """The most recent states visited by a StateMachine.
+
+    We keep only the last const.STATEHISTORY state ids (a strategy
+    that runs for days visits a lot of states), but count all of them,
+    so that a reader can ask for just the states visited since it
+    last looked.
+
+    """
+
+    def __init__(self, names, maxlen=None):
+        # list of state names, indexed by state id
+        self.names = names
+        self.ids = deque(maxlen=maxlen or const.STATEHISTORY)
+        # number of states ever visited
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, sid):
+        self.ids.append(sid)
+        self.count += 1
+
+    def since(self, start=0):
+        """
+        Return names of the states visited after the first start, or
+        as many of them as we still have.
+        """
+
+        skip = max(start - (self.count - len(self.ids)), 0)
+        return [self.names[i] for i in islice(self.ids, skip, None)]
+
 class StateMachine(object):
+    """Table driven state machine.
+
+    States are identified by their integer ids (see State.sid), which
+    index the table self._table.  The row of a state holds its
+    do_actions, check_conditions, entry_actions and exit_actions, or
+    None for any that the state doesn't override, and
+    check_conditions returns the id of the next state.  So stepping
+    the machine is a list lookup and calls to the methods that
+    actually do something, with no lookups by name, which matters
+    since we update thousands of strategies each tick.
+
+    set_state also takes a state name (looked up in self.ids), for
+    use outside the hot path, e.g. to set the initial state.
+
+    """
+
     def __init__(self):
+        # states keyed by name, and by id
         self.states = {}
+        self._states = []
+        # state ids keyed by name, and names by id
+        self.ids = {}
+        self.names = []
+        self._table = []
+
+        # id of active state
+        self.active = None
         self.active_state = None
 
-        # store ordered list of visited states
-        self.visited_states = []
+        # states visited, most recent last
+        self.history = StateHistory(self.names)
 
     def add_state(self, state):
+        sid = state.sid
+        if sid is None:
+            sid = state.sid = len(self._states)
+        while len(self._states) <= sid:
+            self._states.append(None)
+            self.names.append(None)
+            self._table.append(None)
         self.states[state.name] = state
+        self._states[sid] = state
+        self.ids[state.name] = sid
+        self.names[sid] = state.name
+        self._table[sid] = (_hook(state, 'do_actions'),
+                            _hook(state, 'check_conditions'),
+                            _hook(state, 'entry_actions'),
+                            _hook(state, 'exit_actions'))
 
     def update(self):
-        if self.active_state is None:
+        if self.active is None:
             return
 
-        self.active_state.do_actions()
+        t0 = metrics.clock()
+        do_actions, check_conditions = self._table[self.active][:2]
+        if do_actions is not None:
+            do_actions()
 
-        new_state_name = self.active_state.check_conditions()
+        if check_conditions is not None:
+            new_state = check_conditions()
+            if new_state is not None:
+                self.set_state(new_state)
+        _STATETIME.observe(metrics.clock() - t0)
 
-        if new_state_name is not None:
-            self.set_state(new_state_name)
+    def set_state(self, new_state):
+        """Change to state new_state (a state name or id)."""
 
-    def set_state(self, new_state_name):
-        if self.active_state is not None:
-            self.active_state.exit_actions()
+        if isinstance(new_state, basestring):
+            sid = self.ids[new_state]
+        else:
+            sid = new_state
 
+        if self.active is not None:
+            exit_actions = self._table[self.active][3]
+            if exit_actions is not None:
+                exit_actions()
 
-        cname = (self.active_state.name if
-                 self.active_state is not None else 'None')
+        self.history.append(sid)
 
-        # store new state in visited_states list
-        self.visited_states.append(new_state_name)
+        self.active = sid
+        self.active_state = self._states[sid]
+        entry_actions = self._table[sid][2]
+        if entry_actions is not None:
+            entry_actions()
 
-        self.active_state = self.states[new_state_name]
-        self.active_state.entry_actions()
+    @property
+    def visited_states(self):
+        return self.history.since()
 
     def get_num_visited_states(self):
-        return len(self.visited_states)
+        """Return number of states ever visited."""
+
+        return len(self.history)
+
+    def get_visited_states(self, start=0):
+        """
+        Return names of states visited after the first start (only
+        the last const.STATEHISTORY are kept).
+        """
 
-    def get_visited_states(self):
-        return self.visited_states
+        return self.history.since(start)
@@ -0,0 +1,122 @@
+# testrisk.py
+# James Mithen
+# jamesmithen@gmail.com
+
+"""Tests for the exposure checks of the RiskGate (see managers.py).
+
+Run with python testrisk.py.  We don't need the database or the
+exchanges: the order store is replaced by an OrderIndex, which is
+what keeps the positions.
+"""
+
+import unittest
+from betman import const, order
+from betman.core import managers
+from betman.core.stores.orderstore import OrderIndex
+
+class _OrderStore(object):
+    """The parts of OrderStore that RiskGate uses."""
+
+    def __init__(self):
+        self.orders = OrderIndex()
+
+    def get_exposure(self, exid, mid, sid):
+        return self.orders.exposure(exid, mid, sid)
+
+    def get_order_position(self, exid, oref):
+        return self.orders.order_position(exid, oref)
+
+class _PriceStore(object):
+    """Price store with no prices, so no price checks are made."""
+
+    def get_selection(self, exid, mid, sid):
+        return None
+
+def _empty():
+    return {const.BDAQID: [], const.BFID: []}
+
+def _orders(olist):
+    return {const.BDAQID: [], const.BFID: olist}
+
+class TestExposure(unittest.TestCase):
+
+    MID = 100
+    SID = 7
+
+    def setUp(self):
+        self.ostore = _OrderStore()
+        self.gate = managers.RiskGate(self.ostore, _PriceStore(),
+                                      clock=lambda: 0.0)
+        self.oref = 0
+
+    def new(self, polarity, price=3.0, stake=50.0):
+        return order.Order(const.BFID, self.SID, stake, price, polarity,
+                           mid=self.MID)
+
+    def place(self, o):
+        """Add order o to the store as placed and unmatched."""
+
+        self.oref += 1
+        o.oref = self.oref
+        o.status = order.UNMATCHED
+        o.matchedstake = 0.0
+        o.unmatchedstake = o.stake
+        self.ostore.orders.add(const.BFID, o.oref, o)
+
+    def match(self, o):
+        o.status = order.MATCHED
+        o.matchedstake = o.stake
+        o.unmatchedstake = 0.0
+        self.ostore.orders.add(const.BFID, o.oref, o)
+
+    def exposure(self):
+        return self.ostore.get_exposure(const.BFID, self.MID, self.SID)[0][2]
+
+    def test_unmatched_pairs_do_not_hedge(self):
+        # an unmatched back and lay could be matched one without the
+        # other, so the gate shouldn't let us stack them up.
+        passed = []
+        for i in range(10):
+            onew = [self.new(order.BACK), self.new(order.LAY)]
+            c, u, n = self.gate.check(_empty(), _empty(), _orders(onew))
+            for o in n[const.BFID]:
+                self.place(o)
+                passed.append(o)
+        self.assertTrue(self.exposure() <= self.gate.MAXSELLIABILITY)
+        # one lay of 50 at 3.0 risks 100 if the selection wins
+        self.assertTrue(len([o for o in passed
+                             if o.polarity == order.LAY]) <= 2)
+
+    def test_lays_matched_backs_not(self):
+        # put the orders straight in the store (bypassing the gate),
+        # then match only the lays: we lose 10 * 50 * (3 - 1) = 1000
+        # if the selection wins.
+        olist = []
+        for i in range(10):
+            for pol in [order.BACK, order.LAY]:
+                o = self.new(pol)
+                self.place(o)
+                olist.append(o)
+        self.assertAlmostEqual(self.exposure(), 1000.0)
+        for o in olist:
+            if o.polarity == order.LAY:
+                self.match(o)
+        self.assertAlmostEqual(self.exposure(), 1000.0)
+        # and the gate won't let us add to it
+        c, u, n = self.gate.check(_empty(), _empty(),
+                                  _orders([self.new(order.LAY, stake=2.0)]))
+        self.assertEqual(n[const.BFID], [])
+
+    def test_matched_round_trip_hedges(self):
+        for pol in [order.BACK, order.LAY]:
+            o = self.new(pol)
+            self.place(o)
+            self.match(o)
+        self.assertAlmostEqual(self.exposure(), 0.0)
+        # so a new pair within the limit passes
+        onew = [self.new(order.BACK), self.new(order.LAY)]
+        c, u, n = self.gate.check(_empty(), _empty(), _orders(onew))
+        self.assertEqual(len(n[const.BFID]), 2)
+
+if __name__ == '__main__':
+    unittest.main()